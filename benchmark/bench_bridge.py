@@ -0,0 +1,123 @@
+"""
+Throughput of the MQTT -> Kafka bridge (mqtt_bridge/bridge.py).
+
+Starts the fake MQTT broker (benchmark/fakes.py) in its own process with
+VerneMQ's per-client in-flight window, runs `--workers` bridge workers on a
+shared subscription with Quix Streams replaced by the in-process stand-in,
+whose delivery reports arrive `--kafka-latency-ms` after the produce, then
+injects `--messages` QoS 1 events spread over `--devices` topics
+(`devices/site-S/dev-D/telemetry`) and waits until every one is
+acknowledged. Needs paho-mqtt.
+
+Prints the acknowledged rate, the broker's counters and each worker's
+counts as JSON. Every PUBACK waits for a delivery report, so one worker
+moves at most `--max-inflight` messages per Kafka round trip; compare
+e.g. `--max-inflight 20` (VerneMQ's default) with `--max-inflight 1000`.
+
+Usage:
+    python benchmark/bench_bridge.py --workers 4 --messages 200000 --max-inflight 1000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(ROOT)
+sys.path.append(ROOT)
+
+import fakes  # noqa: E402
+
+
+def bench_worker(worker: int, config: dict, stop, results, delivery_delay_ms: float):
+    """A bridge worker with Quix Streams swapped for the in-process stand-in."""
+    sys.path.insert(0, os.path.join(REPO, "mqtt_bridge"))
+    os.environ["METRICS_PORT"] = "0"
+    fakes.FakeApplication.delivery_delay_ms = delivery_delay_ms
+    sys.modules["quixstreams"] = types.SimpleNamespace(Application=fakes.FakeApplication)
+    from bridge import run_worker
+
+    summary = run_worker(worker, config, stop)
+    produced = fakes.FakeApplication.broker.messages(config['kafka_topic'])
+    results.put({**summary, 'keys': len({key for key, _, _ in produced})})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--sites", type=int, default=10)
+    parser.add_argument("--max-inflight", type=int, default=20, help="per-client window of the fake broker")
+    parser.add_argument("--kafka-latency-ms", type=float, default=5, help="produce -> delivery report delay")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    topics = [f"devices/site-{d % args.sites}/dev-{d:05d}/telemetry" for d in range(args.devices)]
+    payloads = [json.dumps({'timestamp': f"2014-07-01 00:{m:02d}:00", 'value': 10000 + m}).encode('utf-8')
+                for m in range(60)]
+    config = {
+        'host': '127.0.0.1',
+        'mqtt_version': 4,
+        'qos': 1,
+        'topic_pattern': 'devices/{site}/{device}/#',
+        'key_template': '{site}.{device}',
+        'share_group': 'bench',
+        'client_id': 'bench-bridge',
+        'clean_session': True,
+        'session_expiry_s': 0,
+        'keepalive': 60,
+        'receive_maximum': args.max_inflight,
+        'topic_header': False,
+        'kafka_broker': 'fake',
+        'kafka_topic': 'bench-event-frames',
+        'linger_ms': 5,
+        'batch_size': 1_000_000,
+        'compression': 'lz4',
+        'delivery_attempts': 3,
+    }
+
+    ctx = multiprocessing.get_context("spawn")
+    with fakes.FakeMqttProcess(max_inflight=args.max_inflight) as broker:
+        config['port'] = broker.port
+        stop, results = ctx.Event(), ctx.Queue()
+        workers = [ctx.Process(target=bench_worker, args=(i, config, stop, results, args.kafka_latency_ms))
+                   for i in range(args.workers)]
+        for process in workers:
+            process.start()
+        deadline = time.monotonic() + 60
+        while broker.stats()['clients'] < args.workers:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Bridge workers did not connect")
+            time.sleep(0.05)
+        time.sleep(0.5)  # let the SUBSCRIBEs land
+
+        started = time.perf_counter()
+        broker.inject(topics, payloads, args.messages)
+        deadline = time.monotonic() + args.timeout
+        while (stats := broker.stats())['acked'] < args.messages and time.monotonic() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        summaries = sorted((results.get(timeout=60) for _ in workers), key=lambda s: s['worker'])
+        for process in workers:
+            process.join()
+
+    print(json.dumps({
+        'workers': args.workers,
+        'max_inflight': args.max_inflight,
+        'kafka_latency_ms': args.kafka_latency_ms,
+        'messages': args.messages,
+        'seconds': round(elapsed, 3),
+        'acked_rate': round(stats['acked'] / elapsed, 1),
+        'broker': stats,
+        'per_worker': summaries,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
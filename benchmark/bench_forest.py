@@ -0,0 +1,96 @@
+"""
+Compare sklearn's IsolationForest against the compiled flat-array forest.
+
+Reports single-row and batched latency for both backends and checks that
+their scores agree. Without --model, a forest is fitted on the demo data
+with the notebook's parameters (contamination=0.005, n_estimators=200,
+max_samples=0.7).
+
+Usage:
+    python benchmark/bench_forest.py [--model subscribe_ml/isolation_forest_model.joblib] [--batch 500]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "subscribe_ml"))
+
+from features import FEATURE_COLUMNS, FeatureState  # noqa: E402
+from forest import CompiledForest  # noqa: E402
+
+
+def load_features(csv_path: str) -> pd.DataFrame:
+    """Run the demo data through the streaming feature state."""
+    df = pd.read_csv(csv_path, parse_dates=['timestamp'])
+    state = FeatureState()
+    rows = []
+    for ts, value in zip(df['timestamp'], df['value'].tolist()):
+        _, features = state.update({'timestamp_ms': int(ts.timestamp() * 1000), 'value': value})
+        if features is not None:
+            rows.append(features)
+    return pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+
+
+def timed(func, repeat: int) -> float:
+    """Median wall time of `func()` in microseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples) * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="joblib IsolationForest; fitted on the demo data if omitted")
+    parser.add_argument("--csv", default=os.path.join(ROOT, "demo_data", "nyc_taxi.csv"))
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    X = load_features(args.csv)
+    if args.model:
+        import joblib
+        model = joblib.load(args.model)
+    else:
+        from sklearn.ensemble import IsolationForest
+        model = IsolationForest(random_state=0, contamination=0.005, n_estimators=200, max_samples=0.7).fit(X)
+
+    start = time.perf_counter()
+    compiled = CompiledForest.from_sklearn(model)
+    compile_ms = (time.perf_counter() - start) * 1000
+
+    single_df, batch_df = X.iloc[:1], X.iloc[:args.batch]
+    single_rows, batch_rows = single_df.values.tolist(), batch_df.values.tolist()
+
+    results = {
+        "n_estimators": compiled.n_estimators,
+        "nodes": int(len(compiled.feature)),
+        "compile_ms": round(compile_ms, 2),
+        "batch_size": len(batch_df),
+        "sklearn_single_us": timed(lambda: model.decision_function(single_df), args.repeat),
+        "compiled_single_us": timed(lambda: compiled.decision_function(single_rows), args.repeat),
+        "sklearn_batch_us": timed(lambda: model.decision_function(batch_df), args.repeat),
+        "compiled_batch_us": timed(lambda: compiled.decision_function(batch_rows), args.repeat),
+        "max_abs_score_diff": float(np.abs(model.decision_function(X) - compiled.decision_function(X.values)).max()),
+        "predict_mismatches": int((model.predict(X) != compiled.predict(X.values)).sum()),
+    }
+    # Every other row with one feature missing: both must route NaN the same way
+    gappy = X.copy()
+    gappy.iloc[::2, 0] = np.nan
+    results["missing_max_abs_score_diff"] = float(
+        np.abs(model.decision_function(gappy) - compiled.decision_function(gappy.values)).max())
+    results["speedup_single"] = round(results["sklearn_single_us"] / results["compiled_single_us"], 1)
+    results["speedup_batch"] = round(results["sklearn_batch_us"] / results["compiled_batch_us"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
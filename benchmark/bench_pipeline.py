@@ -0,0 +1,286 @@
+"""
+End-to-end pipeline benchmark without the docker-compose stack.
+
+Imports the three services with Quix Streams replaced by an in-process
+stand-in (benchmark/fakes.py) and InfluxDB replaced by a local fake HTTP
+endpoint, replays demo_data/nyc_taxi.csv at the requested scale and drives
+each stage's processing function:
+
+- publish:  replay.build_payloads + producer.produce
+- ml:       decode + handle_message and its InfluxAnomalySink (or handle_batch
+            with --ml-batch-size) + the InfluxDB sink flush
+- influx:   decode + process_event + sink add, then the sink flush
+
+Prints msgs/s, p50/p95/p99 per-call latency, CPU time and peak RSS per stage
+as JSON. With --baseline, exits 1 if any stage's throughput dropped by more
+than --tolerance against a previous result.
+
+Usage:
+    python benchmark/bench_pipeline.py --scale 4 --output baseline.json
+    python benchmark/bench_pipeline.py --scale 4 --baseline baseline.json --tolerance 0.2
+    python benchmark/bench_pipeline.py --influx-latency-ms 50 --influx-batch-size 500 --influx-writer async
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(ROOT)
+sys.path.append(ROOT)
+
+import fakes  # noqa: E402
+
+sys.path.append(REPO)
+from common.wire import decode  # noqa: E402
+
+INPUT_TOPIC = "bench-event-frames"
+ML_TOPIC = "bench-taxi-demand-anomalies"
+
+
+def load_service(name: str, env: dict):
+    """Import <service>/main.py under a unique module name with the fakes in place."""
+    service_dir = os.path.join(REPO, name)
+    if service_dir not in sys.path:
+        sys.path.insert(0, service_dir)
+    os.environ.update(env)
+    spec = importlib.util.spec_from_file_location(f"{name}_main", os.path.join(service_dir, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def fit_model(csv_path: str, path: str):
+    """Fit the notebook's forest on the demo data's streaming features."""
+    import joblib
+    from sklearn.ensemble import IsolationForest
+
+    sys.path.insert(0, os.path.join(REPO, "subscribe_ml"))
+    from features import FEATURE_COLUMNS, FeatureState
+
+    df = pd.read_csv(csv_path, parse_dates=['timestamp'])
+    state, rows = FeatureState(), []
+    for ts, value in zip(df['timestamp'], df['value'].tolist()):
+        _, features = state.update({'timestamp_ms': int(ts.timestamp() * 1000), 'value': value})
+        if features is not None:
+            rows.append(features)
+    X = pd.DataFrame(rows, columns=FEATURE_COLUMNS)
+    model = IsolationForest(random_state=0, contamination=0.005, n_estimators=200, max_samples=0.7).fit(X)
+    joblib.dump(model, path)
+
+
+class Stage:
+    """Collects per-call latencies, wall and CPU time for one stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies = []
+        self.messages = 0
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wall = time.perf_counter() - self.wall
+        self.cpu = time.process_time() - self.cpu
+
+    def report(self, **extra) -> dict:
+        lat = np.array(self.latencies) * 1e6
+        result = {
+            'messages': self.messages,
+            'seconds': round(self.wall, 4),
+            'msgs_per_s': round(self.messages / self.wall, 1) if self.wall else None,
+            'cpu_seconds': round(self.cpu, 4),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+        if len(lat):
+            for q in (50, 95, 99):
+                result[f'p{q}_us'] = round(float(np.percentile(lat, q)), 2)
+        result.update(extra)
+        return result
+
+
+def build_streams(publisher, csv_path: str, scale: int, rows: int, wire_format: str = "json"):
+    """One (key, payloads, timestamps) stream per virtual device."""
+    from loadgen import device_frame
+
+    template = pd.read_csv(csv_path, parse_dates=['timestamp'])
+    if rows:
+        template = template.iloc[:rows]
+    streams = []
+    for device in range(scale):
+        frame = template if device == 0 else device_frame(template, device, 0, 60 * 24 * 7, 0.3, 0.05, 0.001, 3.0)
+        payloads, timestamps_ms = publisher.build_payloads(frame, wire_format)
+        streams.append((f"DEVICE_{device:05d}", payloads, timestamps_ms))
+    return streams
+
+
+def run_publish(publisher, streams) -> dict:
+    producer = publisher.app.get_producer()
+    topic = publisher.output_topic.name
+    stage = Stage("publish")
+    perf = time.perf_counter
+    with stage, producer:
+        for row in range(len(streams[0][1])):
+            for key, payloads, timestamps_ms in streams:
+                start = perf()
+                producer.produce(topic=topic, key=key, value=payloads[row], timestamp=timestamps_ms[row])
+                stage.latencies.append(perf() - start)
+        stage.messages = sum(len(s[1]) for s in streams)
+    return stage.report()
+
+
+def run_ml(ml, messages, batch_size: int, influx) -> dict:
+    before = influx.stats()
+    stage = Stage("ml")
+    perf = time.perf_counter
+    with stage:
+        if batch_size <= 1:
+            states = {}
+            # What Quix does with the StreamingDataFrame's output, flushed at the end as one checkpoint
+            sink = ml.InfluxAnomalySink()
+            for offset, (key, value, timestamp) in enumerate(messages):
+                start = perf()
+                row_data = decode(value)
+                state = states.get(key)
+                if state is None:
+                    state = states[key] = fakes.FakeState()
+                row = ml.handle_message(row_data, key, timestamp, None, state)
+                if row is not None:
+                    sink.add(row, key, timestamp, None, INPUT_TOPIC, 0, offset)
+                stage.latencies.append(perf() - start)
+            sink.flush()
+        else:
+            states = {}
+            for i in range(0, len(messages), batch_size):
+                start = perf()
+                batch = [(key, decode(value)) for key, value, _ in messages[i:i + batch_size]]
+                ml.handle_batch(batch, states)
+                stage.latencies.append(perf() - start)
+        ml.influx_sink.flush()
+        stage.messages = len(messages)
+    after = influx.stats()
+    return stage.report(latency_unit='batch' if batch_size > 1 else 'message',
+                        influx_points=after['points'] - before['points'],
+                        influx_requests=after['requests'] - before['requests'])
+
+
+def run_influx(sink_service, messages, influx) -> dict:
+    before = influx.stats()
+    stage = Stage("influx")
+    perf = time.perf_counter
+    sink = sink_service.influx_sink
+    with stage:
+        for offset, (key, value, timestamp) in enumerate(messages):
+            start = perf()
+            sink.add(sink_service.process_event(decode(value)))
+            sink.track(INPUT_TOPIC, 0, offset)
+            sink.poll()
+            stage.latencies.append(perf() - start)
+        sink.flush()
+        stage.messages = len(messages)
+    after = influx.stats()
+    return stage.report(influx_points=after['points'] - before['points'],
+                        influx_requests=after['requests'] - before['requests'])
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Stages whose throughput fell below baseline * (1 - tolerance)."""
+    regressions = []
+    for name, stage in results['stages'].items():
+        old = baseline.get('stages', {}).get(name, {}).get('msgs_per_s')
+        if old and stage['msgs_per_s'] < old * (1 - tolerance):
+            regressions.append(f"{name}: {stage['msgs_per_s']} msgs/s < {old} msgs/s - {tolerance:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=os.path.join(REPO, "demo_data", "nyc_taxi.csv"))
+    parser.add_argument("--scale", type=int, default=1, help="number of virtual devices replaying the CSV")
+    parser.add_argument("--rows", type=int, default=0, help="limit rows per device, 0 = whole file")
+    parser.add_argument("--model", help="joblib IsolationForest; fitted on the demo data if omitted")
+    parser.add_argument("--ml-backend", default="sklearn", choices=["sklearn", "compiled"])
+    parser.add_argument("--ml-batch-size", type=int, default=1)
+    parser.add_argument("--ml-detector", default="forest", choices=["forest", "online", "cascade", "shadow"],
+                        help="online detector mode (subscribe_ml/online.py)")
+    parser.add_argument("--wire-format", default="json", choices=["json", "binary"],
+                        help="encoding of both topics (common/wire.py)")
+    parser.add_argument("--influx-batch-size", type=int, default=5000)
+    parser.add_argument("--influx-latency-ms", type=float, default=0)
+    parser.add_argument("--influx-writer", default="thread", choices=["thread", "async"])
+    parser.add_argument("--influx-max-in-flight", type=int, default=4, help="concurrent writes with --influx-writer async")
+    parser.add_argument("--output", help="write the JSON result to this file")
+    parser.add_argument("--baseline", help="previous JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    # Per-message INFO logs would dominate the numbers and the output
+    logging.basicConfig(level=logging.WARNING)
+    import quixstreams
+    quixstreams.Application = fakes.FakeApplication
+
+    with fakes.FakeInfluxProcess(args.influx_latency_ms) as influx, tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model
+        if not model_path:
+            model_path = os.path.join(tmp, "isolation_forest_model.joblib")
+            fit_model(args.csv, model_path)
+
+        env = {
+            'LOG_LEVEL': 'WARNING',
+            'METRICS_PORT': '0',
+            'KAFKA_INPUT_TOPIC': INPUT_TOPIC,
+            'KAFKA_ML_TOPIC': ML_TOPIC,
+            'INFLUX_URL': influx.url,
+            'INFLUX_TOKEN': 'bench',
+            'INFLUX_ORG': 'bench',
+            'INFLUX_BUCKET': 'bench',
+            'INFLUX_BATCH_SIZE': str(args.influx_batch_size),
+            'INFLUX_WRITER': args.influx_writer,
+            'INFLUX_MAX_IN_FLIGHT': str(args.influx_max_in_flight),
+            'ML_MODEL_PATH': model_path,
+            'ML_BACKEND': args.ml_backend,
+            'ML_DETECTOR': args.ml_detector,
+            'WIRE_FORMAT': args.wire_format,
+            'DELAY_DATA_INGEST_SECOND': '0',
+        }
+        publisher = load_service("publish_csv_kafka", env)
+        ml = load_service("subscribe_ml", env)
+        sink_service = load_service("subscribe_to_influx", env)
+
+        streams = build_streams(publisher, args.csv, args.scale, args.rows, args.wire_format)
+        stages = {'publish': run_publish(publisher, streams)}
+        messages = fakes.FakeApplication.broker.messages(INPUT_TOPIC)
+        stages['ml'] = run_ml(ml, messages, args.ml_batch_size, influx)
+        stages['influx'] = run_influx(sink_service, messages, influx)
+
+    results = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'stages': stages,
+        'ml_topic_messages': len(fakes.FakeApplication.broker.messages(ML_TOPIC)),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
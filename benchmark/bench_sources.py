@@ -0,0 +1,103 @@
+"""
+Time to first message and peak memory of the publisher's input sources.
+
+Writes the demo data tiled to `--rows` rows (shifted in time per copy) as
+CSV, Parquet and Arrow files, then, each in a fresh process, reads them
+the old way (`pd.read_csv` of the whole file) and through
+publish_csv_kafka/sources.py, serializing every chunk with
+`build_payloads`. Reports the time until the first payload, the total
+time and the peak RSS as JSON; run it with two `--rows` values to see
+which of them grow with the file.
+
+Usage:
+    python benchmark/bench_sources.py --rows 1000000 5000000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(ROOT)
+PUBLISHER = os.path.join(REPO, "publish_csv_kafka")
+
+
+def write_inputs(template: pd.DataFrame, rows: int, directory: str) -> dict:
+    copies = -(-rows // len(template))
+    span = template['timestamp'].iloc[-1] - template['timestamp'].iloc[0] + pd.Timedelta(minutes=30)
+    timestamps = np.concatenate([(template['timestamp'] + span * i).to_numpy() for i in range(copies)])[:rows]
+    values = np.tile(template['value'].to_numpy(), copies)[:rows]
+    df = pd.DataFrame({'timestamp': timestamps, 'value': values})
+    paths = {fmt: os.path.join(directory, f"input-{rows}.{fmt}") for fmt in ('csv', 'parquet', 'arrow')}
+    df.to_csv(paths['csv'], index=False)
+    df.to_parquet(paths['parquet'], index=False, row_group_size=100_000)
+    df.to_feather(paths['arrow'], compression='uncompressed', chunksize=100_000)
+    return paths
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process; unlike ru_maxrss, VmHWM does not carry the parent's peak over a spawn."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read(path: str, whole: bool, chunk_rows: int) -> dict:
+    sys.path.insert(0, PUBLISHER)
+    from replay import build_payloads
+    from sources import open_source
+
+    started = time.perf_counter()
+    first, rows = None, 0
+    if whole:
+        chunks = [pd.read_csv(path, parse_dates=['timestamp'])]
+    else:
+        chunks = open_source(path, chunk_rows=chunk_rows).chunks()
+    for chunk in chunks:
+        payloads, _ = build_payloads(chunk)
+        if first is None:
+            first = time.perf_counter() - started
+        rows += len(payloads)
+    return {'rows': rows,
+            'first_message_s': round(first, 3),
+            'total_s': round(time.perf_counter() - started, 3),
+            'peak_rss_mb': round(peak_rss_mb(), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=os.path.join(REPO, "demo_data", "nyc_taxi.csv"))
+    parser.add_argument("--rows", type=int, nargs='+', default=[1_000_000])
+    parser.add_argument("--chunk-rows", type=int, default=50_000)
+    args = parser.parse_args()
+
+    template = pd.read_csv(args.csv, parse_dates=['timestamp'])
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            paths = write_inputs(template, rows, tmp)
+            cases = {'csv_whole': (paths['csv'], True), 'csv_chunked': (paths['csv'], False),
+                     'parquet': (paths['parquet'], False), 'arrow': (paths['arrow'], False)}
+            results[rows] = {}
+            for name, (path, whole) in cases.items():
+                with ctx.Pool(1) as pool:
+                    results[rows][name] = pool.apply(read, (path, whole, args.chunk_rows))
+                results[rows][name]['file_mb'] = round(os.path.getsize(path) / 1e6, 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
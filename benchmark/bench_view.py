@@ -0,0 +1,98 @@
+"""
+Ingest rate and query latency of subscribe_view's materialized view.
+
+Feeds the demo data's values under `--keys` keys (each key a copy shifted
+by a few minutes, with made-up scores and ~1% outliers) into a
+`MaterializedView` and reports the cost per added row, the view's memory,
+and the p50/p99 latency of each query, for all keys and for one key.
+
+Usage:
+    python benchmark/bench_view.py [--keys 50] [--retention-hours 168] [--queries 500]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "subscribe_view"))
+
+from view import MaterializedView  # noqa: E402
+
+
+def scored_rows(df: pd.DataFrame, keys: int, seed: int = 0) -> list:
+    """(key, row) pairs in event-time order, interleaved across keys."""
+    rng = np.random.default_rng(seed)
+    timestamps = df['timestamp'].to_numpy().astype('datetime64[ms]').astype(np.int64)
+    values = df['value'].to_numpy(dtype=float)
+    pairs = []
+    for k in range(keys):
+        shift = k * 60_000
+        scores = rng.normal(0.1, 0.05, len(df))
+        outliers = rng.random(len(df)) < 0.01
+        scores[outliers] = -rng.random(outliers.sum()) * 0.2
+        pairs.extend((int(t) + shift, f"device-{k:04d}", float(v), float(s), 1.0 if o else 0.0)
+                     for t, v, s, o in zip(timestamps, values, scores, outliers))
+    pairs.sort(key=lambda p: p[0])
+    return [(key, {'timestamp_ms': t, 'value': v, 'Score': s, 'Outliers': o}) for t, key, v, s, o in pairs]
+
+
+def latency(func, queries: int) -> dict:
+    """p50/p99 of `func()` in microseconds, plus the size of its last answer."""
+    times = []
+    for _ in range(queries):
+        start = time.perf_counter()
+        rows = func()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1e6
+    return {'p50_us': round(float(np.percentile(times, 50)), 1),
+            'p99_us': round(float(np.percentile(times, 99)), 1),
+            'rows': len(rows)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=os.path.join(ROOT, "demo_data", "nyc_taxi.csv"))
+    parser.add_argument("--keys", type=int, default=50)
+    parser.add_argument("--retention-hours", type=float, default=7 * 24)
+    parser.add_argument("--max-rows", type=int, default=10_000_000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, parse_dates=['timestamp'])
+    rows = scored_rows(df, args.keys)
+    view = MaterializedView(retention_ms=int(args.retention_hours * 3600 * 1000), max_rows=args.max_rows)
+    start = time.perf_counter()
+    for key, row in rows:
+        view.add(key, row)
+    view.expire()
+    ingest = time.perf_counter() - start
+
+    one = rows[-1][0]
+    last_hour = view.since_hours(1)
+    last_day = view.since_hours(24)
+    queries = {
+        'recent_1h': lambda: view.recent(last_hour),
+        'recent_24h_key': lambda: view.recent(last_day, one),
+        'lowest_10': lambda: view.lowest(10),
+        'lowest_10_24h': lambda: view.lowest(10, last_day),
+        'lowest_10_key': lambda: view.lowest(10, key=one),
+        'outliers_24h': lambda: view.outliers(last_day),
+        'outliers_24h_key': lambda: view.outliers(last_day, one),
+    }
+    results = {
+        'rows_in': len(rows),
+        'add_us': round(ingest / len(rows) * 1e6, 3),
+        'view': view.stats(),
+        'queries': {name: latency(func, args.queries) for name, func in queries.items()},
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
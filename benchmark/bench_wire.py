@@ -0,0 +1,99 @@
+"""
+Compare the JSON and binary wire formats (common/wire.py).
+
+Builds the publisher's event messages and subscribe_ml's scored rows from
+the demo data, then reports bytes per message and the per-message encode
+and decode cost of each format on both topics, and checks that every binary
+message decodes to the same dict as its JSON counterpart.
+
+Usage:
+    python benchmark/bench_wire.py [--rows 5000] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "subscribe_ml"))
+sys.path.append(os.path.join(ROOT, "publish_csv_kafka"))
+
+from common.wire import ANOMALY, BINARY_FORMAT, EVENT, JSON_FORMAT, decode, encode  # noqa: E402
+from features import Baseline, FeatureState, feature_frame  # noqa: E402
+from replay import build_payloads  # noqa: E402
+
+
+def scored_rows(df: pd.DataFrame) -> list:
+    """subscribe_ml's published rows for the demo data, with a baseline and a made-up score."""
+    baseline = Baseline.fit(feature_frame(df).dropna())
+    state, rows = FeatureState(), []
+    for row in (json.loads(p) for p in build_payloads(df)[0]):
+        current_row, features = state.update(row, baseline)
+        if features is not None:
+            current_row['Outliers'] = 0.0
+            current_row['Score'] = 0.1 - abs(current_row['Deviation']) / 1e5
+            rows.append(current_row)
+    return rows
+
+
+def timed(func, items: list, repeat: int) -> float:
+    """Best per-item wall time of `func` over `items`, in microseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1e6
+
+
+def measure(rows: list, topic: str, repeat: int) -> dict:
+    result = {}
+    for wire_format in (JSON_FORMAT, BINARY_FORMAT):
+        messages = [encode(row, topic, wire_format) for row in rows]
+        decoded = [decode(m) for m in messages]
+        assert decoded == [json.loads(json.dumps(row)) for row in rows], f"{wire_format} round trip differs"
+        result[wire_format] = {
+            'bytes_per_msg': round(float(np.mean([len(m) for m in messages])), 1),
+            'encode_us': round(timed(lambda row: encode(row, topic, wire_format), rows, repeat), 3),
+            'decode_us': round(timed(decode, messages, repeat), 3),
+        }
+    result['bytes_saved'] = f"{1 - result[BINARY_FORMAT]['bytes_per_msg'] / result[JSON_FORMAT]['bytes_per_msg']:.0%}"
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--csv", default=os.path.join(ROOT, "demo_data", "nyc_taxi.csv"))
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv, parse_dates=['timestamp'])
+    if args.rows:
+        df = df.iloc[:args.rows]
+    events = [json.loads(p) for p in build_payloads(df)[0]]
+
+    # Publisher side: whole-file vectorized build, per message
+    build = {}
+    for wire_format in (JSON_FORMAT, BINARY_FORMAT):
+        start = time.perf_counter()
+        build_payloads(df, wire_format)
+        build[wire_format] = round((time.perf_counter() - start) / len(df) * 1e6, 3)
+
+    results = {
+        'rows': len(df),
+        'build_payloads_us': build,
+        EVENT: measure(events, EVENT, args.repeat),
+        ANOMALY: measure(scored_rows(df), ANOMALY, args.repeat),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,551 @@
+"""
+In-process stand-ins for Kafka/Quix Streams and the InfluxDB write API.
+
+`FakeApplication` replaces `quixstreams.Application` so the services' main
+modules can be imported without a broker; produced messages land in an
+`InMemoryBroker`. `FakeInfluxServer` is a real HTTP server on localhost that
+accepts (optionally gzip-compressed) line-protocol writes and counts them.
+`FakeMqttBroker` is a real MQTT 3.1.1 broker on localhost, small enough to
+read, with shared subscriptions and a per-client in-flight window.
+"""
+import asyncio
+import gzip
+import http.server
+import json
+import multiprocessing
+import struct
+import threading
+import time
+import urllib.request
+from collections import defaultdict, deque
+
+
+class InMemoryBroker:
+    """Topic name -> list of (key, value, timestamp_ms) in produce order."""
+
+    def __init__(self):
+        self.topics = defaultdict(list)
+
+    def messages(self, topic: str) -> list:
+        return self.topics[topic]
+
+
+class FakeTopic:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeProducer:
+    """
+    Delivery reports are immediate, or with `delivery_delay_ms` held back
+    until a `poll()`/`flush()` at least that long after the produce, like
+    a real producer waiting for the broker's acknowledgement.
+    """
+
+    def __init__(self, broker: InMemoryBroker, delivery_delay_ms: float = 0):
+        self.broker = broker
+        self.delay = delivery_delay_ms / 1000.0
+        self.pending = deque()  # (due, on_delivery)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def produce(self, topic, value=None, key=None, headers=None, partition=None,
+                timestamp=None, on_delivery=None, **kwargs):
+        self.broker.topics[topic].append((key, value, timestamp))
+        if on_delivery is None:
+            return
+        if self.delay:
+            self.pending.append((time.monotonic() + self.delay, on_delivery))
+        else:
+            on_delivery(None, None)
+
+    def poll(self, timeout: float = 0):
+        deadline = time.monotonic() + (timeout or 0)
+        served = 0
+        while True:
+            now = time.monotonic()
+            while self.pending and self.pending[0][0] <= now:
+                self.pending.popleft()[1](None, None)
+                served += 1
+            if served or now >= deadline:
+                return served
+            time.sleep(min(0.001, deadline - now))
+
+    def flush(self, timeout: float = None):
+        while self.pending:
+            self.poll(0.01)
+        return 0
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class FakeState:
+    """Dict-backed replacement for a Quix Streams `State`."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def exists(self, key) -> bool:
+        return key in self.data
+
+
+class FakeApplication:
+    """Accepts the same constructor arguments as `quixstreams.Application`."""
+
+    broker = InMemoryBroker()
+    delivery_delay_ms = 0
+
+    def __init__(self, *args, **kwargs):
+        self.config = kwargs
+
+    def topic(self, name: str, **kwargs) -> FakeTopic:
+        return FakeTopic(name)
+
+    def get_producer(self, *args, **kwargs) -> FakeProducer:
+        return FakeProducer(self.broker, self.delivery_delay_ms)
+
+    def get_consumer(self, *args, **kwargs):
+        raise NotImplementedError("The benchmark drives processing functions directly")
+
+    def dataframe(self, *args, **kwargs):
+        raise NotImplementedError("The benchmark drives processing functions directly")
+
+    def run(self, *args, **kwargs):
+        raise NotImplementedError("The benchmark drives processing functions directly")
+
+
+class FakeInfluxServer:
+    """
+    Minimal InfluxDB v2 write endpoint on 127.0.0.1. Records the number of
+    requests, points and (uncompressed) bytes; `latency_ms` delays each reply
+    and `fail()` makes the next writes fail.
+    """
+
+    def __init__(self, latency_ms: float = 0, status: int = 204):
+        self.requests = 0
+        self.points = 0
+        self.bytes = 0
+        self.bodies = []
+        self.keep_bodies = False
+        self.latency = latency_ms / 1000.0
+        self.status = status
+        self.failures = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    failure = server.failures.pop(0) if server.failures else None
+                if failure is not None:
+                    status, retry_after = failure
+                    self.send_response(status)
+                    if retry_after is not None:
+                        self.send_header('Retry-After', str(retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                with server._lock:
+                    server.requests += 1
+                    server.points += body.count(b'\n') + (1 if body and not body.endswith(b'\n') else 0)
+                    server.bytes += len(body)
+                    if server.keep_bodies:
+                        server.bodies.append(body.decode('utf-8'))
+                self.send_response(server.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path.startswith('/stats'):
+                    body = json.dumps(server.stats()).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                # /ping and /health
+                self.send_response(204)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'requests': self.requests, 'points': self.points, 'bytes': self.bytes}
+
+    def fail(self, status: int = 503, count: int = 1, retry_after=None):
+        """Answer the next `count` writes with `status` (and a Retry-After header) without storing them."""
+        with self._lock:
+            self.failures += [(status, retry_after)] * count
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _serve(latency_ms: float, ready):
+    server = FakeInfluxServer(latency_ms=latency_ms)
+    ready.put(server.url)
+    server.httpd.serve_forever()
+
+
+class FakeInfluxProcess:
+    """
+    Runs a FakeInfluxServer in a child process, so its CPU time is not
+    counted against the code being benchmarked. Counters come from GET /stats.
+    """
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency_ms = latency_ms
+        self.url = None
+        self.process = None
+
+    def __enter__(self):
+        ctx = multiprocessing.get_context("spawn")
+        ready = ctx.Queue()
+        self.process = ctx.Process(target=_serve, args=(self.latency_ms, ready), daemon=True)
+        self.process.start()
+        self.url = ready.get(timeout=30)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.process.terminate()
+        self.process.join()
+
+    def stats(self) -> dict:
+        with urllib.request.urlopen(self.url + '/stats') as response:
+            return json.loads(response.read())
+
+
+# --- MQTT --------------------------------------------------------------------
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK = 1, 2, 3, 4, 8, 9
+UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 10, 11, 12, 13, 14
+
+
+def mqtt_packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    length, header = len(body), bytearray([packet_type << 4 | flags])
+    while True:
+        byte, length = length & 0x7F, length >> 7
+        header.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(header) + body
+
+
+def mqtt_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return struct.pack('>H', len(data)) + data
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels, levels = topic_filter.split('/'), topic.split('/')
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(levels) or (level != '+' and level != levels[i]):
+            return False
+    return len(filter_levels) == len(levels)
+
+
+class _MqttSession:
+    def __init__(self, client_id: str, writer):
+        self.client_id = client_id
+        self.writer = writer
+        self.subscriptions = {}  # filter -> (group or None, qos)
+        self.inflight = {}  # packet id -> (topic, payload, group)
+        self.queue = deque()  # (topic, payload) of plain subscriptions waiting for the window
+        self.next_id = 1
+
+
+class _SharedGroup:
+    def __init__(self):
+        self.members = []
+        self.backlog = deque()
+        self.turn = 0
+
+
+class FakeMqttBroker:
+    """
+    MQTT 3.1.1 broker on 127.0.0.1 (CONNECT, PUBLISH QoS 0/1, SUBSCRIBE
+    incl. `$share/<group>/<filter>`, PINGREQ). A client holds at most
+    `max_inflight` unacknowledged QoS 1 messages, like VerneMQ's
+    `max_inflight_messages`; the rest wait. Shared groups hand each message
+    to one member, and the unacknowledged messages of a member that
+    disconnects go back to its group. Sessions are always clean.
+
+    `inject()` publishes from inside the broker, so a benchmark needs no
+    publisher clients; `stats()` counts what went through.
+    """
+
+    def __init__(self, max_inflight: int = 20):
+        self.max_inflight = max_inflight
+        self.sessions = set()
+        self.writers = set()
+        self.groups = defaultdict(_SharedGroup)
+        self.counts = {'published': 0, 'delivered': 0, 'acked': 0, 'requeued': 0}
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self._client, '127.0.0.1', 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _shutdown(self):
+        # Closing the connections ends each client's read loop
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return self._call(lambda: {**self.counts,
+                                   'backlog': sum(len(g.backlog) for g in self.groups.values()),
+                                   'inflight': sum(len(s.inflight) for s in self.sessions),
+                                   'clients': len(self.sessions)})
+
+    def inject(self, topics: list, payloads: list, count: int, qos: int = 1):
+        """Publish `count` messages, cycling through `topics` and `payloads`."""
+        def publish():
+            for i in range(count):
+                self._route(topics[i % len(topics)], payloads[i % len(payloads)], qos)
+        self._call(publish)
+
+    def _call(self, func):
+        return asyncio.run_coroutine_threadsafe(self._run(func), self.loop).result()
+
+    @staticmethod
+    async def _run(func):
+        return func()
+
+    # --- protocol -------------------------------------------------------------
+
+    async def _client(self, reader, writer):
+        session = None
+        self.writers.add(writer)
+        try:
+            while True:
+                first = await reader.readexactly(1)
+                length, shift = 0, 0
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length |= (byte & 0x7F) << shift
+                    shift += 7
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length) if length else b''
+                packet_type, flags = first[0] >> 4, first[0] & 0x0F
+                if packet_type == CONNECT:
+                    name_length = struct.unpack_from('>H', body, 0)[0]
+                    offset = 2 + name_length + 4
+                    id_length = struct.unpack_from('>H', body, offset)[0]
+                    session = _MqttSession(body[offset + 2:offset + 2 + id_length].decode('utf-8'), writer)
+                    self.sessions.add(session)
+                    writer.write(mqtt_packet(CONNACK, 0, b'\x00\x00'))
+                elif packet_type == PUBLISH:
+                    qos = (flags >> 1) & 0x03
+                    topic_length = struct.unpack_from('>H', body, 0)[0]
+                    topic = body[2:2 + topic_length].decode('utf-8')
+                    offset = 2 + topic_length
+                    if qos:
+                        writer.write(mqtt_packet(PUBACK, 0, body[offset:offset + 2]))
+                        offset += 2
+                    self._route(topic, body[offset:], qos)
+                elif packet_type == PUBACK:
+                    self._acked(session, struct.unpack_from('>H', body, 0)[0])
+                elif packet_type == SUBSCRIBE:
+                    granted, offset = bytearray(), 2
+                    while offset < len(body):
+                        filter_length = struct.unpack_from('>H', body, offset)[0]
+                        topic_filter = body[offset + 2:offset + 2 + filter_length].decode('utf-8')
+                        qos = body[offset + 2 + filter_length] & 0x03
+                        offset += 3 + filter_length
+                        self._subscribe(session, topic_filter, min(qos, 1))
+                        granted.append(min(qos, 1))
+                    writer.write(mqtt_packet(SUBACK, 0, body[:2] + bytes(granted)))
+                    self._pump(session)
+                elif packet_type == UNSUBSCRIBE:
+                    offset = 2
+                    while offset < len(body):
+                        filter_length = struct.unpack_from('>H', body, offset)[0]
+                        self._unsubscribe(session, body[offset + 2:offset + 2 + filter_length].decode('utf-8'))
+                        offset += 2 + filter_length
+                    writer.write(mqtt_packet(UNSUBACK, 0, body[:2]))
+                elif packet_type == PINGREQ:
+                    writer.write(mqtt_packet(PINGRESP, 0, b''))
+                elif packet_type == DISCONNECT:
+                    break
+                # Let the client's window drain before reading more from it
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if session is not None:
+                self._drop(session)
+            self.writers.discard(writer)
+            writer.close()
+
+    # --- routing ---------------------------------------------------------------
+
+    def _subscribe(self, session, topic_filter: str, qos: int):
+        group = None
+        if topic_filter.startswith('$share/'):
+            _, group, topic_filter = topic_filter.split('/', 2)
+            group = (group, topic_filter)
+            if session not in self.groups[group].members:
+                self.groups[group].members.append(session)
+        session.subscriptions[topic_filter if group is None else group] = (group, qos)
+
+    def _unsubscribe(self, session, topic_filter: str):
+        if topic_filter.startswith('$share/'):
+            _, group, topic_filter = topic_filter.split('/', 2)
+            key = (group, topic_filter)
+            if key in self.groups and session in self.groups[key].members:
+                self.groups[key].members.remove(session)
+        else:
+            key = topic_filter
+        session.subscriptions.pop(key, None)
+
+    def _route(self, topic: str, payload: bytes, qos: int):
+        self.counts['published'] += 1
+        for key, group in self.groups.items():
+            if group.members and topic_matches(key[1], topic):
+                group.backlog.append((topic, payload))
+                # Round robin, skipping members whose window is full
+                for i in range(len(group.members)):
+                    member = group.members[(group.turn + i) % len(group.members)]
+                    if len(member.inflight) < self.max_inflight:
+                        group.turn = (group.turn + i + 1) % len(group.members)
+                        self._pump(member)
+                        break
+        for session in self.sessions:
+            for topic_filter, (group, _) in session.subscriptions.items():
+                if group is None and topic_matches(topic_filter, topic):
+                    session.queue.append((topic, payload))
+                    self._pump(session)
+                    break
+
+    def _pump(self, session):
+        """Send queued messages to `session` while its window has room."""
+        groups = [self.groups[key] for key, (group, _) in session.subscriptions.items() if group is not None]
+        while len(session.inflight) < self.max_inflight:
+            if session.queue:
+                topic, payload = session.queue.popleft()
+                source = None
+            else:
+                source = next((g for g in groups if g.backlog), None)
+                if source is None:
+                    return
+                topic, payload = source.backlog.popleft()
+            packet_id = session.next_id
+            session.next_id = packet_id % 65535 + 1
+            session.inflight[packet_id] = (topic, payload, source)
+            session.writer.write(mqtt_packet(PUBLISH, 0x02, mqtt_string(topic) + struct.pack('>H', packet_id) + payload))
+            self.counts['delivered'] += 1
+
+    def _acked(self, session, packet_id: int):
+        if session.inflight.pop(packet_id, None) is not None:
+            self.counts['acked'] += 1
+            self._pump(session)
+
+    def _drop(self, session):
+        self.sessions.discard(session)
+        for group in self.groups.values():
+            if session in group.members:
+                group.members.remove(session)
+        # Unacknowledged shared messages go to the other members
+        for topic, payload, source in reversed(list(session.inflight.values())):
+            if source is not None:
+                source.backlog.appendleft((topic, payload))
+                self.counts['requeued'] += 1
+        session.inflight.clear()
+        for group in self.groups.values():
+            for member in list(group.members):
+                self._pump(member)
+
+
+def _serve_mqtt(max_inflight: int, conn):
+    with FakeMqttBroker(max_inflight=max_inflight) as broker:
+        conn.send(broker.port)
+        while True:
+            command, args = conn.recv()
+            if command == 'stop':
+                return
+            conn.send(getattr(broker, command)(*args))
+
+
+class FakeMqttProcess:
+    """Runs a FakeMqttBroker in a child process; `stats()` and `inject()` are forwarded to it."""
+
+    def __init__(self, max_inflight: int = 20):
+        self.max_inflight = max_inflight
+        self.port = None
+        self.process = None
+        self.conn = None
+
+    def __enter__(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_serve_mqtt, args=(self.max_inflight, child), daemon=True)
+        self.process.start()
+        self.port = self.conn.recv()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.conn.send(('stop', ()))
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def stats(self) -> dict:
+        self.conn.send(('stats', ()))
+        return self.conn.recv()
+
+    def inject(self, topics: list, payloads: list, count: int, qos: int = 1):
+        self.conn.send(('inject', (topics, payloads, count, qos)))
+        return self.conn.recv()
@@ -0,0 +1 @@
+"""Modules shared by the Python services (importable with the repo root on PYTHONPATH)."""
@@ -0,0 +1,214 @@
+"""
+asyncio writer for the InfluxDB sink.
+
+`AsyncInfluxBatchSink` batches, tracks offsets and applies backpressure
+exactly like `InfluxBatchSink`, but its writer thread runs an event loop that
+keeps up to `max_in_flight` write requests open at once over a keep-alive
+aiohttp connection pool. On a high-latency link one synchronous request per
+round trip caps the ingest rate at batch_size / RTT; with N requests in
+flight it is N times that, until InfluxDB itself is the limit.
+
+Writes finish out of order, but offsets are released in the order the
+batches were sealed, so a commit still never covers an unwritten point.
+Failed writes are retried with jittered exponential backoff; a 429 or 503
+with a `Retry-After` header waits at least that long, up to
+`MAX_RETRY_AFTER` seconds.
+"""
+import asyncio
+import email.utils
+import gzip as gzip_codec
+import logging
+import queue
+import random
+import time
+from collections import deque
+
+import aiohttp
+
+from common.influx_sink import REJECTED_STATUSES, InfluxBatchSink
+from common.metrics import (ERRORS, INFLUX_BATCH_POINTS, INFLUX_FLUSH_SECONDS, INFLUX_IN_FLIGHT,
+                            MESSAGES_OUT)
+
+MAX_RETRY_DELAY = 30.0
+# Upper bound on a server's Retry-After, so a bogus date cannot park a write for hours
+MAX_RETRY_AFTER = 300.0
+
+
+class InfluxWriteError(Exception):
+    """A write request answered with an error status."""
+
+    def __init__(self, status: int, message: str, retry_after: float = None):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def retry_after_seconds(value: str):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), None if absent or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AsyncInfluxBatchSink(InfluxBatchSink):
+    """
+    `InfluxBatchSink` with concurrent writes.
+
+    :param max_in_flight: write requests open at the same time
+    :param timeout_s: total time allowed for one request
+    """
+
+    def __init__(self, url: str, token: str, org: str, bucket: str, max_in_flight: int = 4,
+                 timeout_s: float = 30, **kwargs):
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.timeout = timeout_s
+        self._loop = None
+        self._wakeup = None
+        self._in_flight = INFLUX_IN_FLIGHT.labels(url)
+        super().__init__(url=url, token=token, org=org, bucket=bucket, **kwargs)
+
+    def _connect(self, token: str, gzip: bool):
+        self.gzip = gzip
+        self.write_url = self.url.rstrip('/') + '/api/v2/write'
+        self.params = {'org': self.org, 'bucket': self.bucket, 'precision': str(self.precision)}
+        self.headers = {'Authorization': f"Token {token}", 'Content-Type': 'text/plain; charset=utf-8'}
+        if gzip:
+            self.headers['Content-Encoding'] = 'gzip'
+
+    def _disconnect(self):
+        # The session is closed by the writer loop on its way out
+        pass
+
+    def _notify(self):
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # Loop shut down between the check and the call
+                pass
+
+    # --- writer thread ---------------------------------------------------
+
+    def _run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._wakeup = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_in_flight)
+        # Batches in the order they were taken from the queue: [batch, done, written]
+        pending = deque()
+        tasks = set()
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            while True:
+                await slots.acquire()
+                batch = await self._next_batch()
+                if batch is None:
+                    slots.release()
+                    if tasks:
+                        await asyncio.wait(tasks)
+                    self._queue.task_done()
+                    return
+                entry = [batch, False, True]
+                pending.append(entry)
+                task = asyncio.create_task(self._write_entry(session, entry, pending, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+    async def _next_batch(self):
+        while True:
+            # Cleared before looking, so a batch queued in between still wakes us up
+            self._wakeup.clear()
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                # Idle consumer: time-based flushes must not wait for the next record
+                self._pump()
+
+    async def _write_entry(self, session, entry: list, pending: deque, slots: asyncio.Semaphore):
+        batch = entry[0]
+        self._in_flight.inc()
+        try:
+            if self._error is None:
+                if self.cooling_down:
+                    entry[2] = False
+                else:
+                    await self._write_async(session, batch)
+        except Exception as e:
+            # Handed back (with failover) by the ordered release below, not here
+            entry[2] = False
+            self._mark_failed(batch, e)
+        finally:
+            self._in_flight.dec()
+            entry[1] = True
+            # Release offsets strictly in batch order; a handed-back batch takes its place in that order
+            while pending and pending[0][1]:
+                done, _, written = pending.popleft()
+                if self._error is None:
+                    self._acked.put(done.offsets if written else done)
+            slots.release()
+            self._queue.task_done()
+
+    async def _write_async(self, session, batch):
+        if not batch.lines:
+            return
+        body = ("\n".join(batch.lines)).encode('utf-8')
+        if self.gzip:
+            # zlib releases the GIL: compress off the loop so other requests keep moving
+            body = await asyncio.get_running_loop().run_in_executor(None, gzip_codec.compress, body)
+        delay = self.retry_interval
+        started = time.perf_counter()
+        for attempt in range(1, self.max_retries + 1):
+            wait = None
+            try:
+                async with session.post(self.write_url, params=self.params, headers=self.headers,
+                                        data=body) as response:
+                    if response.status >= 300:
+                        raise InfluxWriteError(response.status, (await response.text())[:200],
+                                               retry_after_seconds(response.headers.get('Retry-After')))
+                logging.debug(f"[✓] Wrote batch of {len(batch.lines)} points to InfluxDB")
+                self._down_until = 0.0
+                self._node_up.set(1)
+                INFLUX_FLUSH_SECONDS.observe(time.perf_counter() - started)
+                INFLUX_BATCH_POINTS.observe(len(batch.lines))
+                MESSAGES_OUT.labels('influxdb').inc(len(batch.lines))
+                return
+            except InfluxWriteError as e:
+                if e.status in REJECTED_STATUSES:
+                    self._reject(batch, e.status, e)
+                    return
+                # Auth or a missing bucket fails every batch: stop the sink; overload and outages may pass
+                if e.status < 500 and e.status != 429:
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                wait = e.retry_after
+                ERRORS.labels('influx_retry').inc()
+                logging.warning(f"⚠️ InfluxDB write failed ({e.status}), retry {attempt}/{self.max_retries}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                ERRORS.labels('influx_retry').inc()
+                logging.warning(f"⚠️ InfluxDB write failed ({e!r}), retry {attempt}/{self.max_retries}")
+            # Jitter spreads the retries of concurrent batches; Retry-After is a lower bound
+            sleep = random.uniform(delay / 2, delay)
+            if wait is not None:
+                sleep = max(sleep, min(wait, MAX_RETRY_AFTER))
+            self._down_until = time.monotonic() + sleep
+            self._node_up.set(0)
+            await asyncio.sleep(sleep)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
@@ -0,0 +1,256 @@
+"""
+Sharded write router over several InfluxDB nodes.
+
+Each line-protocol record is routed by its series key (measurement plus tag
+set) on a consistent-hash ring, so a series always lands on the same node
+while that node is healthy, and adding a node only moves ~1/N of the series.
+Every node has its own batched, offset-tracking `InfluxBatchSink` (one
+keep-alive HTTP pool and writer thread per node), so nodes are written in
+parallel. With `replication=N` a record goes to the first N distinct nodes
+clockwise from its hash.
+
+A node that is backing off after a failed write gets no new records; they go
+to the next healthy node on the ring instead and return once its backoff has
+expired. Batches already queued on that node keep retrying there, and Kafka
+offsets are only released once every node has written everything tracked
+before them.
+
+A batch that uses up its retries does not fail the router: its node is marked
+down for `failover_cooldown_ms`, hands that batch and everything queued behind
+it back, and the router adds their records to the next healthy nodes of their
+series. No offsets are committed until those nodes have written them. Only a
+record with no healthy node left raises `InfluxSinkError`.
+"""
+import logging
+import time
+import zlib
+from bisect import bisect_right
+
+from confluent_kafka import TopicPartition
+
+from common.influx_sink import InfluxBatchSink, InfluxSinkError
+from common.metrics import ERRORS
+
+SERIES_CACHE_SIZE = 100_000
+# Tracked next to re-routed records; acknowledged once a node has written them
+FAILOVER_TOPIC = "__influx_failover__"
+
+
+def series_key(line: str) -> str:
+    """Measurement and tag set of a line-protocol record (everything before the first unescaped space)."""
+    end = line.find(' ')
+    while end > 0 and line[end - 1] == '\\':
+        end = line.find(' ', end + 1)
+    return line if end < 0 else line[:end]
+
+
+class HashRing:
+    """Consistent-hash ring with `vnodes` virtual points per node."""
+
+    def __init__(self, nodes: list, vnodes: int = 64):
+        points = sorted((zlib.crc32(f"{node}#{i}".encode('utf-8')), index)
+                        for index, node in enumerate(nodes) for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.owners = [index for _, index in points]
+        self.size = len(nodes)
+
+    def preference(self, key: str) -> tuple:
+        """All node indices in ring order, starting with the owner of `key`."""
+        start = bisect_right(self.hashes, zlib.crc32(key.encode('utf-8'))) % len(self.hashes)
+        order = []
+        for i in range(len(self.owners)):
+            owner = self.owners[(start + i) % len(self.owners)]
+            if owner not in order:
+                order.append(owner)
+                if len(order) == self.size:
+                    break
+        return tuple(order)
+
+
+class InfluxShardRouter:
+    """
+    Drop-in replacement for `InfluxBatchSink` that spreads writes over `urls`.
+    Extra keyword arguments are passed to every node's sink.
+
+    :param replication: number of distinct nodes each record is written to
+    :param vnodes: virtual points per node on the hash ring
+    :param sink_class: per-node sink, `InfluxBatchSink` or `AsyncInfluxBatchSink`
+    """
+
+    def __init__(self, urls: list, token: str, org: str, bucket: str,
+                 replication: int = 1, vnodes: int = 64, sink_class=InfluxBatchSink, **sink_kwargs):
+        if not urls:
+            raise ValueError("At least one InfluxDB URL is required")
+        self.urls = list(urls)
+        self.replication = max(1, min(int(replication), len(self.urls)))
+        self.ring = HashRing(self.urls, vnodes)
+        self.nodes = [sink_class(url=url, token=token, org=org, bucket=bucket, failover=True, **sink_kwargs)
+                      for url in self.urls]
+        self._routes = {}
+        # Per node: (topic, partition) -> next offset acknowledged by that node
+        self._acked = [{} for _ in self.nodes]
+        self._committed = {}
+        self._paused = False
+        # Re-routed batches not written yet: id -> (nodes still writing, origin node, offsets)
+        self._failovers = {}
+        self._failover_ids = 0
+
+    def _preference(self, line: str) -> tuple:
+        key = series_key(line)
+        order = self._routes.get(key)
+        if order is None:
+            if len(self._routes) >= SERIES_CACHE_SIZE:
+                self._routes.clear()
+            order = self._routes[key] = self.ring.preference(key)
+        return order
+
+    def route(self, line: str) -> list:
+        """Indices of the nodes `line` is written to."""
+        order = self._preference(line)
+        targets = [i for i in order if self.nodes[i].healthy][:self.replication]
+        # Nobody healthy: queue on the preferred nodes and let backpressure build
+        return targets or list(order[:self.replication])
+
+    def add(self, line: str):
+        """Append one line-protocol record to the batches of its nodes."""
+        if line:
+            for i in self.route(line):
+                self.nodes[i].add(line)
+
+    def track(self, topic: str, partition: int, offset: int):
+        """Commit `offset` once every node has written every record added so far."""
+        for node in self.nodes:
+            node.track(topic, partition, offset)
+
+    @property
+    def backpressure(self) -> bool:
+        return any(node.backpressure for node in self.nodes)
+
+    def poll(self) -> list:
+        """
+        Offsets (next offset to read) acknowledged by all nodes since the last
+        call. Re-routes the batches failed nodes handed back; nothing is
+        committable until those are written.
+        """
+        for i, node in enumerate(self.nodes):
+            for tp in node.poll():
+                self._ack(i, (tp.topic, tp.partition), tp.offset)
+            # After the acks: the ones that came before a failed batch are safe, later ones wait for it
+            for batch in node.take_failed():
+                self._fail_over(i, batch)
+        if self._failovers:
+            return []
+
+        committable = []
+        for key in self._acked[0]:
+            offsets = [acked.get(key) for acked in self._acked]
+            if None in offsets:
+                continue
+            offset = min(offsets)
+            if offset > self._committed.get(key, -1):
+                self._committed[key] = offset
+                committable.append(TopicPartition(key[0], key[1], offset))
+        return committable
+
+    def _ack(self, node: int, key: tuple, offset: int, at_least: bool = False):
+        if key[0] == FAILOVER_TOPIC:
+            failover = self._failovers.get(key[1])
+            if failover is not None:
+                failover[0].discard(node)
+                if not failover[0]:
+                    self._complete(key[1])
+        elif at_least:
+            self._acked[node][key] = max(offset, self._acked[node].get(key, offset))
+        else:
+            self._acked[node][key] = offset
+
+    def _complete(self, failover_id: int):
+        """A re-routed batch is written everywhere: its offsets count as acknowledged by the node it failed on."""
+        _, origin, offsets = self._failovers.pop(failover_id)
+        for key, offset in offsets.items():
+            self._ack(origin, key, offset + 1, at_least=True)
+
+    def _fail_over(self, origin: int, batch):
+        """Add a batch `origin` could not write to the next healthy nodes of each record's series."""
+        self._failover_ids += 1
+        failover_id = self._failover_ids
+        writers = set()
+        for line in batch.lines:
+            targets = [i for i in self._preference(line) if i != origin and self.nodes[i].healthy]
+            if not targets:
+                raise InfluxSinkError(f"No healthy InfluxDB node left for a record that failed on {self.urls[origin]}")
+            for i in targets[:self.replication]:
+                self.nodes[i].add(line)
+                writers.add(i)
+        for i in writers:
+            self.nodes[i].track(FAILOVER_TOPIC, failover_id, 0)
+        self._failovers[failover_id] = (writers, origin, dict(batch.offsets))
+        if batch.lines:
+            ERRORS.labels('influx_failover').inc()
+            logging.warning(f"↪️ Re-routing {len(batch.lines)} records from {self.urls[origin]} "
+                            f"to {', '.join(self.urls[i] for i in sorted(writers))}")
+        if not writers:
+            self._complete(failover_id)
+
+    def sync(self, consumer):
+        """Commit acknowledged offsets and pause or resume the consumer on backpressure."""
+        offsets = self.poll()
+        if offsets:
+            consumer.commit(offsets=offsets, asynchronous=True)
+
+        if self.backpressure and not self._paused:
+            consumer.pause(consumer.assignment())
+            self._paused = True
+            logging.warning("⏸️ InfluxDB router is full, pausing consumer")
+        elif self._paused and not self.backpressure:
+            consumer.resume(consumer.assignment())
+            self._paused = False
+            logging.info("▶️ InfluxDB router drained, resuming consumer")
+
+    def flush(self, consumer=None, timeout: float = None):
+        """Write everything added so far on every node, then commit like `InfluxBatchSink.flush`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        committable = {}
+        while True:
+            # Hand every node its last batch first so the nodes write in parallel
+            for node in self.nodes:
+                node.seal()
+            for node in self.nodes:
+                node.drain(timeout)
+            committable.update(((tp.topic, tp.partition), tp) for tp in self.poll())
+            # Records re-routed by this poll still have to be written
+            if not self._failovers or (deadline is not None and time.monotonic() > deadline):
+                break
+
+        offsets = list(committable.values())
+        if consumer is not None and offsets:
+            consumer.commit(offsets=offsets, asynchronous=False)
+        return offsets
+
+    def close(self):
+        self.flush()
+        for node in self.nodes:
+            node.close()
+
+
+def create_influx_sink(url: str, token: str, org: str, bucket: str, replication: int = 1,
+                       writer: str = "thread", max_in_flight: int = 4, **kwargs):
+    """
+    `InfluxBatchSink` for a single URL, `InfluxShardRouter` for a
+    comma-separated list of URLs. `writer="async"` uses
+    `AsyncInfluxBatchSink` with `max_in_flight` concurrent requests per node.
+    """
+    sink_class = InfluxBatchSink
+    if writer == "async":
+        # aiohttp is only needed by the async writer
+        from common.influx_async import AsyncInfluxBatchSink
+        sink_class = AsyncInfluxBatchSink
+        kwargs['max_in_flight'] = max_in_flight
+    elif writer != "thread":
+        raise ValueError(f"Unknown InfluxDB writer {writer!r}, expected 'thread' or 'async'")
+    urls = [u.strip() for u in url.split(',') if u.strip()]
+    if len(urls) == 1:
+        return sink_class(url=urls[0], token=token, org=org, bucket=bucket, **kwargs)
+    logging.info(f"🔀 Sharding InfluxDB writes over {len(urls)} nodes, replication={replication}")
+    return InfluxShardRouter(urls, token=token, org=org, bucket=bucket, replication=replication,
+                             sink_class=sink_class, **kwargs)
@@ -0,0 +1,159 @@
+"""
+Declared InfluxDB schemas with a cardinality guard.
+
+A `MeasurementSchema` lists which keys of a row are written as tags and
+which as fields. Every tag is indexed and every distinct tag set is a new
+series, so the schema keeps a HyperLogLog sketch of the distinct values per
+tag and of the distinct tag sets. Once a tag's estimate passes
+`max_tag_values`, or the series estimate passes `max_series` (then the tag
+with the most values goes), that tag is demoted to a field for every
+following row and a warning says so. The guard is a safety net; the
+declared schema is what should keep the series count small.
+
+`ANOMALY_SCHEMAS` holds the two layouts of subscribe_ml's measurement:
+"legacy" (every calendar column a tag: a new series for almost every hour)
+and "compact" (only Weekday and Hour as tags, 168 series at most).
+"""
+import hashlib
+import logging
+import math
+
+from influxdb_client import Point
+
+from common.metrics import INFLUX_SERIES_ESTIMATE, INFLUX_TAG_DEMOTIONS
+
+ANOMALY_FIELDS = ['value', 'Lag', 'Rolling_Mean', 'value_Average', 'Deviation', 'Outliers', 'Score']
+ANOMALY_CALENDAR = ['Hour', 'Day', 'Weekday', 'Month', 'Month_day', 'Year']
+
+# name -> (tags, fields)
+ANOMALY_SCHEMAS = {
+    'legacy': (ANOMALY_CALENDAR, ANOMALY_FIELDS),
+    'compact': (['Weekday', 'Hour'], ['Day', 'Month', 'Month_day', 'Year'] + ANOMALY_FIELDS),
+}
+
+# Distinct values remembered exactly per sketch; repeats of them skip the hashing
+EXACT_VALUES = 1024
+# Rows between two checks of the estimates
+CHECK_EVERY = 1000
+
+
+class HyperLogLog:
+    """Distinct-count sketch with 2**precision registers (~1.6% error at 12)."""
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value: str):
+        h = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+        index = h & (self.size - 1)
+        rank = (64 - self.precision) - (h >> self.precision).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> float:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate while many registers are empty
+            return self.size * math.log(self.size / zeros)
+        return estimate
+
+
+class _Sketch:
+    """A HyperLogLog that skips values it has already seen among the first EXACT_VALUES."""
+
+    def __init__(self):
+        self.hll = HyperLogLog()
+        self.seen = set()
+
+    def add(self, value: str):
+        if value in self.seen:
+            return
+        if len(self.seen) < EXACT_VALUES:
+            self.seen.add(value)
+        self.hll.add(value)
+
+    def count(self) -> float:
+        return len(self.seen) if len(self.seen) < EXACT_VALUES else self.hll.count()
+
+
+class MeasurementSchema:
+    """
+    Builds line protocol for one measurement from row dicts.
+
+    :param tags: row keys written as tags (in this order of preference)
+    :param fields: row keys written as fields; None values are left out
+    :param max_tag_values: demote a tag past this many distinct values, 0 disables the guard
+    :param max_series: demote the largest tag while the tag sets exceed this, 0 disables it
+    """
+
+    def __init__(self, measurement: str, tags: list, fields: list,
+                 max_tag_values: int = 1000, max_series: int = 10000):
+        self.measurement = measurement
+        self.tags = list(tags)
+        self.fields = list(fields)
+        self.max_tag_values = max_tag_values
+        self.max_series = max_series
+        self.guarded = bool(max_tag_values or max_series)
+        self._tag_sketches = {tag: _Sketch() for tag in self.tags}
+        self._series_sketch = _Sketch()
+        self._rows = 0
+        self._series = INFLUX_SERIES_ESTIMATE.labels(measurement)
+
+    def line(self, row: dict, time) -> str:
+        """Line protocol for `row` at `time` (datetime or int nanoseconds)."""
+        point = Point(self.measurement)
+        tag_values = []
+        for tag in self.tags:
+            value = row.get(tag)
+            if value is None:
+                continue
+            point.tag(tag, value)
+            tag_values.append(str(value))
+            if self.guarded:
+                self._tag_sketches[tag].add(str(value))
+        for field in self.fields:
+            value = row.get(field)
+            if value is not None:
+                point.field(field, value)
+        point.time(time)
+
+        if self.guarded:
+            self._series_sketch.add('\x00'.join(tag_values))
+            self._rows += 1
+            if self._rows % CHECK_EVERY == 0:
+                self.check()
+        return point.to_line_protocol()
+
+    def check(self):
+        """Demote tags whose estimated cardinality is over the limits."""
+        counts = {tag: sketch.count() for tag, sketch in self._tag_sketches.items()}
+        series = self._series_sketch.count()
+        self._series.set(series)
+        for tag, count in counts.items():
+            if self.max_tag_values and count > self.max_tag_values:
+                self.demote(tag, f"~{count:.0f} distinct values > {self.max_tag_values}")
+        if self.max_series and series > self.max_series and self.tags:
+            tag = max(self.tags, key=lambda t: counts[t])
+            self.demote(tag, f"~{series:.0f} series > {self.max_series}")
+
+    def demote(self, tag: str, reason: str):
+        if tag not in self.tags:
+            return
+        self.tags.remove(tag)
+        self.fields.append(tag)
+        # Start counting series again for the smaller tag set
+        self._series_sketch = _Sketch()
+        INFLUX_TAG_DEMOTIONS.labels(self.measurement, tag).inc()
+        logging.warning(f"⚠️ Writing tag {tag} of {self.measurement} as a field from now on ({reason})")
+
+
+def anomaly_schema(measurement: str, name: str = 'compact', **guard) -> MeasurementSchema:
+    """subscribe_ml's measurement in one of the ANOMALY_SCHEMAS layouts."""
+    if name not in ANOMALY_SCHEMAS:
+        raise ValueError(f"Unknown schema {name!r}, expected one of {sorted(ANOMALY_SCHEMAS)}")
+    tags, fields = ANOMALY_SCHEMAS[name]
+    return MeasurementSchema(measurement, tags, fields, **guard)
@@ -0,0 +1,339 @@
+"""
+Batched, offset-safe InfluxDB sink shared by the Kafka consumers.
+
+Line-protocol records are grouped into batches by size and age and handed to
+a writer thread through a bounded queue. The writer posts each batch as one
+gzip-compressed request and only then releases the Kafka offsets that were
+tracked with it, so the consumer commits nothing InfluxDB has not
+acknowledged. When the queue is full the sink reports backpressure and
+`sync()` pauses the consumer until the writer catches up.
+
+A sink writes to a single InfluxDB node; `common/influx_router.py` shards
+records across several of them.
+"""
+import logging
+import queue
+import threading
+import time
+
+from confluent_kafka import TopicPartition
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
+
+from common.metrics import (ERRORS, INFLUX_BATCH_POINTS, INFLUX_FLUSH_SECONDS, INFLUX_NODE_UP,
+                            INFLUX_QUEUE_BATCHES, MESSAGES_OUT)
+
+
+class InfluxSinkError(Exception):
+    """Raised on the consumer thread when a batch could not be written."""
+
+
+# Data InfluxDB refuses (bad line protocol, field type conflicts, partial writes):
+# the batch is dropped instead of retried or failing the sink
+REJECTED_STATUSES = (400, 422)
+
+
+class _Batch:
+    def __init__(self):
+        self.lines = []
+        self.offsets = {}
+        self.started = None
+
+
+class InfluxBatchSink:
+    """
+    :param batch_size: max line-protocol records per write request
+    :param flush_interval_ms: max age of an open batch before it is sealed
+    :param max_pending_batches: sealed batches the writer queue may hold
+    :param max_retries: attempts per batch before the sink fails
+    :param failover: hand a batch that used up its retries back through
+        `take_failed()` instead of failing the sink (used by the router)
+    :param failover_cooldown_ms: how long a node stays down after that; batches
+        reaching the writer meanwhile are handed back without a try
+    """
+
+    def __init__(self, url: str, token: str, org: str, bucket: str,
+                 batch_size: int = 5000, flush_interval_ms: float = 1000,
+                 max_pending_batches: int = 4, precision: str = WritePrecision.NS,
+                 gzip: bool = True, max_retries: int = 5, retry_interval_ms: float = 500,
+                 failover: bool = False, failover_cooldown_ms: float = 30000):
+        self.url = url
+        self.bucket = bucket
+        self.org = org
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.precision = precision
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval_ms / 1000.0
+        self.failover = failover
+        self.failover_cooldown = failover_cooldown_ms / 1000.0
+
+        self._connect(token, gzip)
+
+        self._lock = threading.Lock()
+        self._batch = _Batch()
+        self._sealed = []
+        self._queue = queue.Queue(maxsize=max(1, int(max_pending_batches)))
+        self._acked = queue.SimpleQueue()
+        self._error = None
+        self._paused = False
+        # Set by the writer after a failed attempt, until its next retry is due
+        self._down_until = 0.0
+        # With failover: set after a batch was handed back, until the node is tried again
+        self._failed_until = 0.0
+        self._failed = []
+        self._node_up = INFLUX_NODE_UP.labels(url)
+        self._node_up.set(1)
+        self._writer = threading.Thread(target=self._run, name="influx-sink", daemon=True)
+        self._writer.start()
+
+    def _connect(self, token: str, gzip: bool):
+        self.client = InfluxDBClient(url=self.url, token=token, org=self.org, enable_gzip=gzip)
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+    def _disconnect(self):
+        self.client.close()
+
+    # --- consumer thread -------------------------------------------------
+
+    def add(self, line: str):
+        """Append one line-protocol record to the open batch."""
+        if self._error is not None:
+            raise InfluxSinkError(str(self._error)) from self._error
+        if line:
+            with self._lock:
+                if self._batch.started is None:
+                    self._batch.started = time.monotonic()
+                self._batch.lines.append(line)
+                if len(self._batch.lines) >= self.batch_size:
+                    self._seal()
+
+    def track(self, topic: str, partition: int, offset: int):
+        """Commit `offset` once every record added so far has been written."""
+        with self._lock:
+            if self._batch.started is None:
+                self._batch.started = time.monotonic()
+            self._batch.offsets[(topic, partition)] = offset
+
+    @property
+    def backpressure(self) -> bool:
+        """True while sealed batches are waiting for room in the writer queue."""
+        return bool(self._sealed)
+
+    @property
+    def healthy(self) -> bool:
+        """False while the writer is backing off after a failed write, or has given up."""
+        now = time.monotonic()
+        return self._error is None and now >= self._down_until and now >= self._failed_until
+
+    def poll(self) -> list:
+        """
+        Seal the open batch if it is due, hand sealed batches to the writer
+        and return the offsets (as TopicPartition, next offset to read) that
+        are now safe to commit.
+        """
+        if self._error is not None:
+            raise InfluxSinkError(str(self._error)) from self._error
+
+        self._pump()
+
+        committable = {}
+        while True:
+            try:
+                offsets = self._acked.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(offsets, _Batch):
+                # Handed back (failover): what follows is acknowledged, the caller re-routes it
+                self._failed.append(offsets)
+                continue
+            committable.update(offsets)
+        return [TopicPartition(topic, partition, offset + 1)
+                for (topic, partition), offset in committable.items()]
+
+    def take_failed(self) -> list:
+        """
+        With `failover`: batches handed back since the last call, in order.
+        Their offsets were not released; `poll()` may already have returned
+        later ones, so they must be written elsewhere before committing.
+        """
+        failed, self._failed = self._failed, []
+        return failed
+
+    def sync(self, consumer):
+        """
+        Call from the poll loop: commit acknowledged offsets and pause or
+        resume the consumer's assignment according to backpressure.
+        """
+        offsets = self.poll()
+        if offsets:
+            consumer.commit(offsets=offsets, asynchronous=True)
+
+        if self.backpressure and not self._paused:
+            consumer.pause(consumer.assignment())
+            self._paused = True
+            logging.warning("⏸️ InfluxDB sink is full, pausing consumer")
+        elif self._paused and not self.backpressure:
+            consumer.resume(consumer.assignment())
+            self._paused = False
+            logging.info("▶️ InfluxDB sink drained, resuming consumer")
+
+    def seal(self):
+        """Close the open batch and queue it for the writer without waiting."""
+        with self._lock:
+            self._seal()
+        self._pump()
+
+    def flush(self, consumer=None, timeout: float = None):
+        """
+        Write everything added so far and wait for the writer to finish.
+        With a consumer, the resulting offsets are committed synchronously.
+        """
+        self.drain(timeout)
+        offsets = self.poll()
+        if consumer is not None and offsets:
+            consumer.commit(offsets=offsets, asynchronous=False)
+        return offsets
+
+    def drain(self, timeout: float = None):
+        """Write everything added so far and wait for the writer, leaving the offsets to `poll()`."""
+        with self._lock:
+            self._seal()
+            pending, self._sealed = self._sealed, []
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for batch in pending:
+            self._queue.put(batch, timeout=timeout)
+            self._notify()
+        while self._queue.unfinished_tasks:
+            if self._error is not None:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._notify()
+        self._writer.join()
+        self._disconnect()
+
+    def _seal(self):
+        # Caller holds self._lock
+        if self._batch.lines or self._batch.offsets:
+            self._sealed.append(self._batch)
+            self._batch = _Batch()
+
+    def _pump(self):
+        """Seal the open batch if it is due and move sealed batches into the queue."""
+        with self._lock:
+            started = self._batch.started
+            if started is not None and time.monotonic() - started >= self.flush_interval:
+                self._seal()
+            queued = False
+            while self._sealed:
+                try:
+                    self._queue.put_nowait(self._sealed[0])
+                except queue.Full:
+                    break
+                self._sealed.pop(0)
+                queued = True
+            INFLUX_QUEUE_BATCHES.set(self._queue.qsize() + len(self._sealed))
+        if queued:
+            self._notify()
+
+    def _notify(self):
+        """Called after batches were queued; the writer thread here simply blocks on the queue."""
+
+    # --- writer thread ---------------------------------------------------
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # Idle consumer: time-based flushes must not wait for the next record
+                self._pump()
+                continue
+            try:
+                if batch is None:
+                    return
+                if self._error is None:
+                    if self.cooling_down:
+                        self._acked.put(batch)
+                    else:
+                        self._write(batch)
+                        self._acked.put(batch.offsets)
+            except Exception as e:
+                self._fail(batch, e)
+            finally:
+                self._queue.task_done()
+
+    @property
+    def cooling_down(self) -> bool:
+        """True while a failover node is down after handing a batch back."""
+        return self.failover and time.monotonic() < self._failed_until
+
+    def _fail(self, batch: _Batch, error: Exception):
+        """A batch used up its retries: fail the sink or, with failover, mark the node down and hand it back."""
+        if self._mark_failed(batch, error):
+            self._acked.put(batch)
+
+    def _mark_failed(self, batch: _Batch, error: Exception) -> bool:
+        """Fail the sink, or with failover mark the node down; True if the batch is to be handed back."""
+        logging.error(f"❌ InfluxDB batch of {len(batch.lines)} points failed on {self.url}: {error}")
+        ERRORS.labels('influx_flush').inc()
+        if not self.failover:
+            self._error = error
+            return False
+        self._failed_until = time.monotonic() + self.failover_cooldown
+        self._node_up.set(0)
+        return True
+
+    def _reject(self, batch: _Batch, status: int, message):
+        """
+        InfluxDB refused the batch's data; retrying would fail the same way
+        and stop the consumer on that offset for good. Log and drop it, which
+        releases its offsets like a written batch.
+        """
+        ERRORS.labels('influx_rejected').inc()
+        logging.error(f"❌ InfluxDB rejected a batch of {len(batch.lines)} points on {self.url} ({status}): "
+                      f"{str(message)[:300]}; first point: {batch.lines[0][:200]}")
+
+    def _write(self, batch: _Batch):
+        if not batch.lines:
+            return
+        delay = self.retry_interval
+        started = time.perf_counter()
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org,
+                                     record=batch.lines, write_precision=self.precision)
+                logging.debug(f"[✓] Wrote batch of {len(batch.lines)} points to InfluxDB")
+                self._down_until = 0.0
+                self._node_up.set(1)
+                INFLUX_FLUSH_SECONDS.observe(time.perf_counter() - started)
+                INFLUX_BATCH_POINTS.observe(len(batch.lines))
+                MESSAGES_OUT.labels('influxdb').inc(len(batch.lines))
+                return
+            except ApiException as e:
+                if e.status in REJECTED_STATUSES:
+                    self._reject(batch, e.status, e.body)
+                    return
+                # Auth or a missing bucket fails every batch: stop the sink; overload and outages may pass
+                if e.status is not None and e.status < 500 and e.status != 429:
+                    raise
+                if attempt == self.max_retries:
+                    raise
+                ERRORS.labels('influx_retry').inc()
+                logging.warning(f"⚠️ InfluxDB write failed ({e.status}), retry {attempt}/{self.max_retries}")
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                ERRORS.labels('influx_retry').inc()
+                logging.warning(f"⚠️ InfluxDB write failed ({e}), retry {attempt}/{self.max_retries}")
+            self._down_until = time.monotonic() + delay
+            self._node_up.set(0)
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
@@ -0,0 +1,120 @@
+"""
+Prometheus metrics shared by the Python services.
+
+Each service calls `start_metrics_server(default_port)` once; the port can
+be overridden with METRICS_PORT (0 disables the endpoint). Stage latencies
+are recorded with the pre-bound children in `STAGES`, e.g.
+
+    with STAGES['inference'].time():
+        scores, outliers = score_batch(IF_model, features)
+"""
+import json
+import logging
+import os
+import time
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Per-message stages are sub-millisecond to tens of milliseconds, Influx flushes up to seconds
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+MESSAGES_IN = Counter('pipeline_messages_in_total', 'Messages consumed from Kafka', ['topic'])
+MESSAGES_OUT = Counter('pipeline_messages_out_total', 'Messages produced to Kafka or written to InfluxDB', ['destination'])
+ERRORS = Counter('pipeline_errors_total', 'Processing errors', ['stage'])
+STAGE_LATENCY = Histogram('pipeline_stage_latency_seconds', 'Time spent per processing stage',
+                          ['stage'], buckets=LATENCY_BUCKETS)
+INFLUX_BATCH_POINTS = Histogram('pipeline_influx_batch_points', 'Points per InfluxDB write request',
+                                buckets=BATCH_BUCKETS)
+INFLUX_FLUSH_SECONDS = Histogram('pipeline_influx_flush_seconds', 'InfluxDB write request latency incl. retries',
+                                 buckets=LATENCY_BUCKETS)
+INFLUX_NODE_UP = Gauge('pipeline_influx_node_up', '1 if the last write to this InfluxDB node succeeded', ['node'])
+INFLUX_SERIES_ESTIMATE = Gauge('pipeline_influx_series_estimate', 'Estimated distinct tag sets written per measurement',
+                               ['measurement'])
+INFLUX_TAG_DEMOTIONS = Counter('pipeline_influx_tag_demotions_total', 'Tags demoted to fields by the cardinality guard',
+                               ['measurement', 'tag'])
+INFLUX_QUEUE_BATCHES = Gauge('pipeline_influx_queue_batches', 'Sealed batches waiting for the InfluxDB writer')
+INFLUX_IN_FLIGHT = Gauge('pipeline_influx_in_flight', 'InfluxDB write requests currently open', ['node'])
+PRODUCER_QUEUE_DEPTH = Gauge('pipeline_producer_queue_depth', 'Messages waiting in the Kafka producer queue')
+STARTUP_SECONDS = Gauge('pipeline_startup_seconds', 'Time spent per startup phase', ['phase'])
+ONLINE_DETECTOR_ROWS = Counter('pipeline_online_detector_rows_total',
+                               'Rows seen by the online detector by mode and outcome', ['mode', 'result'])
+MODEL_RELOADS = Counter('pipeline_model_reloads_total', 'Hot model reloads by result', ['result'])
+MODEL_SHADOW_DISAGREEMENT = Gauge('pipeline_model_shadow_disagreement',
+                                  'Share of shadow-scored rows whose outlier flag differed from the live model')
+MODEL_SHADOW_SCORE_DIFF = Gauge('pipeline_model_shadow_score_diff',
+                                'Mean absolute score difference between the candidate and the live model')
+VIEW_ROWS = Gauge('pipeline_view_rows', 'Rows held by the materialized view')
+VIEW_KEYS = Gauge('pipeline_view_keys', 'Keys held by the materialized view')
+VIEW_BYTES = Gauge('pipeline_view_bytes', 'Bytes allocated for the materialized view arrays')
+VIEW_EVICTIONS = Counter('pipeline_view_evictions_total', 'Rows dropped from the materialized view', ['reason'])
+VIEW_QUERY_SECONDS = Histogram('pipeline_view_query_seconds', 'Materialized view HTTP query latency',
+                               ['endpoint'], buckets=LATENCY_BUCKETS)
+MQTT_UNACKED = Gauge('pipeline_mqtt_unacked', 'MQTT messages received but not yet acknowledged, waiting for Kafka',
+                     ['worker'])
+CONSUMER_LAG = Gauge('pipeline_consumer_lag', 'High watermark minus consumer position', ['topic', 'partition'])
+
+STAGES = {name: STAGE_LATENCY.labels(name)
+          for name in ('deserialize', 'features', 'inference', 'produce', 'influx_write')}
+
+
+def start_metrics_server(default_port: int, offset: int = 0):
+    """
+    Serve /metrics on METRICS_PORT (default `default_port`, 0 disables it)
+    plus `offset`, so worker processes of one service get ports of their own.
+    """
+    port = int(os.getenv("METRICS_PORT", default_port))
+    if port:
+        start_http_server(port + offset)
+        logging.info(f"📈 Prometheus metrics on :{port + offset}/metrics")
+
+
+class LagTracker:
+    """
+    Updates CONSUMER_LAG and PRODUCER_QUEUE_DEPTH at most every `interval`
+    seconds, so it is cheap to call from every iteration of a poll loop.
+    High watermarks come from the consumer's cache (refreshed by its fetch
+    responses), so an update never waits on the broker.
+
+    A consumer whose poll loop is not ours (the Quix StreamingDataFrame
+    path) reports lag through librdkafka statistics instead: pass
+    `consumer_config()` as the consumer's extra config.
+    """
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.last = 0.0
+
+    def update(self, consumer, producer=None):
+        now = time.monotonic()
+        if now - self.last < self.interval:
+            return
+        self.last = now
+        if producer is not None:
+            PRODUCER_QUEUE_DEPTH.set(len(producer))
+        try:
+            assignment = consumer.assignment()
+            for tp in consumer.position(assignment):
+                _, high = consumer.get_watermark_offsets(tp, cached=True)
+                if tp.offset >= 0 and high >= 0:
+                    CONSUMER_LAG.labels(tp.topic, str(tp.partition)).set(max(0, high - tp.offset))
+        except Exception as e:
+            logging.debug(f"Consumer lag unavailable: {e}")
+
+    def consumer_config(self) -> dict:
+        """librdkafka settings that emit statistics every `interval` seconds into `on_statistics`."""
+        return {'statistics.interval.ms': int(self.interval * 1000), 'stats_cb': self.on_statistics}
+
+    def on_statistics(self, stats_json: str):
+        """Set CONSUMER_LAG from a librdkafka statistics payload (the lag behind the committed offset)."""
+        try:
+            stats = json.loads(stats_json)
+            for topic, topic_stats in stats.get('topics', {}).items():
+                for partition, partition_stats in topic_stats.get('partitions', {}).items():
+                    # Partition -1 is librdkafka's internal "unassigned" queue; -1 lag means not known yet
+                    lag = partition_stats.get('consumer_lag', -1)
+                    if partition != '-1' and lag >= 0:
+                        CONSUMER_LAG.labels(topic, partition).set(lag)
+        except Exception as e:
+            logging.debug(f"Consumer lag unavailable: {e}")
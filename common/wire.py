@@ -0,0 +1,179 @@
+"""
+Compact binary wire format for the event and anomaly topics.
+
+A binary message is a 2-byte header (`MAGIC`, schema id) followed by the
+schema's fields packed little-endian at fixed offsets. Only what cannot be
+derived is sent: the formatted `timestamp` string and, on the anomaly topic,
+the calendar fields (Hour, Weekday, ...) are rebuilt from `timestamp_ms` on
+decode, so `decode(encode(row))` equals `json.loads(json.dumps(row))`.
+
+| id | schema                 | fields                                              | bytes |
+|----|------------------------|-----------------------------------------------------|-------|
+| 1  | event_int              | timestamp_ms, value (int)                           | 18    |
+| 2  | event_float            | timestamp_ms, value (float)                         | 18    |
+| 3  | anomaly_int            | + Lag, Rolling_Mean, Outliers, Score                | 50    |
+| 4  | anomaly_float          | (value as float)                                    | 50    |
+| 5  | anomaly_int_baseline   | + value_Average, Deviation                          | 66    |
+| 6  | anomaly_float_baseline |                                                     | 66    |
+
+Readers accept both formats: JSON always starts with `{`, binary with
+`MAGIC`. Writers pick one with WIRE_FORMAT ("json", the default, or
+"binary"), so a migration upgrades the consumers first and then flips the
+producers. Rows that do not fit a schema (extra keys, other types) are
+written as JSON.
+"""
+import json
+import struct
+import time
+
+from quixstreams.models.serializers import (Deserializer, SerializationContext, SerializationError,
+                                            Serializer)
+
+MAGIC = 0xB7
+HEADER = struct.Struct('<BB')
+JSON_FORMAT = "json"
+BINARY_FORMAT = "binary"
+TIMESTAMP_TEMPLATE = '%04d-%02d-%02d %02d:%02d:%02d'
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+EVENT = "event"
+ANOMALY = "anomaly"
+
+
+def _event_time(row: dict):
+    # time.gmtime + %-formatting is about twice as fast as datetime.strftime
+    ts = time.gmtime(row['timestamp_ms'] // 1000)
+    row['timestamp'] = TIMESTAMP_TEMPLATE % (ts.tm_year, ts.tm_mon, ts.tm_mday, ts.tm_hour, ts.tm_min, ts.tm_sec)
+    return ts
+
+
+def _calendar(row: dict):
+    ts = _event_time(row)
+    row['Weekday'] = WEEKDAYS[ts.tm_wday]
+    row['Hour'] = ts.tm_hour
+    row['Day'] = ts.tm_wday
+    row['Month'] = ts.tm_mon
+    row['Year'] = ts.tm_year
+    row['Month_day'] = ts.tm_mday
+
+
+class Schema:
+    """
+    A fixed layout: `fields` is a list of (name, struct format) packed in
+    order; `derived` names the keys `derive(row)` fills in on decode.
+    """
+
+    def __init__(self, schema_id: int, name: str, fields: list, derived: tuple = (), derive=None):
+        self.id = schema_id
+        self.name = name
+        self.names = tuple(name for name, _ in fields)
+        self.struct = struct.Struct('<' + ''.join(fmt for _, fmt in fields))
+        self.types = tuple(int if fmt == 'q' else float for _, fmt in fields)
+        self.keys = frozenset(self.names) | frozenset(derived)
+        self.derive = derive
+        self.size = HEADER.size + self.struct.size
+
+    def fits(self, row: dict) -> bool:
+        if row.keys() != self.keys:
+            return False
+        for name, kind in zip(self.names, self.types):
+            if type(row[name]) is not kind:
+                return False
+        return True
+
+    def encode(self, row: dict) -> bytes:
+        return HEADER.pack(MAGIC, self.id) + self.struct.pack(*[row[name] for name in self.names])
+
+    def decode(self, data: bytes) -> dict:
+        row = dict(zip(self.names, self.struct.unpack_from(data, HEADER.size)))
+        if self.derive is not None:
+            self.derive(row)
+        return row
+
+
+def _anomaly_fields(value_format: str, baseline: bool) -> list:
+    fields = [('timestamp_ms', 'q'), ('value', value_format), ('Lag', 'd'), ('Rolling_Mean', 'd')]
+    if baseline:
+        fields += [('value_Average', 'd'), ('Deviation', 'd')]
+    return fields + [('Outliers', 'd'), ('Score', 'd')]
+
+
+_CALENDAR_KEYS = ('timestamp', 'Weekday', 'Hour', 'Day', 'Month', 'Year', 'Month_day')
+
+SCHEMAS = {schema.id: schema for schema in [
+    Schema(1, "event_int", [('timestamp_ms', 'q'), ('value', 'q')], ('timestamp',), _event_time),
+    Schema(2, "event_float", [('timestamp_ms', 'q'), ('value', 'd')], ('timestamp',), _event_time),
+    Schema(3, "anomaly_int", _anomaly_fields('q', False), _CALENDAR_KEYS, _calendar),
+    Schema(4, "anomaly_float", _anomaly_fields('d', False), _CALENDAR_KEYS, _calendar),
+    Schema(5, "anomaly_int_baseline", _anomaly_fields('q', True), _CALENDAR_KEYS, _calendar),
+    Schema(6, "anomaly_float_baseline", _anomaly_fields('d', True), _CALENDAR_KEYS, _calendar),
+]}
+
+# Candidate schemas per topic, tried in order
+TOPIC_SCHEMAS = {
+    EVENT: [SCHEMAS[1], SCHEMAS[2]],
+    ANOMALY: [SCHEMAS[3], SCHEMAS[4], SCHEMAS[5], SCHEMAS[6]],
+}
+
+
+def encode(row: dict, topic: str = EVENT, wire_format: str = JSON_FORMAT) -> bytes:
+    """Serialize a row for `topic` (EVENT or ANOMALY) in `wire_format`."""
+    if wire_format == BINARY_FORMAT:
+        for schema in TOPIC_SCHEMAS[topic]:
+            if schema.fits(row):
+                return schema.encode(row)
+    return json.dumps(row).encode('utf-8')
+
+
+def decode(data: bytes) -> dict:
+    """Deserialize a binary or JSON message; raises ValueError if it is neither."""
+    if data and data[0] == MAGIC:
+        schema = SCHEMAS.get(data[1]) if len(data) > 1 else None
+        if schema is None or len(data) != schema.size:
+            raise ValueError(f"Unknown or truncated binary message ({len(data)} bytes)")
+        return schema.decode(data)
+    return json.loads(data)
+
+
+def encode_events(timestamps_ms, values) -> list:
+    """
+    Binary event messages for whole columns at once, the vectorized form of
+    `encode({'timestamp_ms', 'value', 'timestamp'}, EVENT, BINARY_FORMAT)`.
+    `values` is a NumPy array; integer arrays use event_int, others event_float.
+    """
+    import numpy as np
+
+    integer = np.issubdtype(values.dtype, np.integer)
+    schema = SCHEMAS[1 if integer else 2]
+    records = np.empty(len(values), dtype=[('magic', 'u1'), ('schema', 'u1'),
+                                           ('timestamp_ms', '<i8'), ('value', '<i8' if integer else '<f8')])
+    records['magic'] = MAGIC
+    records['schema'] = schema.id
+    records['timestamp_ms'] = timestamps_ms
+    records['value'] = values
+    data = records.tobytes()
+    return [data[i:i + schema.size] for i in range(0, len(data), schema.size)]
+
+
+class WireSerializer(Serializer):
+    """Quix Streams value serializer writing `topic` rows in `wire_format`."""
+
+    def __init__(self, topic: str = EVENT, wire_format: str = JSON_FORMAT):
+        self.topic = topic
+        self.wire_format = wire_format
+
+    def __call__(self, value, ctx: SerializationContext) -> bytes:
+        try:
+            return encode(value, self.topic, self.wire_format)
+        except (TypeError, ValueError) as exc:
+            raise SerializationError(str(exc)) from exc
+
+
+class WireDeserializer(Deserializer):
+    """Quix Streams value deserializer accepting binary and JSON messages."""
+
+    def __call__(self, value: bytes, ctx: SerializationContext) -> dict:
+        try:
+            return decode(value)
+        except (TypeError, ValueError, struct.error) as exc:
+            raise SerializationError(str(exc)) from exc
@@ -0,0 +1,291 @@
+"""
+MQTT -> Kafka bridge worker.
+
+Each worker process holds one MQTT connection, subscribed through a shared
+subscription (`$share/<group>/<filter>`) so the broker spreads the devices'
+messages over the workers, and one Kafka producer that batches and
+compresses. Payloads are forwarded unchanged (the consumers read JSON and
+binary events, see common/wire.py); the Kafka key is built from the MQTT
+topic levels by `TopicKeys`.
+
+A QoS 1 message is acknowledged (PUBACK) only once Kafka has confirmed its
+delivery, so a worker that dies loses nothing: the broker sends its
+unacknowledged messages again. Acknowledgements go out in arrival order, as
+MQTT 3.1.1 requires, through an `AckWindow`. The broker stops sending to a
+client that holds `max_inflight_messages` (VerneMQ) or `Receive Maximum`
+(MQTT 5) unacknowledged messages, which is the bridge's backpressure. A
+message Kafka will not take (too large, or still undelivered after
+`delivery_attempts`) is logged, counted and acknowledged anyway, since it
+would otherwise hold back every acknowledgement behind it.
+
+Usage (see main.py for the environment variables):
+    python main.py
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import (ERRORS, MESSAGES_IN, MESSAGES_OUT, MQTT_UNACKED, STAGE_LATENCY,
+                            start_metrics_server)
+
+# Named topic levels, e.g. "{device}" in "devices/{site}/{device}/telemetry"
+LEVEL_NAME = re.compile(r'^\{(\w+)\}$')
+
+
+class TopicKeys:
+    """
+    Maps MQTT topics to Kafka keys. `pattern` is the topic filter with
+    named single levels, e.g. `devices/{site}/{device}/#`; the broker is
+    subscribed to `filter` (`devices/+/+/#`). `template` builds the key from
+    the named levels, e.g. `{site}.{device}`; by default it is the named
+    levels joined by '/', or the whole topic if there are none. Keys are
+    cached per topic, since a device always publishes to the same few
+    topics.
+    """
+
+    def __init__(self, pattern: str, template: str = None, cache_size: int = 100_000):
+        self.levels = []  # (index, name) of the named levels
+        filter_levels = []
+        for i, level in enumerate(pattern.split('/')):
+            match = LEVEL_NAME.match(level)
+            if match:
+                self.levels.append((i, match.group(1)))
+                level = '+'
+            filter_levels.append(level)
+        self.filter = '/'.join(filter_levels)
+        self.template = template or '/'.join('{%s}' % name for _, name in self.levels) or None
+        if self.template is not None:
+            unknown = set(re.findall(r'\{(\w+)', self.template)) - {name for _, name in self.levels}
+            if unknown:
+                raise ValueError(f"Key template {template!r} uses {sorted(unknown)}, not levels of {pattern!r}")
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def key(self, topic: str) -> str:
+        key = self.cache.get(topic)
+        if key is not None:
+            return key
+        if self.template is None:
+            key = topic
+        else:
+            parts = topic.split('/')
+            try:
+                key = self.template.format(**{name: parts[i] for i, name in self.levels})
+            except IndexError:
+                # Only reachable with a '#' ahead of a named level; keep the message anyway
+                key = topic
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[topic] = key
+        return key
+
+
+class AckWindow:
+    """
+    QoS 1 messages of the current connection in arrival order. `delivered()`
+    marks one as written to Kafka and sends the PUBACKs of the delivered
+    prefix, so acknowledgements keep the arrival order even when Kafka
+    partitions confirm out of order. After a reconnect, packet ids of the old
+    connection mean nothing: `reset()` forgets them and the broker sends
+    those messages again. `latency` (a histogram) gets the receive -> PUBACK
+    time of every message.
+    """
+
+    def __init__(self, ack, latency=None):
+        self.ack = ack  # ack(mid, qos)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.pending = deque()  # [mid, qos, received, delivered]
+        self.acked = 0
+
+    def add(self, mid: int, qos: int) -> list:
+        entry = [mid, qos, time.monotonic(), False]
+        with self.lock:
+            self.pending.append(entry)
+        return entry
+
+    def delivered(self, entry: list):
+        with self.lock:
+            entry[3] = True
+            pending = self.pending
+            now = time.monotonic()
+            while pending and pending[0][3]:
+                mid, qos, received, _ = pending.popleft()
+                self.ack(mid, qos)
+                self.acked += 1
+                if self.latency is not None:
+                    self.latency.observe(now - received)
+
+    def reset(self) -> int:
+        """Drop every unacknowledged message, returns how many there were."""
+        with self.lock:
+            dropped = len(self.pending)
+            self.pending = deque()
+        return dropped
+
+    def __len__(self):
+        return len(self.pending)
+
+
+def connect_client(config: dict, worker: int, on_message, on_connect, on_disconnect):
+    """A paho client with manual acknowledgements, connected and subscribed on every (re)connect."""
+    import paho.mqtt.client as mqtt
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+
+    v5 = config['mqtt_version'] == 5
+    client_id = f"{config['client_id']}-{worker}"
+    if v5:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                             protocol=mqtt.MQTTv5, manual_ack=True)
+    else:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                             protocol=mqtt.MQTTv311, clean_session=config['clean_session'],
+                             manual_ack=True)
+    subscription = config['topic_filter']
+    if config['share_group']:
+        subscription = f"$share/{config['share_group']}/{subscription}"
+
+    def handle_connect(client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logging.error(f"❌ MQTT connect refused: {reason_code}")
+            return
+        client.subscribe(subscription, qos=config['qos'])
+        on_connect()
+        logging.info(f"🔌 Worker {worker} subscribed to {subscription} on {config['host']}:{config['port']}")
+
+    def handle_disconnect(client, userdata, flags, reason_code, properties):
+        on_disconnect(reason_code)
+
+    client.on_connect = handle_connect
+    client.on_disconnect = handle_disconnect
+    client.on_message = on_message
+    client.reconnect_delay_set(min_delay=1, max_delay=30)
+    if v5:
+        properties = Properties(PacketTypes.CONNECT)
+        properties.ReceiveMaximum = config['receive_maximum']
+        # A persistent session keeps unacknowledged messages across restarts
+        properties.SessionExpiryInterval = 0 if config['clean_session'] else config['session_expiry_s']
+        client.connect(config['host'], config['port'], keepalive=config['keepalive'],
+                       clean_start=config['clean_session'], properties=properties)
+    else:
+        client.connect(config['host'], config['port'], keepalive=config['keepalive'])
+    return client, subscription
+
+
+def run_worker(worker: int, config: dict, stop=None) -> dict:
+    """
+    Bridge messages until `stop` (a multiprocessing Event) is set, then
+    unsubscribe, flush the producer so the last acknowledgements go out,
+    and disconnect. Returns the worker's counters.
+    """
+    from quixstreams import Application
+
+    # Worker i serves its metrics on METRICS_PORT + i
+    start_metrics_server(8006, offset=worker)
+    topic_keys = TopicKeys(config['topic_pattern'], config['key_template'])
+    config = {**config, 'topic_filter': topic_keys.filter}
+    app = Application(broker_address=config['kafka_broker'], loglevel="WARNING", producer_extra_config={
+        'linger.ms': config['linger_ms'],
+        'batch.size': config['batch_size'],
+        'compression.type': config['compression'],
+        'acks': 'all',
+        'enable.idempotence': True,
+    })
+    kafka_topic = config['kafka_topic']
+    counts = {'received': 0, 'produced': 0, 'errors': 0, 'dropped': 0, 'rejected': 0, 'connects': 0}
+    messages_in = MESSAGES_IN.labels(f"mqtt:{topic_keys.filter}")
+    messages_out = MESSAGES_OUT.labels(kafka_topic)
+    produce_errors = ERRORS.labels('bridge_produce')
+
+    with app.get_producer() as producer:
+        def give_up(topic, entry, error):
+            # Acknowledged anyway: left in the window it would hold back every PUBACK behind it
+            counts['rejected'] += 1
+            ERRORS.labels('bridge_dropped').inc()
+            logging.error(f"❌ Dropping MQTT message from {topic}: {error}")
+            if entry is not None:
+                acks.delivered(entry)
+
+        def produce(topic, key, payload, headers, entry, attempt=1):
+            def on_delivery(err, msg):
+                if err is not None:
+                    counts['errors'] += 1
+                    produce_errors.inc()
+                    if attempt >= config['delivery_attempts']:
+                        give_up(topic, entry, f"Kafka delivery failed {attempt} times: {err}")
+                        return
+                    # Still unacknowledged: send it again rather than drop it
+                    logging.warning(f"⚠️ Kafka delivery failed ({attempt}/{config['delivery_attempts']}), "
+                                    f"retrying: {err}")
+                    try:
+                        produce(topic, key, payload, headers, entry, attempt + 1)
+                    except Exception as e:
+                        give_up(topic, entry, e)
+                    return
+                counts['produced'] += 1
+                messages_out.inc()
+                if entry is not None:
+                    acks.delivered(entry)
+            producer.produce(topic=kafka_topic, key=key, value=payload, headers=headers,
+                             on_delivery=on_delivery)
+
+        def on_message(client, userdata, message):
+            counts['received'] += 1
+            messages_in.inc()
+            headers = {'mqtt_topic': message.topic} if config['topic_header'] else None
+            entry = acks.add(message.mid, message.qos) if message.qos else None
+            while True:
+                try:
+                    produce(message.topic, topic_keys.key(message.topic), message.payload, headers, entry)
+                    return
+                except BufferError:
+                    # Local queue full: serve delivery reports (and their PUBACKs) until there is room
+                    producer.poll(0.1)
+                except Exception as e:
+                    # Oversized or otherwise unproducible: sending it again would fail the same way
+                    counts['errors'] += 1
+                    produce_errors.inc()
+                    give_up(message.topic, entry, e)
+                    return
+
+        def on_connect():
+            counts['connects'] += 1
+
+        def on_disconnect(reason_code):
+            dropped = acks.reset()
+            counts['dropped'] += dropped
+            if stop is None or not stop.is_set():
+                logging.warning(f"⚠️ Worker {worker} disconnected ({reason_code}), "
+                                f"{dropped} unacknowledged messages will be redelivered")
+
+        # The callbacks only run once the network loop is started
+        client, subscription = connect_client(config, worker, on_message, on_connect, on_disconnect)
+        acks = AckWindow(client.ack, STAGE_LATENCY.labels('mqtt_to_kafka'))
+        client.loop_start()
+        acked = 0
+        last_report = time.monotonic()
+        try:
+            # Delivery callbacks, and so the PUBACKs, run on this thread (and on the MQTT
+            # thread while on_message waits for room in the producer queue)
+            while stop is None or not stop.is_set():
+                producer.poll(0.05)
+                now = time.monotonic()
+                if now - last_report >= 5.0:
+                    MQTT_UNACKED.labels(str(worker)).set(len(acks))
+                    if acks.acked > acked:
+                        logging.info(f"Worker {worker}: {(acks.acked - acked) / (now - last_report):.1f} msgs/s "
+                                     f"acknowledged, {len(acks)} waiting for Kafka")
+                    acked, last_report = acks.acked, now
+        finally:
+            client.unsubscribe(subscription)
+            producer.flush()
+            client.disconnect()
+            client.loop_stop()
+    return {'worker': worker, 'acked': acks.acked, **counts}
@@ -0,0 +1,121 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+# Load environment variables (useful when working locally)
+from dotenv import load_dotenv
+load_dotenv(".env")
+
+from bridge import TopicKeys, run_worker
+
+# Logggin env
+log_level_str = os.getenv("LOG_LEVEL", "INFO").upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+
+logging.basicConfig(
+    level=log_level,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+# --- MQTT Setup ---
+MQTT_BROKER = os.getenv("MQTT_BROKER", "172.16.2.117")
+MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+# 4 = MQTT 3.1.1, 5 = MQTT 5
+MQTT_VERSION = int(os.getenv("MQTT_VERSION", 4))
+MQTT_QOS = int(os.getenv("MQTT_QOS", 1))
+# Topic filter; named levels become parts of the Kafka key, e.g. devices/{site}/{device}/telemetry
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "devices/{device}/#")
+# Kafka key built from the named levels, e.g. {site}.{device}; empty = the named levels joined
+# by '/', or the whole MQTT topic if it has none
+MQTT_KEY_TEMPLATE = os.getenv("MQTT_KEY_TEMPLATE", "")
+# Workers subscribe as $share/<group>/<filter>; empty = plain subscription (every worker gets everything)
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "kafka-bridge")
+# Worker i connects as <MQTT_CLIENT_ID>-<i>; persistent sessions get unacknowledged messages back after a restart
+MQTT_CLIENT_ID = os.getenv("MQTT_CLIENT_ID", "kafka-bridge")
+MQTT_CLEAN_SESSION = os.getenv("MQTT_CLEAN_SESSION", "false").lower() == "true"
+MQTT_SESSION_EXPIRY_S = int(os.getenv("MQTT_SESSION_EXPIRY_S", 3600))
+MQTT_KEEPALIVE = int(os.getenv("MQTT_KEEPALIVE", 60))
+# MQTT 5 only: unacknowledged messages the broker may send each worker (3.1.1 uses the broker's max_inflight_messages)
+MQTT_RECEIVE_MAXIMUM = int(os.getenv("MQTT_RECEIVE_MAXIMUM", 1000))
+# Add the MQTT topic as a Kafka header
+MQTT_TOPIC_HEADER = os.getenv("MQTT_TOPIC_HEADER", "false").lower() == "true"
+
+# --- Kafka Setup ---
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "172.16.2.117:9092")
+KAFKA_INPUT_TOPIC = os.getenv("KAFKA_INPUT_TOPIC", "event-frames-model")
+# A PUBACK waits for the Kafka delivery, so the linger adds to every message's
+# time in the broker's in-flight window; keep it small
+BRIDGE_LINGER_MS = float(os.getenv("BRIDGE_LINGER_MS", 5))
+BRIDGE_BATCH_SIZE = int(os.getenv("BRIDGE_BATCH_SIZE", 1_000_000))
+BRIDGE_COMPRESSION = os.getenv("BRIDGE_COMPRESSION", "lz4")
+BRIDGE_WORKERS = int(os.getenv("BRIDGE_WORKERS", 1))
+# Produce attempts per message (each after the producer's own retries ran out) before it is dropped
+BRIDGE_DELIVERY_ATTEMPTS = int(os.getenv("BRIDGE_DELIVERY_ATTEMPTS", 3))
+
+
+def bridge_config() -> dict:
+    # Fail on a bad pattern/template before starting any worker
+    TopicKeys(MQTT_TOPIC, MQTT_KEY_TEMPLATE)
+    return {
+        'host': MQTT_BROKER,
+        'port': MQTT_PORT,
+        'mqtt_version': MQTT_VERSION,
+        'qos': MQTT_QOS,
+        'topic_pattern': MQTT_TOPIC,
+        'key_template': MQTT_KEY_TEMPLATE,
+        'share_group': MQTT_SHARE_GROUP,
+        'client_id': MQTT_CLIENT_ID,
+        'clean_session': MQTT_CLEAN_SESSION,
+        'session_expiry_s': MQTT_SESSION_EXPIRY_S,
+        'keepalive': MQTT_KEEPALIVE,
+        'receive_maximum': MQTT_RECEIVE_MAXIMUM,
+        'topic_header': MQTT_TOPIC_HEADER,
+        'kafka_broker': KAFKA_BROKER,
+        'kafka_topic': KAFKA_INPUT_TOPIC,
+        'linger_ms': BRIDGE_LINGER_MS,
+        'batch_size': BRIDGE_BATCH_SIZE,
+        'compression': BRIDGE_COMPRESSION,
+        'delivery_attempts': max(1, BRIDGE_DELIVERY_ATTEMPTS),
+    }
+
+
+def main():
+    """Run BRIDGE_WORKERS worker processes and restart any that dies, until SIGTERM/SIGINT."""
+    config = bridge_config()
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+
+    def start(worker: int):
+        process = ctx.Process(target=run_worker, args=(worker, config, stop), name=f"bridge-{worker}")
+        process.start()
+        return process
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    logging.info(f"🌉 Bridging MQTT {MQTT_BROKER}:{MQTT_PORT} {MQTT_TOPIC} -> Kafka {KAFKA_INPUT_TOPIC} "
+                 f"with {BRIDGE_WORKERS} workers (share group {MQTT_SHARE_GROUP or 'none'})")
+    workers = [start(i) for i in range(BRIDGE_WORKERS)]
+    while not stop.is_set():
+        stop.wait(1.0)
+        for i, process in enumerate(workers):
+            if not process.is_alive() and not stop.is_set():
+                logging.error(f"❌ Worker {i} exited with code {process.exitcode}, restarting")
+                time.sleep(1.0)
+                workers[i] = start(i)
+    # Workers unsubscribe, flush their producers and send their last PUBACKs
+    for process in workers:
+        process.join(30)
+        if process.is_alive():
+            process.terminate()
+    logging.info("Bridge stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+One-shot historical backfill for the publisher.
+
+Pushes a whole history (CSV or Parquet with `timestamp` and `value`) to the
+input topic as fast as the brokers take it, then stops and prints a
+throughput summary. The history is sorted by time and cut into `--keys`
+contiguous time slices of equal size; each slice is published under its own
+message key, in order, so per-key features (Lag, Rolling_Mean) stay correct
+inside a slice while the keys spread the load over the partitions
+(`--partitions N` pins slice i to partition i % N for an exact spread).
+Slices are split over producer processes in time order, and every process
+only keeps its own time range in memory. With Parquet, the timestamp filter
+also skips row groups outside that range. A CSV has no such index, so the
+planner reads its whole timestamp column and every process scans the whole
+file: memory is bounded per process, I/O is not (it grows with the number of
+processes). Convert large CSV histories to Parquet first.
+
+Producers batch aggressively (`--linger-ms`, `--batch-size`), compress, and
+count delivery reports asynchronously; nothing is logged per message.
+
+Usage:
+    python backfill.py --source history.parquet --processes 8 --keys 64
+    PUBLISH_MODE=backfill python main.py --source nyc_taxi.csv
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from replay import build_payloads
+from sources import CsvSource
+
+
+def read_source(path: str, start=None, end=None) -> pd.DataFrame:
+    """(timestamp, value) rows with start <= timestamp < end (either bound may be None), in time order."""
+    if path.endswith(('.parquet', '.pq')):
+        filters = []
+        if start is not None:
+            filters.append(('timestamp', '>=', start))
+        if end is not None:
+            filters.append(('timestamp', '<', end))
+        df = pd.read_parquet(path, columns=['timestamp', 'value'], filters=filters or None)
+    else:
+        # Filter chunk by chunk: the whole file is read, but only this time range is kept
+        parts = []
+        for chunk in CsvSource(path).chunks():
+            if start is not None:
+                chunk = chunk[chunk['timestamp'] >= start]
+            if end is not None:
+                chunk = chunk[chunk['timestamp'] < end]
+            parts.append(chunk)
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame({
+            'timestamp': pd.Series(dtype='datetime64[ns]'), 'value': pd.Series(dtype='int64')})
+    if df['timestamp'].dt.tz is not None:
+        df['timestamp'] = df['timestamp'].dt.tz_convert('UTC').dt.tz_localize(None)
+    return df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def plan_slices(path: str, keys: int, processes: int) -> list:
+    """
+    Per process, a list of (slice number, start, end) covering the history
+    in time order; slices hold about the same number of rows. Reads the
+    whole timestamp column.
+    """
+    if path.endswith(('.parquet', '.pq')):
+        timestamps = pd.read_parquet(path, columns=['timestamp'])['timestamp']
+    else:
+        timestamps = pd.read_csv(path, usecols=['timestamp'], parse_dates=['timestamp'])['timestamp']
+    timestamps = np.sort(timestamps.to_numpy())
+    keys = max(1, min(keys, len(timestamps)))
+    # Slice boundaries are timestamps, so rows sharing one never straddle two slices
+    bounds = [None] + [pd.Timestamp(timestamps[len(timestamps) * i // keys]) for i in range(1, keys)] + [None]
+    slices = [(i, bounds[i], bounds[i + 1]) for i in range(keys)]
+    processes = max(1, min(processes, keys))
+    return [slices[len(slices) * w // processes:len(slices) * (w + 1) // processes] for w in range(processes)]
+
+
+def run_worker(worker: int, slices: list, config: dict) -> dict:
+    """Publish this worker's slices and wait until every message is acknowledged."""
+    from quixstreams import Application
+
+    started = time.perf_counter()
+    df = read_source(config['source'], slices[0][1], slices[-1][2])
+    read_seconds = time.perf_counter() - started
+
+    app = Application(broker_address=config['broker'], loglevel="WARNING", producer_extra_config={
+        'linger.ms': config['linger_ms'],
+        'batch.size': config['batch_size'],
+        'compression.type': config['compression'],
+        'queue.buffering.max.messages': 1_000_000,
+        'queue.buffering.max.kbytes': 1_048_576,
+    })
+    counts = {'delivered': 0, 'errors': 0}
+
+    def on_delivery(err, msg):
+        counts['errors' if err is not None else 'delivered'] += 1
+
+    timestamps = df['timestamp'].to_numpy()
+    sent = 0
+    payload_bytes = 0
+    with app.get_producer() as producer:
+        produce = producer.produce
+        for number, start, end in slices:
+            lo = 0 if start is None else timestamps.searchsorted(start.to_datetime64())
+            hi = len(df) if end is None else timestamps.searchsorted(end.to_datetime64())
+            payloads, timestamps_ms = build_payloads(df.iloc[lo:hi], config['wire_format'])
+            key = f"{config['key_prefix']}{number:05d}"
+            partition = number % config['partitions'] if config['partitions'] else None
+            for payload, timestamp_ms in zip(payloads, timestamps_ms):
+                produce(topic=config['topic'], key=key, value=payload, timestamp=timestamp_ms,
+                        partition=partition, on_delivery=on_delivery)
+            sent += len(payloads)
+            payload_bytes += sum(map(len, payloads))
+        produce_seconds = time.perf_counter() - started
+    # Leaving the producer context flushed it: every delivery report is in
+    return {
+        'worker': worker,
+        'slices': len(slices),
+        'sent': sent,
+        'bytes': payload_bytes,
+        'read_seconds': read_seconds,
+        'produce_seconds': produce_seconds,
+        'seconds': time.perf_counter() - started,
+        **counts,
+    }
+
+
+def summarize(results: list, seconds: float) -> dict:
+    sent = sum(r['sent'] for r in results)
+    payload_bytes = sum(r['bytes'] for r in results)
+    return {
+        'processes': len(results),
+        'keys': sum(r['slices'] for r in results),
+        'sent': sent,
+        'delivered': sum(r['delivered'] for r in results),
+        'errors': sum(r['errors'] for r in results),
+        'seconds': round(seconds, 3),
+        'read_seconds': round(max(r['read_seconds'] for r in results), 3),
+        'rate': round(sent / seconds, 1) if seconds else None,
+        'mb_per_s': round(payload_bytes / seconds / 1e6, 2) if seconds else None,
+        'bytes_per_msg': round(payload_bytes / sent, 1) if sent else None,
+    }
+
+
+def run_backfill(config: dict) -> dict:
+    """Fan the time slices out over `processes` producer processes and return the summary."""
+    started = time.perf_counter()
+    plan = plan_slices(config['source'], config['keys'], config['processes'])
+    logging.info(f"Backfilling {config['source']} to {config['topic']}: "
+                 f"{sum(map(len, plan))} keys over {len(plan)} processes")
+    if len(plan) == 1:
+        results = [run_worker(0, plan[0], config)]
+    else:
+        with multiprocessing.get_context("spawn").Pool(len(plan)) as pool:
+            results = pool.starmap(run_worker, [(w, slices, config) for w, slices in enumerate(plan)])
+    summary = summarize(results, time.perf_counter() - started)
+    logging.info(f"Backfill done: {summary['sent']} messages in {summary['seconds']}s "
+                 f"({summary['rate']} msgs/s, {summary['errors']} errors)")
+    return summary
+
+
+def parse_args(argv=None) -> dict:
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default=os.getenv("KAFKA_BROKER", "172.16.2.117:9092"))
+    parser.add_argument("--topic", default=os.getenv("KAFKA_INPUT_TOPIC", "event-frames-model"))
+    parser.add_argument("--source", default=os.path.join(script_dir, os.getenv("DEMO_DATA_CSV", "nyc_taxi.csv")),
+                        help="CSV or Parquet with timestamp,value")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--keys", type=int, default=64, help="time slices, each published under its own key")
+    parser.add_argument("--partitions", type=int, default=0,
+                        help="pin slice i to partition i %% N, 0 = partition by key hash")
+    parser.add_argument("--linger-ms", type=float, default=100)
+    parser.add_argument("--batch-size", type=int, default=1_000_000, help="max producer batch size in bytes")
+    parser.add_argument("--compression", default="lz4", choices=["none", "gzip", "snappy", "lz4", "zstd"])
+    parser.add_argument("--key-prefix", default="BACKFILL_")
+    parser.add_argument("--wire-format", default=os.getenv("WIRE_FORMAT", "json"), choices=["json", "binary"])
+    return vars(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    print(json.dumps(run_backfill(parse_args()), indent=2))
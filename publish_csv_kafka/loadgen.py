@@ -0,0 +1,182 @@
+"""
+Multi-device synthetic load generator built on the CSV template.
+
+Simulates N virtual devices, each with its own message key, a time offset,
+amplitude scaling, Gaussian noise and injected anomalies, so the keyed
+traffic spreads across the topic's partitions. Devices are split over
+producer processes; every process paces its share of the total rate and
+measures delivery latency from the producer's delivery callbacks.
+
+Usage:
+    python loadgen.py --devices 1000 --processes 4 --rate 20000 --duration 60
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from replay import TokenBucket, build_payloads
+
+LATENCY_SAMPLES = 100_000
+
+
+def device_frame(template: pd.DataFrame, device: int, seed: int, offset_minutes: float,
+                 amplitude: float, noise: float, anomaly_rate: float, anomaly_scale: float) -> pd.DataFrame:
+    """Derive one device's series from the template."""
+    rng = np.random.default_rng(seed + device)
+    values = template['value'].to_numpy(dtype=np.float64)
+    values = values * rng.uniform(1 - amplitude, 1 + amplitude)
+    if noise:
+        values = values + rng.normal(0, noise * values.std(), len(values))
+    if anomaly_rate:
+        spikes = rng.random(len(values)) < anomaly_rate
+        values[spikes] *= rng.choice([1 / anomaly_scale, anomaly_scale], spikes.sum())
+    offset = pd.Timedelta(minutes=offset_minutes * rng.random())
+    return pd.DataFrame({
+        'timestamp': (template['timestamp'] + offset).dt.floor('s'),
+        'value': np.round(np.maximum(values, 0)).astype(np.int64),
+    })
+
+
+class LatencyRecorder:
+    """Reservoir sample of delivery latencies plus delivered/error counters."""
+
+    def __init__(self, size: int = LATENCY_SAMPLES):
+        self.size = size
+        self.samples = []
+        self.seen = 0
+        self.delivered = 0
+        self.errors = 0
+
+    def callback(self, sent_at: float):
+        def on_delivery(err, msg):
+            if err is not None:
+                self.errors += 1
+                return
+            self.delivered += 1
+            self.record(time.perf_counter() - sent_at)
+        return on_delivery
+
+    def record(self, latency: float):
+        self.seen += 1
+        if len(self.samples) < self.size:
+            self.samples.append(latency)
+        else:
+            i = random.randrange(self.seen)
+            if i < self.size:
+                self.samples[i] = latency
+
+
+def run_worker(worker: int, config: dict) -> dict:
+    """Publish the devices assigned to this worker until the duration or message budget runs out."""
+    from quixstreams import Application
+
+    template = pd.read_csv(config['csv'], parse_dates=['timestamp'])
+    devices = range(worker, config['devices'], config['processes'])
+    streams = []
+    for device in devices:
+        frame = device_frame(template, device, config['seed'], config['offset_minutes'],
+                             config['amplitude'], config['noise'], config['anomaly_rate'],
+                             config['anomaly_scale'])
+        payloads, timestamps_ms = build_payloads(frame, config['wire_format'])
+        streams.append((f"{config['key_prefix']}{device:05d}", payloads, timestamps_ms))
+
+    rate = config['rate'] / config['processes'] if config['rate'] else 0
+    pacer = TokenBucket(rate)
+    recorder = LatencyRecorder()
+    budget = config['messages'] // config['processes'] if config['messages'] else None
+    deadline = time.monotonic() + config['duration'] if config['duration'] else None
+
+    app = Application(broker_address=config['broker'], loglevel="WARNING")
+    producer = app.get_producer()
+    sent = 0
+    started = time.perf_counter()
+    with producer:
+        # Round-robin over devices row by row so every key advances together
+        for row in range(len(template)):
+            for key, payloads, timestamps_ms in streams:
+                pacer.wait()
+                producer.produce(topic=config['topic'], key=key, value=payloads[row],
+                                 timestamp=timestamps_ms[row],
+                                 on_delivery=recorder.callback(time.perf_counter()))
+                sent += 1
+                if budget is not None and sent >= budget:
+                    break
+            if (budget is not None and sent >= budget) or (deadline is not None and time.monotonic() > deadline):
+                break
+        producer_elapsed = time.perf_counter() - started
+    elapsed = time.perf_counter() - started
+
+    return {
+        'worker': worker,
+        'devices': len(streams),
+        'sent': sent,
+        'delivered': recorder.delivered,
+        'errors': recorder.errors,
+        'produce_seconds': producer_elapsed,
+        'seconds': elapsed,
+        'latencies': recorder.samples,
+    }
+
+
+def summarize(results: list) -> dict:
+    latencies = np.array([x for r in results for x in r['latencies']]) * 1000
+    seconds = max(r['seconds'] for r in results)
+    sent = sum(r['sent'] for r in results)
+    delivered = sum(r['delivered'] for r in results)
+    summary = {
+        'devices': sum(r['devices'] for r in results),
+        'processes': len(results),
+        'sent': sent,
+        'delivered': delivered,
+        'errors': sum(r['errors'] for r in results),
+        'seconds': round(seconds, 3),
+        'produce_rate': round(sent / max(r['produce_seconds'] for r in results), 1),
+        'delivered_rate': round(delivered / seconds, 1),
+    }
+    if len(latencies):
+        for q in (50, 95, 99):
+            summary[f'delivery_p{q}_ms'] = round(float(np.percentile(latencies, q)), 3)
+        summary['delivery_max_ms'] = round(float(latencies.max()), 3)
+    return summary
+
+
+def run_loadgen(config: dict) -> dict:
+    """Fan the devices out over `processes` producer processes and return the summary."""
+    if config['processes'] == 1:
+        results = [run_worker(0, config)]
+    else:
+        with multiprocessing.get_context("spawn").Pool(config['processes']) as pool:
+            results = pool.starmap(run_worker, [(w, config) for w in range(config['processes'])])
+    return summarize(results)
+
+
+def parse_args(argv=None) -> dict:
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default=os.getenv("KAFKA_BROKER", "172.16.2.117:9092"))
+    parser.add_argument("--topic", default=os.getenv("KAFKA_INPUT_TOPIC", "event-frames-model"))
+    parser.add_argument("--csv", default=os.path.join(script_dir, os.getenv("DEMO_DATA_CSV", "nyc_taxi.csv")))
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=0, help="total msgs/s, 0 = unlimited")
+    parser.add_argument("--duration", type=float, default=60, help="seconds, 0 = until the template ends")
+    parser.add_argument("--messages", type=int, default=0, help="total message budget, 0 = no limit")
+    parser.add_argument("--offset-minutes", type=float, default=60 * 24 * 7, help="max per-device time offset")
+    parser.add_argument("--amplitude", type=float, default=0.3, help="+/- amplitude scaling per device")
+    parser.add_argument("--noise", type=float, default=0.05, help="noise std as a fraction of the series std")
+    parser.add_argument("--anomaly-rate", type=float, default=0.001)
+    parser.add_argument("--anomaly-scale", type=float, default=3.0)
+    parser.add_argument("--key-prefix", default="DEVICE_")
+    parser.add_argument("--wire-format", default=os.getenv("WIRE_FORMAT", "json"), choices=["json", "binary"])
+    parser.add_argument("--seed", type=int, default=0)
+    return vars(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    print(json.dumps(run_loadgen(parse_args()), indent=2))
@@ -5,14 +5,22 @@ from quixstreams.models.serializers.quix import JSONSerializer, SerializationCon
 # (see https://quix.io/docs/quix-streams/v2-0-latest/api-reference/quixstreams.html for more details)
 
 # Import additional modules as needed
-import pandas as pd
 import random
 import time
 import os
-import logging
+import sys
 import json
+import logging
 from datetime import datetime
 
+from replay import TimeWarp, TokenBucket, build_payloads, burst_profile
+from sources import DEFAULT_CHUNK_ROWS, open_source
+
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import MESSAGES_OUT, PRODUCER_QUEUE_DEPTH, STAGES, start_metrics_server
+from common.wire import EVENT, WireSerializer
+
 # for local dev, load env vars from a .env file
 from dotenv import load_dotenv
 load_dotenv()
@@ -34,6 +42,30 @@ UID = os.getenv("UID", "123456789")
 DELAY_DATA_INGEST_SECOND = float(os.getenv("DELAY_DATA_INGEST_SECOND", 1))
 DEMO_DATA_CSV = os.getenv("DEMO_DATA_CSV", "nyc_taxi.csv")
 
+# Replay pacing (see replay.py)
+# PUBLISH_RATE: msgs/s, 0 = unlimited; defaults to 1 / DELAY_DATA_INGEST_SECOND
+PUBLISH_RATE = float(os.getenv("PUBLISH_RATE", 1 / DELAY_DATA_INGEST_SECOND if DELAY_DATA_INGEST_SECOND > 0 else 0))
+# PUBLISH_TIME_WARP: replay at K x the data's own cadence instead of a fixed rate
+PUBLISH_TIME_WARP = float(os.getenv("PUBLISH_TIME_WARP", 0))
+PUBLISH_BURST_FACTOR = float(os.getenv("PUBLISH_BURST_FACTOR", 1))
+PUBLISH_BURST_EVERY_S = float(os.getenv("PUBLISH_BURST_EVERY_S", 60))
+PUBLISH_BURST_SECONDS = float(os.getenv("PUBLISH_BURST_SECONDS", 0))
+PUBLISH_JITTER = float(os.getenv("PUBLISH_JITTER", 0))
+LOG_EVERY_N = int(os.getenv("LOG_EVERY_N", 1000))
+# WIRE_FORMAT: "json" or "binary" (see common/wire.py); consumers read both
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "json").lower()
+# PUBLISH_MODE: "replay" (default), "loadgen" (N virtual devices, see loadgen.py) or
+# "backfill" (publish a whole history once, as fast as possible, see backfill.py); CLI args are passed through
+PUBLISH_MODE = os.getenv("PUBLISH_MODE", "replay")
+# Input (see sources.py): a CSV, Parquet or Arrow file, a directory or a glob; defaults to DEMO_DATA_CSV
+PUBLISH_SOURCE = os.getenv("PUBLISH_SOURCE", "")
+# Rows parsed at a time, this bounds the publisher's memory
+PUBLISH_CHUNK_ROWS = int(os.getenv("PUBLISH_CHUNK_ROWS", DEFAULT_CHUNK_ROWS))
+# Several input files are merged by timestamp, or with "false" published one after the other
+PUBLISH_MERGE = os.getenv("PUBLISH_MERGE", "true").lower() == "true"
+PUBLISH_TIMESTAMP_COLUMN = os.getenv("PUBLISH_TIMESTAMP_COLUMN", "timestamp")
+PUBLISH_VALUE_COLUMN = os.getenv("PUBLISH_VALUE_COLUMN", "value")
+
 # Validate the config
 if KAFKA_INPUT_TOPIC == "":
     raise ValueError("output (topic) environment variable is required")
@@ -48,7 +80,7 @@ app = Application(broker_address=KAFKA_BROKER,
 # Create the producer, this is used to write data to the output topic
 producer = app.get_producer()
 # create a topic object for use later on
-output_topic = app.topic(KAFKA_INPUT_TOPIC, value_serializer="json")
+output_topic = app.topic(KAFKA_INPUT_TOPIC, value_serializer=WireSerializer(EVENT, WIRE_FORMAT))
 
 logging.info(f"Connected: KAFKA={KAFKA_BROKER}")
 # Define a serializer for messages, using JSON Serializer for ease
@@ -56,58 +88,61 @@ serializer = JSONSerializer()
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.realpath(__file__))
-# Construct the path to the CSV file
-csv_file_path = os.path.join(script_dir, DEMO_DATA_CSV)
+# Construct the path to the input: PUBLISH_SOURCE, or the demo CSV next to this script
+source_spec = PUBLISH_SOURCE or os.path.join(script_dir, DEMO_DATA_CSV)
 
 
-# this function loads the file and sends each row to the publisher
-def read_csv_file(file_path: str):
+# this function streams the input and sends each row to the publisher
+def read_source(spec: str):
     """
-    A function to read data from a CSV file in an endless manner.
-    It returns a generator with stream_id and rows
+    A function to read data from the input in an endless manner, one chunk
+    of PUBLISH_CHUNK_ROWS rows at a time (see sources.py).
+    It returns a generator with stream_id, serialized rows and their timestamps
     """
-
-    # Read the CSV file into a pandas.DataFrame, parsing 'timestamp' as datetime objects
-    logging.info("CSV file loading.")
-    df = pd.read_csv(file_path, parse_dates=['timestamp'])
-    print("File loaded.")
-
-    # Get the number of rows in the dataFrame for printing out later
-    row_count = len(df)
+    source = open_source(spec, chunk_rows=PUBLISH_CHUNK_ROWS, merge=PUBLISH_MERGE,
+                         timestamp_column=PUBLISH_TIMESTAMP_COLUMN, value_column=PUBLISH_VALUE_COLUMN)
+    logging.info(f"Reading {source} in chunks of {PUBLISH_CHUNK_ROWS} rows.")
 
     # Generate a unique ID for this data stream.
     # It will be used as a message key in Kafka
     stream_id = f"CSV_DATA_{str(random.randint(1, 100)).zfill(3)}"
 
-    # Get the column headers as a list
-    headers = df.columns.tolist()
+    # An input that fits in one chunk is serialized once, up front, instead of on every loop
+    cached = None
 
     # Continuously loop over the data
     while True:
-        # Print a message to the console for each iteration 
-        print(f"Publishing {row_count} rows.")
-
-        # Iterate over the rows and convert them to
-        for _, row in df.iterrows():
-            # Create a dictionary that includes both column headers and row values
-            # We convert the datetime object to a string for the JSON payload
-            row_data = {
-                'timestamp': row['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
-                'value': row['value']
-            }
-
-            # Convert the datetime object to a timestamp in milliseconds
-            row_data["timestamp_ms"] = int(row['timestamp'].timestamp() * 1000)
-            
-            # Yield the stream ID and the row data
-            yield stream_id, row_data
-
-        print("All rows published")
+        # Serialize a whole chunk at once
+        batches = [cached] if cached is not None else (build_payloads(chunk, WIRE_FORMAT) for chunk in source.chunks())
+        row_count, chunk_count = 0, 0
+        for batch in batches:
+            payloads, timestamps_ms = batch
+            for payload, timestamp_ms in zip(payloads, timestamps_ms):
+                # Yield the stream ID and the serialized row
+                yield stream_id, payload, timestamp_ms
+            row_count += len(payloads)
+            chunk_count += 1
+        if chunk_count == 1:
+            cached = batch
+
+        print(f"All {row_count} rows published")
 
         # Wait a moment before outputting more data.
         time.sleep(5) # wait for next loop
 
 
+def make_pacer():
+    """Build the pacer selected by the PUBLISH_* settings."""
+    if PUBLISH_TIME_WARP > 0:
+        logging.info(f"Pacing: time-warp x{PUBLISH_TIME_WARP}, jitter {PUBLISH_JITTER}")
+        return TimeWarp(PUBLISH_TIME_WARP, jitter=PUBLISH_JITTER)
+    profile = None
+    if PUBLISH_BURST_SECONDS > 0 and PUBLISH_BURST_FACTOR != 1:
+        profile = burst_profile(PUBLISH_BURST_FACTOR, PUBLISH_BURST_EVERY_S, PUBLISH_BURST_SECONDS)
+    logging.info(f"Pacing: {PUBLISH_RATE or 'unlimited'} msgs/s, burst x{PUBLISH_BURST_FACTOR}, jitter {PUBLISH_JITTER}")
+    return TokenBucket(PUBLISH_RATE, profile=profile, jitter=PUBLISH_JITTER)
+
+
 def main():
     """
     Read data from the CSV file and publish it to Kafka
@@ -115,27 +150,50 @@ def main():
 
     # Create a pre-configured Producer object.
     producer = app.get_producer()
+    pacer = make_pacer()
+    messages_out = MESSAGES_OUT.labels(output_topic.name)
+    produce_latency = STAGES['produce']
 
     with producer:
+        sent = 0
+        window_start = time.monotonic()
+        last_ts = None
         # Iterate over the data from CSV file
-        for message_key, row_data in read_csv_file(file_path=csv_file_path):
-            
-            # Serialize row value to bytes
-            serialized_value = json.dumps(row_data).encode("utf-8")
+        for message_key, serialized_value, timestamp_ms in read_source(source_spec):
+            # A new pass over the file restarts the time-warp clock
+            if isinstance(pacer, TimeWarp) and last_ts is not None and timestamp_ms < last_ts:
+                pacer.reset()
+            last_ts = timestamp_ms
+            pacer.wait(timestamp_ms)
 
             # publish the data to the topic
-            producer.produce(
-                topic=output_topic.name,
-                key=message_key,
-                value=serialized_value,
-                timestamp=row_data['timestamp_ms'],
-            )
-
-            logging.info(f"Publish topic-{output_topic.name} data-{row_data}")
-            time.sleep(DELAY_DATA_INGEST_SECOND)
+            with produce_latency.time():
+                producer.produce(
+                    topic=output_topic.name,
+                    key=message_key,
+                    value=serialized_value,
+                    timestamp=timestamp_ms,
+                )
+            messages_out.inc()
+
+            logging.debug(f"Publish topic-{output_topic.name} data-{serialized_value!r}")
+            sent += 1
+            if sent % LOG_EVERY_N == 0:
+                now = time.monotonic()
+                logging.info(f"Published {sent} messages to {output_topic.name} ({LOG_EVERY_N / (now - window_start):.1f} msgs/s)")
+                PRODUCER_QUEUE_DEPTH.set(len(producer))
+                window_start = now
 
 if __name__ == "__main__":
     try:
-        main()
+        if PUBLISH_MODE == "loadgen":
+            from loadgen import parse_args, run_loadgen
+            print(json.dumps(run_loadgen(parse_args(sys.argv[1:])), indent=2))
+        elif PUBLISH_MODE == "backfill":
+            from backfill import parse_args, run_backfill
+            print(json.dumps(run_backfill(parse_args(sys.argv[1:])), indent=2))
+        else:
+            start_metrics_server(8001)
+            main()
     except KeyboardInterrupt:
         print("Exiting.")
\ No newline at end of file
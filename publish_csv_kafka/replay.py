@@ -0,0 +1,140 @@
+"""
+Replay engine for the CSV publisher.
+
+`build_payloads` turns the whole CSV into ready-to-send JSON (or binary, see
+common/wire.py) messages in one vectorized pass. Pacers decide when each message may go out:
+
+- `TokenBucket`: fixed rate in msgs/s (0 = unlimited), optionally shaped by a
+  burst profile and jitter
+- `TimeWarp`: follows the data's own timestamps, K times faster than real time
+"""
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.wire import BINARY_FORMAT, JSON_FORMAT, encode_events
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def build_payloads(df: pd.DataFrame, wire_format: str = JSON_FORMAT):
+    """
+    Serialize every row of a (timestamp, value) frame at once.
+    Returns (payloads, timestamps_ms): lists of message bytes and epoch ms, in
+    row order. The JSON matches `json.dumps({'timestamp', 'value', 'timestamp_ms'})`,
+    the binary form is `common.wire.encode` of the same dict.
+    """
+    timestamps_ms = (df['timestamp'] - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    if wire_format == BINARY_FORMAT:
+        return encode_events(timestamps_ms.to_numpy(), df['value'].to_numpy()), timestamps_ms.tolist()
+    values = df['value']
+    if pd.api.types.is_float_dtype(values):
+        special = ~np.isfinite(values.to_numpy())
+        text = values.map(repr)
+        if special.any():
+            # repr gives nan/inf, json.dumps the NaN/Infinity tokens json.loads accepts
+            text[special] = values[special].map(json.dumps)
+        values = text
+    payloads = ('{"timestamp": "' + df['timestamp'].dt.strftime(TIMESTAMP_FORMAT)
+                + '", "value": ' + values.astype(str)
+                + ', "timestamp_ms": ' + timestamps_ms.astype(str) + '}')
+    return [p.encode('utf-8') for p in payloads.tolist()], timestamps_ms.tolist()
+
+
+def burst_profile(factor: float, every_s: float, duration_s: float):
+    """Rate multiplier: `factor` for `duration_s` at the start of every `every_s` period, else 1."""
+    def multiplier(elapsed: float) -> float:
+        return factor if elapsed % every_s < duration_s else 1.0
+    return multiplier
+
+
+class TokenBucket:
+    """
+    Blocks until a token is available at `rate` tokens per second.
+    `capacity` tokens may be spent back-to-back after an idle period; the
+    default (50 ms worth) also absorbs sleep overshoot at high rates.
+    `profile(elapsed_s)` scales the rate over time (see `burst_profile`) and
+    `jitter` randomizes each token's cost by +/- that fraction.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, profile=None, jitter: float = 0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        if capacity is None:
+            capacity = (rate or 0) / 20
+        # A jittered token may cost up to 1 + jitter, the bucket must be able to hold it
+        self.capacity = max(1.0 + jitter, capacity)
+        self.profile = profile
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.started = clock()
+        self.updated = self.started
+        self.tokens = self.capacity
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.rate or self.rate <= 0
+
+    def current_rate(self) -> float:
+        if self.profile is None:
+            return self.rate
+        return self.rate * self.profile(self.clock() - self.started)
+
+    def wait(self, _timestamp_ms=None):
+        if self.unlimited:
+            return
+        cost = 1.0
+        if self.jitter:
+            cost *= 1.0 + random.uniform(-self.jitter, self.jitter)
+        while True:
+            now = self.clock()
+            rate = self.current_rate()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            if self.tokens >= cost:
+                self.tokens -= cost
+                return
+            self.sleep((cost - self.tokens) / rate)
+
+
+class TimeWarp:
+    """
+    Paces messages by their event time: a gap of N seconds in the data is
+    replayed as N / speed seconds, with optional +/- `jitter` per gap.
+    """
+
+    def __init__(self, speed: float, jitter: float = 0, clock=time.monotonic, sleep=time.sleep):
+        self.speed = speed
+        self.jitter = jitter
+        self.clock = clock
+        self.sleep = sleep
+        self.reset()
+
+    def reset(self):
+        """Start a new pass over the data (e.g. when the replay loops)."""
+        self.first_ts = None
+        self.last_ts = None
+        self.due = None
+
+    def wait(self, timestamp_ms: int):
+        if self.first_ts is None:
+            self.first_ts = self.last_ts = timestamp_ms
+            self.due = self.clock()
+            return
+        gap = (timestamp_ms - self.last_ts) / 1000.0 / self.speed
+        if self.jitter:
+            gap *= 1.0 + random.uniform(-self.jitter, self.jitter)
+        self.last_ts = timestamp_ms
+        # Schedule against the previous due time so sleep overshoot does not accumulate
+        self.due += max(0.0, gap)
+        delay = self.due - self.clock()
+        if delay > 0:
+            self.sleep(delay)
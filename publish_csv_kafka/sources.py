@@ -0,0 +1,176 @@
+"""
+Input sources for the publisher.
+
+A source's `chunks()` yields (timestamp, value) frames of at most
+`chunk_rows` rows in time order, so the publisher holds a few chunks at a
+time whatever the size of the input, and the first message goes out as
+soon as the first chunk is parsed:
+
+- `CsvSource`: `pd.read_csv(chunksize=...)`, parsing only the two columns
+- `ArrowSource`: Parquet (read batch by batch) or Arrow IPC / Feather files,
+  memory-mapped, reading only the two columns
+- `MergedSource`: several time-ordered sources merged by timestamp
+- `ConcatSource`: several sources one after the other
+
+`open_source` builds one from a file, a directory or a glob pattern. Each
+input file must be sorted by time; the merge keeps the order across files.
+"""
+import glob
+import os
+
+import pandas as pd
+
+DEFAULT_CHUNK_ROWS = 50_000
+CSV_EXTENSIONS = ('.csv', '.csv.gz', '.csv.bz2', '.csv.zst')
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+
+def normalize(df: pd.DataFrame, timestamp_column: str, value_column: str) -> pd.DataFrame:
+    """The two columns as `timestamp` (naive UTC datetime) and `value`."""
+    df = df[[timestamp_column, value_column]].rename(columns={timestamp_column: 'timestamp',
+                                                               value_column: 'value'})
+    if not pd.api.types.is_datetime64_any_dtype(df['timestamp']):
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+    if df['timestamp'].dt.tz is not None:
+        df['timestamp'] = df['timestamp'].dt.tz_convert('UTC').dt.tz_localize(None)
+    return df.reset_index(drop=True)
+
+
+class CsvSource:
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                 timestamp_column: str = 'timestamp', value_column: str = 'value'):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.columns = (timestamp_column, value_column)
+
+    def chunks(self):
+        with pd.read_csv(self.path, usecols=list(self.columns), parse_dates=[self.columns[0]],
+                         chunksize=self.chunk_rows) as reader:
+            for chunk in reader:
+                if len(chunk):
+                    yield normalize(chunk, *self.columns)
+
+    def __repr__(self):
+        return f"CsvSource({self.path!r})"
+
+
+class ArrowSource:
+    """
+    Parquet is read one batch of `chunk_rows` at a time (pyarrow decodes a
+    row group's pages as needed). Arrow IPC files are used in place: their
+    record batches are zero-copy slices of the mapped file.
+    """
+
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                 timestamp_column: str = 'timestamp', value_column: str = 'value'):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.columns = (timestamp_column, value_column)
+
+    def batches(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = list(self.columns)
+        if self.path.endswith(PARQUET_EXTENSIONS):
+            parquet = pq.ParquetFile(self.path, memory_map=True)
+            yield from parquet.iter_batches(batch_size=self.chunk_rows, columns=columns)
+            return
+        with pa.memory_map(self.path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i).select(columns)
+                for offset in range(0, batch.num_rows, self.chunk_rows):
+                    yield batch.slice(offset, self.chunk_rows)
+
+    def chunks(self):
+        for batch in self.batches():
+            if batch.num_rows:
+                yield normalize(batch.to_pandas(), *self.columns)
+
+    def __repr__(self):
+        return f"ArrowSource({self.path!r})"
+
+
+class ConcatSource:
+    def __init__(self, sources: list):
+        self.sources = sources
+
+    def chunks(self):
+        for source in self.sources:
+            yield from source.chunks()
+
+    def __repr__(self):
+        return f"ConcatSource({len(self.sources)} files)"
+
+
+class MergedSource:
+    """
+    Merges time-ordered sources by timestamp holding one chunk per source.
+    Every round emits, from each source's current chunk, the rows up to the
+    smallest last timestamp among those chunks: no source can still have an
+    earlier row. Rows with equal timestamps keep the sources' order.
+    """
+
+    def __init__(self, sources: list, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        self.sources = sources
+        self.chunk_rows = chunk_rows
+
+    def chunks(self):
+        iterators = [source.chunks() for source in self.sources]
+        heads = [next(it, None) for it in iterators]
+        while True:
+            active = [i for i, head in enumerate(heads) if head is not None]
+            if not active:
+                return
+            bound = min(heads[i]['timestamp'].iat[-1] for i in active)
+            parts = []
+            for i in active:
+                head = heads[i]
+                n = head['timestamp'].searchsorted(bound, side='right')
+                parts.append(head.iloc[:n])
+                heads[i] = head.iloc[n:] if n < len(head) else next(iterators[i], None)
+            merged = pd.concat(parts, ignore_index=True).sort_values('timestamp', kind='stable')
+            for start in range(0, len(merged), self.chunk_rows):
+                yield merged.iloc[start:start + self.chunk_rows].reset_index(drop=True)
+
+    def __repr__(self):
+        return f"MergedSource({len(self.sources)} files)"
+
+
+def file_source(path: str, **kwargs):
+    name = path.lower()
+    if name.endswith(PARQUET_EXTENSIONS + ARROW_EXTENSIONS):
+        return ArrowSource(path, **kwargs)
+    if name.endswith(CSV_EXTENSIONS):
+        return CsvSource(path, **kwargs)
+    raise ValueError(f"Unsupported input file {path!r}, expected CSV, Parquet or Arrow")
+
+
+def source_paths(spec: str) -> list:
+    """The files named by `spec`: a file, every supported file in a directory, or a glob pattern."""
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in os.listdir(spec)
+                 if name.lower().endswith(CSV_EXTENSIONS + PARQUET_EXTENSIONS + ARROW_EXTENSIONS)]
+    elif glob.has_magic(spec):
+        paths = [path for path in glob.glob(spec, recursive=True) if os.path.isfile(path)]
+    else:
+        paths = [spec] if os.path.isfile(spec) else []
+    if not paths:
+        raise FileNotFoundError(f"No input files match {spec!r}")
+    return sorted(paths)
+
+
+def open_source(spec: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, merge: bool = True,
+                timestamp_column: str = 'timestamp', value_column: str = 'value'):
+    """
+    A source for `spec`. Several files are merged by timestamp, or with
+    `merge=False` read one after the other in name order.
+    """
+    sources = [file_source(path, chunk_rows=chunk_rows, timestamp_column=timestamp_column,
+                           value_column=value_column)
+               for path in source_paths(spec)]
+    if len(sources) == 1:
+        return sources[0]
+    return MergedSource(sources, chunk_rows) if merge else ConcatSource(sources)
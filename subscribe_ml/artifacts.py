@@ -0,0 +1,55 @@
+"""
+Loading the model artifacts written by train.py: the forest and its
+Hour x Weekday baseline. Kept out of main.py so inference worker processes
+(inference_pool.py) can load a model without starting a Kafka application.
+"""
+import logging
+import os
+
+from batching import model_columns, score_batch
+from features import BASELINE_COLUMNS, Baseline, baseline_path
+from forest import CompiledForest
+
+
+def load_model(model_path: str, backend: str = "sklearn"):
+    """
+    Load the forest for `backend` ("sklearn" or "compiled"). The compiled
+    backend memory-maps a `.forest` file next to the joblib model when it is
+    at least as new, which skips the sklearn/joblib imports and the
+    unpickling entirely.
+    """
+    forest_path = os.path.splitext(model_path)[0] + ".forest"
+    if backend == "compiled" or model_path.endswith(".forest"):
+        if os.path.exists(forest_path) and (
+                not os.path.exists(model_path) or os.path.getmtime(forest_path) >= os.path.getmtime(model_path)):
+            model = CompiledForest.load(forest_path)
+            logging.info(f"✅ Compiled forest mapped from {forest_path}: {model.n_estimators} trees")
+            return model
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model file not found at: {model_path}")
+
+    import joblib
+    model = joblib.load(model_path)
+    logging.info("✅ Isolation Forest model loaded successfully.")
+    if backend == "compiled":
+        model = CompiledForest.from_sklearn(model)
+        logging.info(f"✅ Compiled forest: {model.n_estimators} trees, {len(model.feature)} nodes")
+    return model
+
+
+def load_baseline(model_path: str, model):
+    """Hour x Weekday value_Average table exported with the model by train.py, if any."""
+    if os.path.exists(baseline_path(model_path)):
+        baseline = Baseline.load(baseline_path(model_path))
+        logging.info(f"✅ Baseline loaded from {baseline_path(model_path)}")
+        return baseline
+    if set(BASELINE_COLUMNS) & set(model_columns(model)):
+        raise FileNotFoundError(f"Model expects {BASELINE_COLUMNS} but {baseline_path(model_path)} is missing")
+    return None
+
+
+def warm_up(model, batch_size: int = 1):
+    """Score dummy rows once, so the first real batch does not pay for page faults and lazy imports."""
+    width = len(model_columns(model))
+    for size in sorted({1, max(1, batch_size)}):
+        score_batch(model, [[0.0] * width] * size)
@@ -0,0 +1,339 @@
+"""
+Batch/stream parity backtest for the taxi anomaly detector, without Kafka.
+
+Runs the serving path over a whole (timestamp, value) history at once: the
+features `FeatureState.update` builds per event (computed for all rows by
+`features.feature_frame`, the Hour x Weekday baseline looked up as in
+serving), scored in `--batch-size` batches through the same `score_rows`
+as subscribe_ml, with or without the online detector. It then:
+
+- checks the vectorized features against `FeatureState.update` replayed
+  event by event (`--verify-streaming`)
+- diffs the result against the offline pipeline of
+  TimeSeries/time-series-anomaly-detection.py: hourly means, Lag and a
+  7-hour Rolling_Mean, the notebook's forest fitted on the hourly frame.
+  Streaming rows are grouped by hour (an hour is flagged if any of its rows
+  is) and compared hour by hour: features, flags and score ranks. Flags are
+  aligned by position; the notebook's `assign(Outliers=...)` aligns them by
+  index, one hour off.
+- with `--labels` (a CSV of anomaly windows with `start,end` columns),
+  reports event-level precision/recall for both (as in train.py)
+
+A parameter grid is fanned out over a process pool. Without `--model`, every
+combination of `--contamination`, `--n-estimators` and `--max-samples` fits
+a forest on the rows before `--train-end` (all rows by default), as train.py
+would. Every forest is backtested with every `--detector` setting. Results
+are ranked by event F1 with labels, otherwise by agreement with the
+offline flags.
+
+Usage:
+    python backtest.py --data ../demo_data/nyc_taxi.csv --labels ../demo_data/nyc_taxi_labels.csv
+    python backtest.py --model isolation_forest_model.joblib --detector forest cascade online --threshold 3 4 5
+    python backtest.py --contamination 0.001 0.005 --n-estimators 100 200 --train-end 2014-12-01 --processes 8
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+
+# online.py imports the shared metrics from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from artifacts import load_baseline, load_model  # noqa: E402
+from batching import model_columns, score_batch  # noqa: E402
+from features import (BASELINE_COLUMNS, FEATURE_COLUMNS, Baseline, FeatureState,  # noqa: E402
+                      feature_frame)
+from online import MODES, OnlineDetector, score_rows  # noqa: E402
+from train import event_metrics, label_events, load_history  # noqa: E402
+
+# The notebook's forest
+OFFLINE_PARAMS = {'contamination': 0.005, 'n_estimators': 200, 'max_samples': 0.7}
+OFFLINE_COLUMNS = ['value', 'Hour', 'Day', 'Month_day', 'Month', 'Rolling_Mean', 'Lag']
+
+# Filled in each worker process by _init_worker
+_context = None
+
+
+def streaming_parity(history: pd.DataFrame, features: pd.DataFrame, baseline: Baseline = None) -> dict:
+    """Max absolute difference per column between the vectorized features and FeatureState replayed event by event."""
+    state, rows = FeatureState(), []
+    timestamps_ms = (history['timestamp'] - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    for timestamp_ms, value in zip(timestamps_ms.tolist(), history['value'].tolist()):
+        _, row_features = state.update({'timestamp_ms': timestamp_ms, 'value': value}, baseline)
+        if row_features is not None:
+            rows.append(row_features)
+    columns = FEATURE_COLUMNS + (BASELINE_COLUMNS if baseline is not None else [])
+    streamed = np.asarray(rows, dtype=np.float64)
+    vectorized = features[columns].to_numpy(dtype=np.float64)
+    if streamed.shape != vectorized.shape:
+        return {'rows': len(rows), 'vectorized_rows': len(vectorized), 'max_abs_diff': None}
+    diff = np.abs(streamed - vectorized).max(axis=0) if len(rows) else np.zeros(len(columns))
+    return {'rows': len(rows), 'max_abs_diff': dict(zip(columns, diff.round(9).tolist()))}
+
+
+def offline_pipeline(history: pd.DataFrame, seed: int = 0) -> pd.DataFrame:
+    """The notebook's hourly frame with its Outliers (1/0) and Score, indexed by hour."""
+    hourly = history.set_index('timestamp')[['value']].resample('h').mean()
+    ts = hourly.index
+    hourly = hourly.assign(Hour=ts.hour, Day=ts.weekday, Month_day=ts.day, Month=ts.month,
+                           Lag=hourly['value'].shift(1),
+                           Rolling_Mean=hourly['value'].rolling(7, min_periods=1).mean())
+    hourly = hourly[OFFLINE_COLUMNS].dropna()
+    model = IsolationForest(random_state=seed, **OFFLINE_PARAMS).fit(hourly)
+    scores = model.decision_function(hourly)
+    return hourly.assign(Outliers=(scores < 0).astype(float), Score=scores)
+
+
+def hourly_view(features: pd.DataFrame, scores: np.ndarray = None, outliers: np.ndarray = None) -> pd.DataFrame:
+    """Streaming rows grouped by hour: mean value, the hour's last Lag and Rolling_Mean, min score, any flag."""
+    hours = features.index.floor('h')
+    frame = features[['value', 'Lag', 'Rolling_Mean']].assign(hour=hours)
+    if scores is not None:
+        frame = frame.assign(Score=scores, Outliers=outliers)
+    aggregations = {'value': 'mean', 'Lag': 'last', 'Rolling_Mean': 'last'}
+    if scores is not None:
+        aggregations.update(Score='min', Outliers='max')
+    return frame.groupby('hour').agg(aggregations)
+
+
+def feature_diff(stream_hourly: pd.DataFrame, offline: pd.DataFrame) -> dict:
+    """Mean absolute difference of the shared features per hour, also relative to the mean value."""
+    common = stream_hourly.index.intersection(offline.index)
+    scale = float(offline['value'].abs().mean()) or 1.0
+    diff = {}
+    for column in ('value', 'Lag', 'Rolling_Mean'):
+        mae = float((stream_hourly.loc[common, column] - offline.loc[common, column]).abs().mean())
+        diff[column] = {'mae': round(mae, 3), 'relative': round(mae / scale, 5)}
+    return {'hours': len(common), **diff}
+
+
+def flag_diff(stream_hourly: pd.DataFrame, offline: pd.DataFrame) -> dict:
+    """Hour-by-hour agreement of the outlier flags and Spearman correlation of the scores."""
+    common = stream_hourly.index.intersection(offline.index)
+    stream = stream_hourly.loc[common, 'Outliers'].to_numpy() > 0
+    batch = offline.loc[common, 'Outliers'].to_numpy() > 0
+    both = int((stream & batch).sum())
+    union = int((stream | batch).sum())
+    spearman = stream_hourly.loc[common, 'Score'].corr(offline.loc[common, 'Score'], method='spearman')
+    return {'hours': len(common), 'both': both, 'stream_only': int((stream & ~batch).sum()),
+            'offline_only': int((~stream & batch).sum()), 'jaccard': round(both / union, 4) if union else 1.0,
+            'score_spearman': round(float(spearman), 4) if not np.isnan(spearman) else None}
+
+
+def run_serving(model, features: pd.DataFrame, detector: OnlineDetector = None, batch_size: int = 10000):
+    """
+    Score every row like subscribe_ml's batched path: (scores, outliers) as
+    arrays plus the number of rows the forest scored.
+    """
+    columns = model_columns(model)
+    X = features[columns].to_numpy(dtype=np.float64)
+    scores = np.empty(len(X))
+    outliers = np.empty(len(X))
+    forest_rows = 0
+    if detector is None or detector.mode == "forest":
+        for start in range(0, len(X), batch_size):
+            batch_scores, batch_outliers = score_batch(model, X[start:start + batch_size])
+            scores[start:start + batch_size] = batch_scores
+            outliers[start:start + batch_size] = batch_outliers
+        return scores, outliers, len(X)
+
+    # The detector keeps its statistics in the stream's FeatureState; it only needs these fields
+    level_columns = ['value', 'Rolling_Mean'] + (['value_Average'] if 'value_Average' in features else [])
+    levels = features[level_columns].to_dict('records')
+    state = FeatureState()
+    for start in range(0, len(X), batch_size):
+        rows = levels[start:start + batch_size]
+        batch_scores, batch_outliers, forest = score_rows(model, detector, [state] * len(rows), rows,
+                                                          X[start:start + batch_size])
+        scores[start:start + len(rows)] = batch_scores
+        outliers[start:start + len(rows)] = batch_outliers
+        forest_rows += len(forest[0])
+    return scores, outliers, forest_rows
+
+
+def detector_grid(config: dict) -> list:
+    """Detector settings to try; None is the forest alone."""
+    settings = []
+    for mode in config['detector']:
+        if mode == "forest":
+            settings.append(None)
+            continue
+        suspicious = config['suspicious'] if mode == "cascade" else config['suspicious'][:1]
+        for threshold, alpha, suspicious_z in itertools.product(config['threshold'], config['alpha'], suspicious):
+            settings.append({'mode': mode, 'threshold': threshold, 'alpha': alpha,
+                             'suspicious': suspicious_z, 'warmup': config['warmup']})
+    return settings
+
+
+def _init_worker(context: dict):
+    global _context
+    _context = context
+
+
+def _evaluate(model, detector_params: dict) -> dict:
+    """Backtest one model with one detector setting on the worker's context."""
+    ctx = _context
+    features = ctx['features']
+    detector = OnlineDetector(**detector_params) if detector_params else None
+    started = time.perf_counter()
+    scores, outliers, forest_rows = run_serving(model, features, detector, ctx['batch_size'])
+    seconds = time.perf_counter() - started
+
+    test = ctx['test']
+    flagged = outliers[test] > 0
+    metrics = {'flagged': int(flagged.sum()), 'flagged_ratio': round(float(flagged.mean()), 5),
+               'forest_rows': forest_rows, 'score_seconds': round(seconds, 3)}
+    if ctx['event_ids'] is not None:
+        metrics.update(event_metrics(flagged, ctx['event_ids'][test], ctx['n_events']))
+    metrics['offline'] = flag_diff(hourly_view(features[test], scores[test], outliers[test]), ctx['offline'])
+    metrics['objective'] = metrics['f1'] if ctx['event_ids'] is not None else metrics['offline']['jaccard']
+    return metrics
+
+
+def _run_task(model_params: dict, detectors: list) -> list:
+    """Fit (or take the loaded) forest and backtest it with each detector setting."""
+    ctx = _context
+    model, fit_seconds = ctx['model'], None
+    if model is None:
+        started = time.perf_counter()
+        train_rows = ctx['features'][ctx['train']]
+        model = IsolationForest(random_state=ctx['seed'], **model_params)
+        model.fit(train_rows[ctx['columns']])
+        fit_seconds = round(time.perf_counter() - started, 3)
+    results = []
+    for detector_params in detectors:
+        metrics = _evaluate(model, detector_params)
+        if fit_seconds is not None:
+            metrics['fit_seconds'] = fit_seconds
+        results.append({'params': model_params, 'detector': detector_params or {'mode': 'forest'},
+                        'metrics': metrics})
+        logging.info(f"🔎 {model_params or 'model'} {detector_params or 'forest'} -> "
+                     f"objective {metrics['objective']:.4f}")
+    return results
+
+
+def backtest(config: dict) -> dict:
+    started = time.perf_counter()
+    history = load_history(config['data'])
+    if history['timestamp'].dt.tz is not None:
+        history['timestamp'] = history['timestamp'].dt.tz_convert('UTC').dt.tz_localize(None)
+
+    features = feature_frame(history).dropna()
+    if config['train_end'] is not None:
+        train = features.index < pd.Timestamp(config['train_end'])
+        test = ~train
+    else:
+        train = test = np.ones(len(features), dtype=bool)
+
+    model = None
+    if config['model']:
+        model = load_model(config['model'], config['backend'])
+        baseline = load_baseline(config['model'], model)
+    elif config['baseline']:
+        baseline = Baseline.fit(features[train])
+    else:
+        baseline = None
+    if baseline is not None:
+        features = baseline.apply(features)
+    columns = FEATURE_COLUMNS + (BASELINE_COLUMNS if baseline is not None else [])
+    feature_seconds = time.perf_counter() - started
+    logging.info(f"📦 {len(history)} rows -> {len(features)} feature rows in {feature_seconds:.2f}s")
+
+    summary = {'rows': len(history), 'feature_rows': len(features)}
+    if config['verify_streaming']:
+        summary['streaming_parity'] = streaming_parity(history, features, baseline)
+
+    # The offline reference and the feature diff do not depend on the grid
+    offline = offline_pipeline(history, config['seed'])
+    if config['train_end'] is not None:
+        offline_test = offline.index >= pd.Timestamp(config['train_end'])
+    else:
+        offline_test = np.ones(len(offline), dtype=bool)
+    summary['offline'] = {'hours': len(offline), 'flagged': int(offline['Outliers'].sum()),
+                          'feature_diff': feature_diff(hourly_view(features), offline)}
+
+    event_ids, n_events = None, 0
+    if config['labels']:
+        labels = pd.read_csv(config['labels'])
+        event_ids = label_events(features.index, labels)
+        n_events = len(labels)
+        summary['offline'].update(event_metrics(offline['Outliers'].to_numpy()[offline_test] > 0,
+                                                label_events(offline.index, labels)[offline_test], n_events))
+
+    context = {'features': features, 'columns': columns, 'model': model, 'train': train, 'test': test,
+               'event_ids': event_ids, 'n_events': n_events, 'offline': offline[offline_test],
+               'batch_size': config['batch_size'], 'seed': config['seed']}
+    detectors = detector_grid(config)
+    if model is None:
+        keys = ('contamination', 'n_estimators', 'max_samples')
+        tasks = [(dict(zip(keys, values)), detectors)
+                 for values in itertools.product(*(config[k] for k in keys))]
+    else:
+        # One loaded model: spread its detector settings instead
+        tasks = [({}, [detector]) for detector in detectors]
+
+    grid_started = time.perf_counter()
+    if config['processes'] == 1 or len(tasks) == 1:
+        _init_worker(context)
+        results = [r for task in tasks for r in _run_task(*task)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(config['processes'] or os.cpu_count(), len(tasks)),
+                                 initializer=_init_worker, initargs=(context,)) as pool:
+            futures = [pool.submit(_run_task, *task) for task in tasks]
+            results = [r for future in futures for r in future.result()]
+    results.sort(key=lambda r: r['metrics']['objective'], reverse=True)
+    summary.update(objective='event_f1' if event_ids is not None else 'offline_jaccard',
+                   best=results[0], results=results,
+                   timings={'features_seconds': round(feature_seconds, 3),
+                            'grid_seconds': round(time.perf_counter() - grid_started, 3),
+                            'total_seconds': round(time.perf_counter() - started, 3)})
+    logging.info(f"🏆 Best {results[0]['params'] or config['model']} {results[0]['detector']}: "
+                 f"objective {results[0]['metrics']['objective']:.4f} "
+                 f"({len(results)} runs in {summary['timings']['total_seconds']}s)")
+    return summary
+
+
+def parse_args(argv=None) -> dict:
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    default_data = os.path.join(os.path.dirname(script_dir), "demo_data", "nyc_taxi.csv")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=default_data, help="CSV or Parquet with timestamp,value")
+    parser.add_argument("--labels", help="CSV of anomaly windows (start,end)")
+    parser.add_argument("--model", help="backtest this model (and its baseline) instead of fitting a grid")
+    parser.add_argument("--backend", default=os.getenv("ML_BACKEND", "sklearn"), choices=["sklearn", "compiled"])
+    parser.add_argument("--contamination", type=float, nargs='+', default=[OFFLINE_PARAMS['contamination']])
+    parser.add_argument("--n-estimators", type=int, nargs='+', default=[OFFLINE_PARAMS['n_estimators']])
+    parser.add_argument("--max-samples", type=float, nargs='+', default=[OFFLINE_PARAMS['max_samples']])
+    parser.add_argument("--no-baseline", dest="baseline", action="store_false",
+                        help="fit forests on the 7 original features only")
+    parser.add_argument("--train-end", help="fit on rows before this time, score and report on the rest")
+    parser.add_argument("--detector", nargs='+', default=["forest"], choices=MODES)
+    parser.add_argument("--threshold", type=float, nargs='+', default=[4.0])
+    parser.add_argument("--suspicious", type=float, nargs='+', default=[2.5])
+    parser.add_argument("--alpha", type=float, nargs='+', default=[0.01])
+    parser.add_argument("--warmup", type=int, default=24)
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per score_rows call")
+    parser.add_argument("--verify-streaming", action="store_true",
+                        help="also replay FeatureState event by event and compare the features")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="grid runs in parallel")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the full JSON report here as well")
+    return vars(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    config = parse_args()
+    report = backtest(config)
+    if config['output']:
+        with open(config['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({k: v for k, v in report.items() if k != 'results'}, indent=2))
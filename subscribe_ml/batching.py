@@ -0,0 +1,93 @@
+"""
+Micro-batching for Isolation Forest scoring.
+
+Events are grouped per partition until either `max_size` events or
+`max_wait_ms` milliseconds have accumulated, then scored with a single
+`decision_function`-equivalent call instead of `predict` + `decision_function`
+per message.
+"""
+import time
+
+from features import FEATURE_COLUMNS
+from forest import CompiledForest
+
+
+def model_columns(model) -> list:
+    """Feature columns a fitted model expects, in order."""
+    names = getattr(model, 'feature_names_in_', None)
+    return list(names) if names is not None else FEATURE_COLUMNS
+
+
+def score_batch(model, features: list):
+    """
+    Score a list of feature vectors in one pass over the forest.
+    Vectors may carry trailing columns the model was not trained with
+    (e.g. BASELINE_COLUMNS for an older model); they are ignored.
+    Returns (scores, outliers) where outliers holds 1.0 / 0.0 per row.
+    """
+    columns = model_columns(model)
+    if len(features[0]) != len(columns):
+        features = [f[:len(columns)] for f in features]
+    # sklearn expects the feature names it was fitted with, the compiled forest takes plain rows
+    if isinstance(model, CompiledForest):
+        X = features
+    else:
+        import pandas as pd
+        X = pd.DataFrame(features, columns=columns)
+    # decision_function == score_samples - offset_, and predict() flags every
+    # row whose decision is below 0, so one traversal gives both results.
+    raw = model.score_samples(X)
+    scores = raw - model.offset_
+    outliers = [1.0 if s < model.offset_ else 0.0 for s in raw]
+    return [float(s) for s in scores], outliers
+
+
+class MicroBatcher:
+    """
+    Collects items per partition and releases a partition's batch once it
+    holds `max_size` items or its oldest item is `max_wait_ms` old.
+    Items keep their arrival order inside a batch.
+    """
+
+    def __init__(self, max_size: int = 500, max_wait_ms: float = 50, clock=time.monotonic):
+        self.max_size = max(1, int(max_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self.clock = clock
+        self.batches = {}
+        self.started = {}
+
+    def __len__(self):
+        return sum(len(b) for b in self.batches.values())
+
+    def add(self, partition, item):
+        """Add an item; returns the partition's batch if it is now full, else None."""
+        batch = self.batches.get(partition)
+        if batch is None:
+            batch = self.batches[partition] = []
+            self.started[partition] = self.clock()
+        batch.append(item)
+        if len(batch) >= self.max_size:
+            return self.pop(partition)
+        return None
+
+    def pop(self, partition) -> list:
+        """Remove and return everything pending for a partition."""
+        self.started.pop(partition, None)
+        return self.batches.pop(partition, [])
+
+    def expired(self) -> list:
+        """Pop and return [(partition, batch)] for batches older than max_wait_ms."""
+        now = self.clock()
+        due = [p for p, started in self.started.items() if now - started >= self.max_wait]
+        return [(p, self.pop(p)) for p in due]
+
+    def drain(self) -> list:
+        """Pop and return every pending batch."""
+        return [(p, self.pop(p)) for p in list(self.batches)]
+
+    def poll_timeout(self) -> float:
+        """Seconds until the oldest pending batch expires (max_wait when idle)."""
+        if not self.started:
+            return self.max_wait
+        oldest = min(self.started.values())
+        return max(0.0, self.max_wait - (self.clock() - oldest))
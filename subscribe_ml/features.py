@@ -0,0 +1,239 @@
+"""
+Incremental feature engineering for the taxi anomaly detector.
+
+Produces the same feature vector the pandas buffer in ``handle_message`` used
+to build (``value, Hour, Day, Month_day, Month, Rolling_Mean, Lag``), but keeps
+a fixed-size ring buffer with a running sum instead of rebuilding a DataFrame
+on every message, so each event costs O(1). `feature_frame` builds the same
+features for a whole history at once, for training.
+
+`Baseline` is the notebook's `value_Average`: the mean value per
+Hour x Weekday, fitted at training time and saved next to the model
+(`baseline_path`), so serving looks it up instead of recomputing it.
+"""
+import json
+import math
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Column order expected by the Isolation Forest
+FEATURE_COLUMNS = ['value', 'Hour', 'Day', 'Month_day', 'Month', 'Rolling_Mean', 'Lag']
+# Appended to FEATURE_COLUMNS for models trained with a Baseline
+BASELINE_COLUMNS = ['value_Average', 'Deviation']
+ROLLING_WINDOW = 7
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def event_time(row_data: dict) -> datetime:
+    """
+    Return the event time of a message as a naive datetime.
+    `timestamp_ms` is preferred; the formatted `timestamp` string is the fallback.
+    """
+    timestamp_ms = row_data.get('timestamp_ms')
+    if timestamp_ms is not None:
+        # The publisher derives timestamp_ms from a naive timestamp, i.e. as UTC
+        return datetime.fromtimestamp(timestamp_ms / 1000.0, tz=timezone.utc).replace(tzinfo=None)
+    return datetime.fromisoformat(str(row_data['timestamp']))
+
+
+def event_time_ms(row_data: dict) -> int:
+    """Return the event time of a message in epoch milliseconds (UTC)."""
+    timestamp_ms = row_data.get('timestamp_ms')
+    if timestamp_ms is not None:
+        return int(timestamp_ms)
+    return int(event_time(row_data).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def baseline_path(model_path: str) -> str:
+    """Where the Baseline exported with a model lives."""
+    return os.path.splitext(model_path)[0] + '.baseline.json'
+
+
+class Baseline:
+    """
+    Mean value per (weekday, hour), stored flat at `weekday * 24 + hour`.
+    Cells without training data fall back to the overall mean.
+    """
+
+    def __init__(self, table: list, fallback: float):
+        self.table = [float(v) for v in table]
+        self.fallback = float(fallback)
+
+    @classmethod
+    def fit(cls, features):
+        """Fit from a `feature_frame` (or any frame with value, Day and Hour columns)."""
+        cells = features['Day'].to_numpy(dtype=np.intp) * 24 + features['Hour'].to_numpy(dtype=np.intp)
+        values = features['value'].to_numpy(dtype=np.float64)
+        counts = np.bincount(cells, minlength=7 * 24)
+        sums = np.bincount(cells, weights=values, minlength=7 * 24)
+        fallback = float(values.mean()) if len(values) else 0.0
+        table = np.where(counts > 0, sums / np.maximum(counts, 1), fallback)
+        return cls(table.tolist(), fallback)
+
+    def lookup(self, weekday: int, hour: int) -> float:
+        return self.table[weekday * 24 + hour]
+
+    def apply(self, features):
+        """Add the BASELINE_COLUMNS to a `feature_frame`."""
+        cells = features['Day'].to_numpy(dtype=np.intp) * 24 + features['Hour'].to_numpy(dtype=np.intp)
+        average = np.asarray(self.table).take(cells)
+        return features.assign(value_Average=average, Deviation=features['value'].to_numpy() - average)
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'table': self.table, 'fallback': self.fallback}, f)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['table'], data['fallback'])
+
+
+class FeatureState:
+    """
+    Rolling state for one stream: a ring buffer of the last `window` values,
+    their running sum for `Rolling_Mean` and the previous value for `Lag`.
+    A missing (None, NaN or infinite) value keeps its slot in the window but
+    not in the mean, like pandas' `rolling().mean()`; neither that event nor
+    the next one (its Lag is missing) gets features.
+    """
+
+    def __init__(self, window: int = ROLLING_WINDOW):
+        self.window = window
+        self.values = [0.0] * window
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+        # Missing values among the last `count`
+        self.missing = 0
+        self.lag = None
+        # [mean, mad, count] of the online detector (online.py), when one runs
+        self.detector = None
+
+    def to_dict(self) -> dict:
+        """JSON-serializable snapshot, e.g. for a Quix Streams State store."""
+        return {
+            'window': self.window,
+            'values': self.values,
+            'pos': self.pos,
+            'count': self.count,
+            'total': self.total,
+            'missing': self.missing,
+            'lag': self.lag,
+            'detector': self.detector,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Rebuild a FeatureState saved with `to_dict`; None gives a fresh state."""
+        state = cls()
+        if data:
+            state.window = data['window']
+            state.values = list(data['values'])
+            state.pos = data['pos']
+            state.count = data['count']
+            state.total = data['total']
+            state.missing = data.get('missing', 0)
+            state.lag = data['lag']
+            state.detector = data.get('detector')
+        return state
+
+    def push(self, value: float):
+        """
+        Add a value to the window and return (Rolling_Mean, Lag) for it.
+        Lag is None for the first value seen, like `shift(1)` in pandas;
+        Rolling_Mean is NaN while every value in the window is missing.
+        """
+        lag = self.lag
+        if self.count == self.window:
+            old = self.values[self.pos]
+            if math.isfinite(old):
+                self.total -= old
+            else:
+                self.missing -= 1
+        else:
+            self.count += 1
+        if math.isfinite(value):
+            self.total += value
+        else:
+            value = math.nan
+            self.missing += 1
+        self.values[self.pos] = value
+        self.pos = (self.pos + 1) % self.window
+        self.lag = value
+
+        # Re-sum once per lap so float drift from the running sum cannot build up
+        if self.pos == 0:
+            self.total = sum(v for v in self.values[:self.count] if math.isfinite(v))
+
+        present = self.count - self.missing
+        return (self.total / present if present else math.nan), lag
+
+    def update(self, row_data: dict, baseline: Baseline = None):
+        """
+        Enrich a message with calendar, Lag and Rolling_Mean fields, plus
+        value_Average and Deviation when a `baseline` is given.
+        Returns (current_row, features); features is None until a Lag exists,
+        and for events whose value, Lag or Rolling_Mean is missing.
+        """
+        ts = event_time(row_data)
+        value = row_data['value']
+        value = math.nan if value is None else float(value)
+        rolling_mean, lag = self.push(value)
+
+        current_row = dict(row_data)
+        current_row['timestamp'] = ts.strftime(TIMESTAMP_FORMAT)
+        current_row['Weekday'] = WEEKDAYS[ts.weekday()]
+        current_row['Hour'] = ts.hour
+        current_row['Day'] = ts.weekday()
+        current_row['Month'] = ts.month
+        current_row['Year'] = ts.year
+        current_row['Month_day'] = ts.day
+        current_row['Lag'] = lag
+        current_row['Rolling_Mean'] = rolling_mean
+        if baseline is not None:
+            average = baseline.lookup(ts.weekday(), ts.hour)
+            current_row['value_Average'] = average
+            current_row['Deviation'] = value - average
+
+        # The pandas path dropped such rows with dropna()
+        if lag is None or not (math.isfinite(value) and math.isfinite(lag) and math.isfinite(rolling_mean)):
+            return current_row, None
+
+        features = [value, ts.hour, ts.weekday(), ts.day, ts.month, rolling_mean, lag]
+        if baseline is not None:
+            features += [current_row['value_Average'], current_row['Deviation']]
+        return current_row, features
+
+
+def feature_frame(df):
+    """
+    Vectorized `FeatureState.update` over a (timestamp, value) history in
+    event order: one row of FEATURE_COLUMNS per event FeatureState gives
+    features for (it has a value, a Lag and a Rolling_Mean), indexed by
+    timestamp. Weekdays stay integers; `Baseline.apply` adds the
+    BASELINE_COLUMNS.
+    """
+    # Training only: serving should not pay for the pandas import
+    import pandas as pd
+
+    ts = pd.to_datetime(df['timestamp'])
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert('UTC').dt.tz_localize(None)
+    value = df['value'].astype('float64')
+    # Infinite values are missing too, as in FeatureState
+    value = value.where(np.isfinite(value.to_numpy()))
+    features = pd.DataFrame({
+        'value': value.to_numpy(),
+        'Hour': ts.dt.hour.to_numpy(),
+        'Day': ts.dt.weekday.to_numpy(),
+        'Month_day': ts.dt.day.to_numpy(),
+        'Month': ts.dt.month.to_numpy(),
+        'Rolling_Mean': value.rolling(ROLLING_WINDOW, min_periods=1).mean().to_numpy(),
+        'Lag': value.shift(1).to_numpy(),
+    }, index=pd.DatetimeIndex(ts, name='timestamp'))
+    return features.dropna()
@@ -0,0 +1,272 @@
+"""
+Feature building and scoring on worker processes.
+
+`InferencePool` runs `workers` single-process executors. Every message key is
+pinned to one worker (crc32 of the key), which keeps that key's FeatureState
+and sees the key's messages in order, so features match the in-process path
+exactly. A batch handed to `submit` is split by worker, scored in parallel,
+and comes back from `completed` as a `Ticket` with the rows in the batch's
+own order; tickets are released first in, first out, so the consumer can
+produce and commit them in offset order while the next batches are scored.
+
+A new model is loaded and warmed up by each worker on a background thread
+(`prepare_model`) while it keeps scoring with the current one;
+`switch_model` then moves every worker over between two batches.
+
+Workers are forked (not spawned: a spawned child would re-run main.py), so
+create the pool before the service starts any thread of its own.
+"""
+import multiprocessing
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from artifacts import load_baseline, load_model, warm_up
+from features import FeatureState
+from online import score_rows
+
+# Per worker process
+_model = None
+_baseline = None
+_detector = None
+_states = {}
+# model_path -> None while loading, then (model, baseline) or the load's exception
+_prepared = {}
+
+
+def _set_model(model_path: str, backend: str, batch_size: int = 1):
+    global _model, _baseline
+    model = load_model(model_path, backend)
+    baseline = load_baseline(model_path, model)
+    warm_up(model, batch_size)
+    _model, _baseline = model, baseline
+
+
+def _prepare_model(model_path: str, backend: str, batch_size: int = 1):
+    _prepared.clear()
+    _prepared[model_path] = None
+
+    def load():
+        try:
+            model = load_model(model_path, backend)
+            baseline = load_baseline(model_path, model)
+            warm_up(model, batch_size)
+            result = (model, baseline)
+        except Exception as e:
+            result = e
+        # A newer prepare_model may have replaced this one meanwhile
+        if model_path in _prepared:
+            _prepared[model_path] = result
+
+    threading.Thread(target=load, name="prepare-model", daemon=True).start()
+
+
+def _model_prepared(model_path: str) -> bool:
+    result = _prepared.get(model_path)
+    if isinstance(result, Exception):
+        raise result
+    return result is not None
+
+
+def _use_model(model_path: str):
+    global _model, _baseline
+    _model, _baseline = _prepared.pop(model_path)
+
+
+def _set_detector(detector):
+    global _detector
+    _detector = detector
+
+
+def _drop(partitions: list):
+    for state_key in [k for k in _states if k[0] in partitions]:
+        del _states[state_key]
+
+
+def _score(partition, items: list) -> dict:
+    """
+    Features and scores for [(index, key, row_data)]; rows without a Lag yet
+    are skipped, malformed ones are skipped and reported under 'invalid'.
+    """
+    started = time.perf_counter()
+    indexes, states, rows, features, invalid = [], [], [], [], []
+    for index, key, row_data in items:
+        state = _states.get((partition, key))
+        if state is None:
+            state = _states[(partition, key)] = FeatureState()
+        try:
+            current_row, row_features = state.update(row_data, _baseline)
+        except Exception as e:
+            invalid.append(f"{row_data!r:.200}: {e!r}")
+            continue
+        if row_features is None:
+            continue
+        indexes.append(index)
+        states.append(state)
+        rows.append(current_row)
+        features.append(row_features)
+    scored = time.perf_counter()
+
+    forest = ([], [], [])
+    if rows:
+        scores, outliers, forest = score_rows(_model, _detector, states, rows, features)
+        for current_row, score, outlier in zip(rows, scores, outliers):
+            current_row['Outliers'] = outlier
+            current_row['Score'] = score
+    return {
+        'indexes': indexes,
+        'rows': rows,
+        'forest': forest,
+        'skipped': len(items) - len(rows) - len(invalid),
+        'invalid': invalid,
+        'features_seconds': scored - started,
+        'inference_seconds': time.perf_counter() - scored,
+    }
+
+
+class Ticket:
+    """
+    One submitted batch: `items` as given, plus results (or `error`) once
+    completed; `invalid` describes the rows that could not be parsed.
+    `forest` holds the (features, scores, outliers) the forest scored, in
+    no particular order, for shadow scoring.
+    """
+
+    def __init__(self, partition, items: list, context=None):
+        self.partition = partition
+        self.items = items
+        self.context = context
+        self.error = None
+        self.futures = []
+        self.keys, self.rows = [], []
+        self.forest = ([], [], [])
+        self.skipped = 0
+        self.invalid = []
+        self.features_seconds = 0.0
+        self.inference_seconds = 0.0
+
+    def done(self) -> bool:
+        return all(future.done() for future in self.futures)
+
+    def assemble(self):
+        """Merge the per-worker results back into the batch's order."""
+        parts = [future.result() for future in self.futures]
+        merged = sorted((index, part, i) for part in parts for i, index in enumerate(part['indexes']))
+        for index, part, i in merged:
+            self.keys.append(self.items[index][0])
+            self.rows.append(part['rows'][i])
+        self.forest = tuple([value for part in parts for value in part['forest'][column]] for column in range(3))
+        self.skipped = sum(part['skipped'] for part in parts)
+        self.invalid = [error for part in parts for error in part['invalid']]
+        # Workers run side by side: the slowest one is what the batch waited for
+        self.features_seconds = max((part['features_seconds'] for part in parts), default=0.0)
+        self.inference_seconds = max((part['inference_seconds'] for part in parts), default=0.0)
+
+
+class InferencePool:
+    """
+    Score batches on `workers` processes with at most `max_in_flight`
+    tickets outstanding (`full()` tells the caller to wait on `completed`).
+    """
+
+    def __init__(self, workers: int, model_path: str, backend: str = "sklearn", batch_size: int = 1,
+                 max_in_flight: int = 8, detector=None):
+        self.batch_size = batch_size
+        self.max_in_flight = max(1, max_in_flight)
+        context = multiprocessing.get_context("fork")
+        self.executors = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(max(1, workers))]
+        self.tickets = deque()
+        self.preparing = None
+        self._checks = []
+        self.set_model(model_path, backend)
+        for future in [executor.submit(_set_detector, detector) for executor in self.executors]:
+            future.result()
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def full(self) -> bool:
+        return len(self.tickets) >= self.max_in_flight
+
+    def _worker(self, key) -> int:
+        if len(self.executors) == 1:
+            return 0
+        data = key if isinstance(key, bytes) else str(key).encode('utf-8')
+        return zlib.crc32(data) % len(self.executors)
+
+    def submit(self, partition, items: list, context=None) -> Ticket:
+        """Queue [(key, row_data)] of one partition for scoring; `context` comes back on the ticket."""
+        ticket = Ticket(partition, items, context)
+        shares = {}
+        for index, (key, row_data) in enumerate(items):
+            shares.setdefault(self._worker(key), []).append((index, key, row_data))
+        for worker, share in shares.items():
+            ticket.futures.append(self.executors[worker].submit(_score, partition, share))
+        self.tickets.append(ticket)
+        return ticket
+
+    def completed(self, wait_for: int = 0) -> list:
+        """
+        Pop finished tickets from the front of the queue, in submission order.
+        Blocks until at least `wait_for` tickets (or all there are) are done.
+        """
+        ready = []
+        while self.tickets:
+            ticket = self.tickets[0]
+            if not ticket.done():
+                if len(ready) >= wait_for:
+                    break
+                wait(ticket.futures)
+            self.tickets.popleft()
+            try:
+                ticket.assemble()
+            except Exception as e:
+                ticket.error = e
+            ready.append(ticket)
+        return ready
+
+    def set_model(self, model_path: str, backend: str = "sklearn"):
+        """Load a model on every worker; batches submitted after this are scored with it."""
+        futures = [executor.submit(_set_model, model_path, backend, self.batch_size) for executor in self.executors]
+        for future in futures:
+            future.result()
+
+    def prepare_model(self, model_path: str, backend: str = "sklearn"):
+        """Start loading a model on every worker without waiting for it; see `switch_model`."""
+        self.preparing = model_path
+        self._checks = [executor.submit(_prepare_model, model_path, backend, self.batch_size)
+                        for executor in self.executors]
+
+    def switch_model(self):
+        """
+        Call between batches: once every worker has the prepared model, switch
+        them all to it (batches submitted from now on are scored with it) and
+        return its path. None while it is still loading; raises if it failed.
+        """
+        if self.preparing is None or not all(check.done() for check in self._checks):
+            return None
+        model_path = self.preparing
+        try:
+            # The first round are the _prepare_model calls themselves, which return None
+            ready = all(check.result() for check in self._checks)
+        except Exception:
+            self.preparing = None
+            raise
+        if not ready:
+            self._checks = [executor.submit(_model_prepared, model_path) for executor in self.executors]
+            return None
+        for executor in self.executors:
+            executor.submit(_use_model, model_path)
+        self.preparing = None
+        return model_path
+
+    def drop(self, partitions: list):
+        """Forget the feature state of revoked partitions (after their tickets are done)."""
+        for future in [executor.submit(_drop, list(partitions)) for executor in self.executors]:
+            future.result()
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(cancel_futures=True)
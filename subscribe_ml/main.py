@@ -1,18 +1,49 @@
 # Import Quix Streams and other necessary libraries
+import time
+STARTED = time.perf_counter()
+
 import os
+import sys
 import logging
-import joblib
-import pandas as pd
 from dotenv import load_dotenv
-import json
+from datetime import datetime, timezone
 
 from quixstreams import Application
+from quixstreams.sinks import BatchingSink
 
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+from influxdb_client import Point
 
 # For local development, load environment variables from a .env file
 load_dotenv()
 
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.influx_router import create_influx_sink
+from common.influx_schema import anomaly_schema as create_anomaly_schema
+from common.metrics import (ERRORS, MESSAGES_IN, MESSAGES_OUT, MODEL_RELOADS, STAGES, STARTUP_SECONDS,
+                            LagTracker, start_metrics_server)
+from common.wire import ANOMALY, WireDeserializer, WireSerializer, decode, encode
+from artifacts import load_baseline, load_model, warm_up
+from batching import MicroBatcher
+from features import FeatureState, event_time_ms
+from inference_pool import InferencePool
+from online import OnlineDetector, score_rows
+from reload import ModelReloader
+
+# Startup time per phase, reported once the service is ready to consume
+startup = {}
+_phase_started = STARTED
+
+
+def startup_phase(name: str):
+    global _phase_started
+    now = time.perf_counter()
+    startup[name] = now - _phase_started
+    _phase_started = now
+
+
+startup_phase("imports")
+
 # --- Kafka and Log Configuration ---
 log_level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
 logging.basicConfig(level=log_level, format='[%(asctime)s] [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
@@ -21,136 +52,179 @@ KAFKA_BROKER = os.getenv("KAFKA_BROKER", "172.16.2.117:9092")
 KAFKA_INPUT_TOPIC = os.getenv("KAFKA_INPUT_TOPIC", "event-frames-model")
 KAFKA_ML_TOPIC = os.getenv("KAFKA_ML_TOPIC", "taxi-demand-anomalies")
 CONSUMER_GROUP = os.getenv("CONSUMER_GROUP", "taxi-anomaly-detector")
+# Micro-batching: ML_BATCH_SIZE > 1 scores up to N events (or ML_BATCH_MAX_WAIT_MS) per partition at once
+ML_BATCH_SIZE = int(os.getenv("ML_BATCH_SIZE", 1))
+ML_BATCH_MAX_WAIT_MS = float(os.getenv("ML_BATCH_MAX_WAIT_MS", 50))
+# Inference backend: "sklearn" or "compiled" (flat-array forest, see forest.py)
+ML_BACKEND = os.getenv("ML_BACKEND", "sklearn").lower()
+# Output encoding: "json" or "binary" (see common/wire.py); the input topic may carry either
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "json").lower()
+# Hot reload: poll the model files every ML_RELOAD_INTERVAL_S (0 disables) and/or listen on ML_CONTROL_TOPIC,
+# score ML_SHADOW_ROWS rows with both models, then swap unless more than ML_SHADOW_MAX_DISAGREEMENT flags differ
+ML_RELOAD_INTERVAL_S = float(os.getenv("ML_RELOAD_INTERVAL_S", 10))
+ML_CONTROL_TOPIC = os.getenv("ML_CONTROL_TOPIC", "")
+ML_SHADOW_ROWS = int(os.getenv("ML_SHADOW_ROWS", 1000))
+ML_SHADOW_MAX_DISAGREEMENT = float(os.getenv("ML_SHADOW_MAX_DISAGREEMENT", 1.0))
+# Process-pool inference: ML_WORKERS > 0 builds features and scores on that many processes while the
+# consumer keeps polling, with at most ML_MAX_IN_FLIGHT batches handed out at a time
+ML_WORKERS = int(os.getenv("ML_WORKERS", 0))
+ML_MAX_IN_FLIGHT = int(os.getenv("ML_MAX_IN_FLIGHT", 8))
+# Online detector (see online.py): "forest" (off), "online", "cascade" or "shadow"
+ML_DETECTOR = os.getenv("ML_DETECTOR", "forest").lower()
+ML_ONLINE_ALPHA = float(os.getenv("ML_ONLINE_ALPHA", 0.01))
+ML_ONLINE_THRESHOLD = float(os.getenv("ML_ONLINE_THRESHOLD", 4.0))
+ML_ONLINE_SUSPICIOUS = float(os.getenv("ML_ONLINE_SUSPICIOUS", 2.5))
+ML_ONLINE_WARMUP = int(os.getenv("ML_ONLINE_WARMUP", 24))
+script_dir = os.path.dirname(os.path.realpath(__file__))
+model_path = os.getenv("ML_MODEL_PATH", os.path.join(script_dir, "isolation_forest_model.joblib"))
 
-INFLUX_URL = "http://172.16.2.117:8086" #os.getenv("INFLUX_URL")
+INFLUX_URL = os.getenv("INFLUX_URL", "http://172.16.2.117:8086")
 INFLUX_TOKEN = os.getenv("INFLUX_TOKEN")
 INFLUX_ORG = os.getenv("INFLUX_ORG")
 INFLUX_BUCKET = os.getenv("INFLUX_BUCKET")
+INFLUX_BATCH_SIZE = int(os.getenv("INFLUX_BATCH_SIZE", 5000))
+INFLUX_FLUSH_INTERVAL_MS = float(os.getenv("INFLUX_FLUSH_INTERVAL_MS", 1000))
+INFLUX_MAX_PENDING_BATCHES = int(os.getenv("INFLUX_MAX_PENDING_BATCHES", 4))
+INFLUX_GZIP = os.getenv("INFLUX_GZIP", "true").lower() in ("1", "true", "yes")
+# Several comma-separated INFLUX_URLs shard the writes (see common/influx_router.py)
+INFLUX_REPLICATION = int(os.getenv("INFLUX_REPLICATION", 1))
+# "async" keeps INFLUX_MAX_IN_FLIGHT write requests open per node (see common/influx_async.py)
+INFLUX_WRITER = os.getenv("INFLUX_WRITER", "thread").lower()
+INFLUX_MAX_IN_FLIGHT = int(os.getenv("INFLUX_MAX_IN_FLIGHT", 4))
+# Tags vs fields of the anomaly measurement: "compact" (Weekday, Hour as tags) or "legacy" (every calendar column)
+INFLUX_SCHEMA = os.getenv("INFLUX_SCHEMA", "compact").lower()
+# Cardinality guard: tags past these estimates are written as fields instead (0 disables)
+INFLUX_MAX_TAG_VALUES = int(os.getenv("INFLUX_MAX_TAG_VALUES", 1000))
+INFLUX_MAX_SERIES = int(os.getenv("INFLUX_MAX_SERIES", 10000))
+# The <topic>_DATA measurement repeats the same fields without tags; only needed by old queries
+INFLUX_WRITE_DATA_COPY = os.getenv("INFLUX_WRITE_DATA_COPY", "false").lower() in ("1", "true", "yes")
+
+detector = None
+if ML_DETECTOR != "forest":
+    detector = OnlineDetector(ML_DETECTOR, alpha=ML_ONLINE_ALPHA, threshold=ML_ONLINE_THRESHOLD,
+                              suspicious=ML_ONLINE_SUSPICIOUS, warmup=ML_ONLINE_WARMUP)
+
+# Workers are forked, so they start before the InfluxDB and Kafka clients run any thread
+pool = None
+if ML_WORKERS > 0:
+    pool = InferencePool(ML_WORKERS, model_path, ML_BACKEND, ML_BATCH_SIZE, ML_MAX_IN_FLIGHT, detector)
+    startup_phase("workers")
 
 # Initialize InfluxDB client
 try:
-    influx_client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
-    influx_writer = influx_client.write_api(write_options=WriteOptions(batch_size=1, flush_interval=1))
+    influx_sink = create_influx_sink(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG, bucket=INFLUX_BUCKET,
+                                  batch_size=INFLUX_BATCH_SIZE, flush_interval_ms=INFLUX_FLUSH_INTERVAL_MS,
+                                  max_pending_batches=INFLUX_MAX_PENDING_BATCHES, gzip=INFLUX_GZIP,
+                                  replication=INFLUX_REPLICATION, writer=INFLUX_WRITER,
+                                  max_in_flight=INFLUX_MAX_IN_FLIGHT)
+    anomaly_schema = create_anomaly_schema(KAFKA_ML_TOPIC, INFLUX_SCHEMA, max_tag_values=INFLUX_MAX_TAG_VALUES,
+                                           max_series=INFLUX_MAX_SERIES)
     logging.info("✅ InfluxDB client initialized successfully")
 except Exception as e:
     logging.error(f"❌ Failed to initialize InfluxDB client: {e}")
     exit(1)
+startup_phase("influx")
 
 if not all([KAFKA_BROKER, KAFKA_INPUT_TOPIC, KAFKA_ML_TOPIC]):
     raise ValueError("Missing required environment variables for Kafka.")
 
 # --- Load the Model ---
+def load_candidate(path: str):
+    """Load, check and warm up a new model for ModelReloader (runs on its thread)."""
+    model = load_model(path, ML_BACKEND)
+    candidate_baseline = load_baseline(path, model)
+    warm_up(model, ML_BATCH_SIZE)
+    return model, candidate_baseline
+
+
 try:
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    model_path = os.path.join(script_dir, "isolation_forest_model.joblib")
-    if not os.path.exists(model_path):
-        raise FileNotFoundError(f"Model file not found at: {model_path}")
-    IF_model = joblib.load(model_path)
-    logging.info("✅ Isolation Forest model loaded successfully.")
+    IF_model = load_model(model_path, ML_BACKEND)
+    baseline = load_baseline(model_path, IF_model)
 except Exception as e:
     logging.error(f"❌ Failed to load the model: {e}")
     raise
+startup_phase("model")
+
+warm_up(IF_model, ML_BATCH_SIZE)
+startup_phase("warmup")
+
+reloader = None
+if ML_RELOAD_INTERVAL_S > 0 or ML_CONTROL_TOPIC:
+    shadow_rows = ML_SHADOW_ROWS
+    if ML_DETECTOR == "online" and shadow_rows > 0:
+        # The forest scores no rows in this mode, so a candidate would never finish its shadow run
+        logging.info("🔁 ML_DETECTOR=online does not use the forest: "
+                     "reloaded models are swapped in without shadow scoring")
+        shadow_rows = 0
+    reloader = ModelReloader(load_candidate, model_path, interval=ML_RELOAD_INTERVAL_S or 3600,
+                             shadow_rows=shadow_rows, max_disagreement=ML_SHADOW_MAX_DISAGREEMENT,
+                             broker=KAFKA_BROKER, control_topic=ML_CONTROL_TOPIC, consumer_group=CONSUMER_GROUP)
 
 # --- Initialize Quix Application ---
+# The batched and pooled loops poll the consumer themselves and read lag from it;
+# the StreamingDataFrame path gets it from librdkafka statistics instead
+sdf_lag = LagTracker() if pool is None and ML_BATCH_SIZE <= 1 else None
 app = Application(
     broker_address=KAFKA_BROKER,
     consumer_group=CONSUMER_GROUP,
     loglevel="INFO",
     state_dir=os.path.dirname(os.path.abspath(__file__)) + "/state/",
-    auto_offset_reset="earliest"
+    auto_offset_reset="earliest",
+    consumer_extra_config=sdf_lag.consumer_config() if sdf_lag is not None else None,
 )
 
 # Define input and output topics
-input_topic = app.topic(KAFKA_INPUT_TOPIC, value_deserializer="json")
-output_topic = app.topic(KAFKA_ML_TOPIC, value_serializer="json")
+input_topic = app.topic(KAFKA_INPUT_TOPIC, value_deserializer=WireDeserializer())
+output_topic = app.topic(KAFKA_ML_TOPIC, value_serializer=WireSerializer(ANOMALY, WIRE_FORMAT))
 
 producer = app.get_producer()
+startup_phase("kafka")
 
-# A simple buffer to store historical data for 'Lag' and 'Rolling_Mean'
-data_buffer = []
-BUFFER_SIZE = 20  # You can adjust this size
+# Feature state ('Lag', 'Rolling_Mean' ring buffer) is kept per message key.
+# The StreamingDataFrame path stores it in the Quix state store (RocksDB, restored
+# from the changelog topic); the batched path keeps it in memory per partition.
+FEATURE_STATE_KEY = "features"
+partition_states = {}
 
-def handle_message(row_data):
-    try:
-        # 1. รับข้อมูลจาก Kafka
-        # logging.info(f"Received message: {row_data}")
+messages_in = MESSAGES_IN.labels(input_topic.name)
+messages_out = MESSAGES_OUT.labels(output_topic.name)
 
-        # 2. เพิ่มข้อมูลเข้า buffer และจัดการขนาด
-        data_buffer.append(row_data)
-        if len(data_buffer) > BUFFER_SIZE:
-            data_buffer.pop(0)
-
-        # 3. เตรียมข้อมูลสำหรับ Model
-        df = pd.DataFrame(data_buffer)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-
-        # 4. Feature Engineering
-        df['Weekday'] = df['timestamp'].dt.strftime('%A')
-        df['Hour'] = df['timestamp'].dt.hour
-        df['Day'] = df['timestamp'].dt.weekday
-        df['Month'] = df['timestamp'].dt.month
-        df['Year'] = df['timestamp'].dt.year
-        df['Month_day'] = df['timestamp'].dt.day
-        df['Lag'] = df['value'].shift(1)
-        df['Rolling_Mean'] = df['value'].rolling(window=7, min_periods=1).mean()
-        # Note: For 'value_Average', you would need to store historical averages or a pre-calculated lookup table.
-        # This example omits it for simplicity in real-time streaming.
-        
-        current_row = df.iloc[-1].to_dict()
-        features_for_model = pd.DataFrame([current_row])[['value', 'Hour', 'Day', 'Month_day', 'Month', 'Rolling_Mean', 'Lag']].dropna()
-
-        if features_for_model.empty:
-            logging.warning("Not enough data in buffer to make a prediction. Skipping.")
-            return
+def publish_result(current_row, key=None):
+    """Publish a scored row to the output topic (under the input key) and InfluxDB."""
+    ts = produce_result(current_row, key)
+    with STAGES['influx_write'].time():
+        write_influx(current_row, ts)
 
-        # 5. ทำนายด้วย Model
-        prediction = IF_model.predict(features_for_model)
-        score = IF_model.decision_function(features_for_model)
-        
-        # 6. เพิ่มผลลัพธ์ลงในข้อมูล
-        current_row['Outliers'] = 1.0 if prediction[0] == -1 else 0.0
-        current_row['Score'] = float(score[0])
-        
-        # 7. Serialize the data before publishing
-        # --- FIX: Convert Timestamp object to string before serialization ---
-        if 'timestamp' in current_row and isinstance(current_row['timestamp'], pd.Timestamp):
-            current_row['timestamp'] = current_row['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
-
-        serialized_data = json.dumps(current_row).encode("utf-8")
-        
-        ts = int(pd.Timestamp(current_row['timestamp']).timestamp() * 1000)
+
+def produce_result(current_row, key=None) -> int:
+    """Publish a scored row to the output topic under the input key; returns its event time in ms."""
+    # 7. Serialize the data before publishing
+    with STAGES['produce'].time():
+        serialized_data = encode(current_row, ANOMALY, WIRE_FORMAT)
+
+        ts = event_time_ms(current_row)
         producer.produce(
             topic=output_topic.name,
+            key=key,
             value=serialized_data,
             timestamp=ts
         )
-        logging.info(f"✅ Published to {KAFKA_ML_TOPIC} - data: {current_row}")
+    messages_out.inc()
+    logging.debug(f"✅ Published to {KAFKA_ML_TOPIC} - data: {current_row}")
+    return ts
 
-        # Write to InfluxDB (only fan_speed_predicted)
-        # Convert timestamp string to pd.Timestamp with UTC
-        ts_val = pd.to_datetime(current_row['timestamp'], utc=True)
-        point = (
-            Point(KAFKA_ML_TOPIC)
-            
-            .tag("Hour", current_row.get("Hour"))
-            .tag("Day", current_row.get("Day"))
-            .tag("Weekday", current_row.get("Weekday"))
-            .tag("Month", current_row.get("Month"))
-            .tag("Month_day", current_row.get("Month_day"))
-            .tag("Year", current_row.get("Year"))
-            .field("Lag", current_row.get("Lag"))
-            .field("Rolling_Mean", current_row.get("Rolling_Mean"))
-            .field("Outliers", current_row.get("Outliers"))
-            .field("Score", current_row.get("Score"))
-            .field("value", current_row.get("value"))
-            .time(ts_val)
-        )
-        influx_writer.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
-        logging.info("[📊] Wrote prediction to InfluxDB for Abnomalie")
 
+def write_influx(current_row, ts):
+    """Queue the scored row for the InfluxDB sink, laid out by anomaly_schema."""
+    # Event time in UTC, taken from the same epoch ms as the Kafka timestamp
+    ts_val = datetime.fromtimestamp(ts / 1000.0, tz=timezone.utc)
+    influx_sink.add(anomaly_schema.line(current_row, ts_val))
+    logging.debug("[📊] Queued prediction for InfluxDB for Abnomalie")
+
+    if INFLUX_WRITE_DATA_COPY:
         point = (
             Point(KAFKA_ML_TOPIC+"_DATA")
-            
+
             .field("Lag", current_row.get("Lag"))
             .field("Rolling_Mean", current_row.get("Rolling_Mean"))
             .field("Outliers", current_row.get("Outliers"))
@@ -158,17 +232,324 @@ def handle_message(row_data):
             .field("value", current_row.get("value"))
             .time(ts_val)
         )
-        influx_writer.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
-        logging.info("[📊] Wrote prediction to InfluxDB for Data")
+        influx_sink.add(point.to_line_protocol())
+        logging.debug("[📊] Queued prediction for InfluxDB for Data")
+
+
+class InfluxAnomalySink(BatchingSink):
+    """
+    InfluxDB writes of the StreamingDataFrame path. On every Quix checkpoint
+    it waits until the output topic and InfluxDB have acknowledged the rows,
+    before the checkpoint commits offsets; a failed write fails the checkpoint.
+    """
+
+    def write(self, batch):
+        for item in batch:
+            with STAGES['influx_write'].time():
+                write_influx(item.value, event_time_ms(item.value))
+
+    def flush(self):
+        super().flush()
+        producer.flush()
+        influx_sink.flush()
+
+
+def swap_model():
+    """
+    Switch to a reloaded model once it has finished its shadow run; only
+    called between batches. Returns the promoted Candidate, if any.
+    """
+    global IF_model, baseline
+    if reloader is None:
+        return None
+    candidate = reloader.promote()
+    if candidate is not None:
+        IF_model, baseline = candidate.model, candidate.baseline
+    return candidate
+
+
+def handle_batch(batch, states):
+    """
+    Build features for a batch of (key, message) pairs in order, score them in
+    one call and publish. `states` maps message keys to their FeatureState.
+    A message that cannot be turned into features is logged and skipped on
+    its own; failures past that point (scoring, Kafka, InfluxDB) propagate,
+    so the batch's offsets are not committed.
+    """
+    swap_model()
+    rows, keys, row_states, features = [], [], [], []
+    with STAGES['features'].time():
+        for key, row_data in batch:
+            feature_state = states.get(key)
+            if feature_state is None:
+                feature_state = states[key] = FeatureState()
+            try:
+                # Raises before touching the state on a malformed message
+                current_row, row_features = feature_state.update(row_data, baseline)
+            except Exception as e:
+                ERRORS.labels('handle_batch').inc()
+                logging.error(f"❌ Error processing message {row_data!r:.200}: {e!r}")
+                continue
+            if row_features is None:
+                logging.warning("Not enough data in buffer to make a prediction. Skipping.")
+                continue
+            rows.append(current_row)
+            keys.append(key)
+            row_states.append(feature_state)
+            features.append(row_features)
 
+    if not rows:
+        return []
+
+    # 5. ทำนายด้วย Model
+    with STAGES['inference'].time():
+        scores, outliers, forest = score_rows(IF_model, detector, row_states, rows, features)
+    if reloader is not None:
+        reloader.shadow(*forest)
+
+    # 6. เพิ่มผลลัพธ์ลงในข้อมูล
+    for current_row, key, score, outlier in zip(rows, keys, scores, outliers):
+        current_row['Outliers'] = outlier
+        current_row['Score'] = score
+        publish_result(current_row, key)
+
+    return rows
+
+
+def handle_message(row_data, key, timestamp, headers, state):
+    try:
+        # 1. รับข้อมูลจาก Kafka
+        # logging.info(f"Received message: {row_data}")
+
+        # 2-4. อัปเดต state ของ key นี้และสร้าง Feature
+        # value_Average / Deviation come from the Hour x Weekday baseline exported with the model
+        messages_in.inc()
+        swap_model()
+        with STAGES['features'].time():
+            feature_state = FeatureState.from_dict(state.get(FEATURE_STATE_KEY))
+            current_row, features = feature_state.update(row_data, baseline)
+
+        if features is None:
+            state.set(FEATURE_STATE_KEY, feature_state.to_dict())
+            logging.warning("Not enough data in buffer to make a prediction. Skipping.")
+            return
+
+        # 5. ทำนายด้วย Model
+        with STAGES['inference'].time():
+            scores, outliers, forest = score_rows(IF_model, detector, [feature_state], [current_row], [features])
+        # The online detector keeps its statistics in the feature state too
+        state.set(FEATURE_STATE_KEY, feature_state.to_dict())
+        if reloader is not None:
+            reloader.shadow(*forest)
+
+        # 6. เพิ่มผลลัพธ์ลงในข้อมูล
+        current_row['Outliers'] = outliers[0]
+        current_row['Score'] = scores[0]
+
+        # InfluxAnomalySink writes the returned row
+        produce_result(current_row, key)
 
         return current_row
     except Exception as e:
+        ERRORS.labels('handle_message').inc()
         logging.error(f"❌ Error processing message: {e}")
 
+
+def decode_message(msg):
+    """The message's row, or None (logged and counted) if it is neither binary nor JSON."""
+    try:
+        with STAGES['deserialize'].time():
+            return decode(msg.value())
+    except ValueError as e:
+        ERRORS.labels('deserialize').inc()
+        logging.error(f"❌ Invalid message at {msg.topic()}[{msg.partition()}]@{msg.offset()}: {e}")
+        return None
+
+
+def run_batched():
+    """
+    Consume with a plain Kafka consumer and score up to ML_BATCH_SIZE events
+    (or ML_BATCH_MAX_WAIT_MS worth) per partition at once.
+    Offsets are committed once a batch has been published to Kafka and
+    its points have been acknowledged by InfluxDB.
+    """
+    batcher = MicroBatcher(ML_BATCH_SIZE, ML_BATCH_MAX_WAIT_MS)
+    lag = LagTracker()
+
+    def flush(consumer, partition, batch):
+        if not batch:
+            return
+        handle_batch([(msg.key(), row_data) for msg, row_data in batch],
+                     partition_states.setdefault(partition, {}))
+        producer.flush()
+        last = batch[-1][0]
+        influx_sink.track(last.topic(), partition, last.offset())
+
+    def on_revoke(consumer, partitions):
+        for tp in partitions:
+            flush(consumer, tp.partition, batcher.pop(tp.partition))
+            partition_states.pop(tp.partition, None)
+        influx_sink.flush(consumer)
+
+    def on_lost(consumer, partitions):
+        # Lost partitions may already belong to another member: drop, don't commit
+        for tp in partitions:
+            batcher.pop(tp.partition)
+            partition_states.pop(tp.partition, None)
+
+    with app.get_consumer(auto_commit_enable=False) as consumer, producer:
+        consumer.subscribe([input_topic.name], on_revoke=on_revoke, on_lost=on_lost)
+        logging.info(f"🚀 Micro-batching {KAFKA_INPUT_TOPIC}: batch_size={ML_BATCH_SIZE}, max_wait_ms={ML_BATCH_MAX_WAIT_MS}")
+        try:
+            while True:
+                msg = consumer.poll(timeout=batcher.poll_timeout())
+                if msg is not None:
+                    if msg.error():
+                        logging.error(f"❌ Kafka error: {msg.error()}")
+                    else:
+                        messages_in.inc()
+                        row_data = decode_message(msg)
+                        batch = batcher.add(msg.partition(), (msg, row_data)) if row_data is not None else None
+                        if batch:
+                            flush(consumer, msg.partition(), batch)
+                for partition, batch in batcher.expired():
+                    flush(consumer, partition, batch)
+                influx_sink.sync(consumer)
+                lag.update(consumer, producer)
+        finally:
+            for partition, batch in batcher.drain():
+                flush(consumer, partition, batch)
+            influx_sink.flush(consumer)
+
+
+def run_pooled():
+    """
+    Consume like run_batched, but build features and score on the
+    InferencePool (ML_WORKERS processes). The poll loop only deserializes,
+    dispatches batches and publishes the ones the workers have finished,
+    in the order they were dispatched; offsets are committed once a
+    batch's rows are in Kafka and acknowledged by InfluxDB.
+    """
+    batcher = MicroBatcher(ML_BATCH_SIZE, ML_BATCH_MAX_WAIT_MS)
+    lag = LagTracker()
+
+    def publish(tickets, discard=()):
+        if not tickets:
+            return
+        for ticket in tickets:
+            if ticket.partition in discard:
+                continue
+            if ticket.error is not None:
+                # Not a bad message: the worker or the model failed, leave the offsets uncommitted
+                raise ticket.error
+            for error in ticket.invalid:
+                ERRORS.labels('handle_batch').inc()
+                logging.error(f"❌ Error processing message {error}")
+            STAGES['features'].observe(ticket.features_seconds)
+            STAGES['inference'].observe(ticket.inference_seconds)
+            if ticket.skipped:
+                logging.warning(f"Not enough data in buffer to make a prediction. Skipped {ticket.skipped} rows.")
+            if reloader is not None:
+                reloader.shadow(*ticket.forest)
+            for current_row, key in zip(ticket.rows, ticket.keys):
+                publish_result(current_row, key)
+        producer.flush()
+        for ticket in tickets:
+            if ticket.partition not in discard:
+                last = ticket.context
+                influx_sink.track(last.topic(), ticket.partition, last.offset())
+
+    def dispatch(partition, batch):
+        if not batch:
+            return
+        candidate = swap_model()
+        if candidate is not None:
+            # The workers load it in the background and keep scoring with the old one meanwhile
+            pool.prepare_model(candidate.path, ML_BACKEND)
+        try:
+            switched = pool.switch_model()
+        except Exception as e:
+            MODEL_RELOADS.labels('failed').inc()
+            logging.error(f"❌ Inference workers failed to load the new model: {e}")
+        else:
+            if switched is not None:
+                logging.info(f"✅ Inference workers switched to model from {switched}")
+        # Bounded in-flight work: publish the oldest batch before handing out another
+        if pool.full():
+            publish(pool.completed(wait_for=1))
+        pool.submit(partition, [(msg.key(), row_data) for msg, row_data in batch], context=batch[-1][0])
+
+    def on_revoke(consumer, partitions):
+        revoked = [tp.partition for tp in partitions]
+        for partition in revoked:
+            dispatch(partition, batcher.pop(partition))
+        publish(pool.completed(wait_for=len(pool)))
+        pool.drop(revoked)
+        influx_sink.flush(consumer)
+
+    def on_lost(consumer, partitions):
+        # Lost partitions may already belong to another member: drop, don't commit
+        lost = [tp.partition for tp in partitions]
+        for partition in lost:
+            batcher.pop(partition)
+        publish(pool.completed(wait_for=len(pool)), discard=lost)
+        pool.drop(lost)
+
+    with app.get_consumer(auto_commit_enable=False) as consumer, producer:
+        consumer.subscribe([input_topic.name], on_revoke=on_revoke, on_lost=on_lost)
+        logging.info(f"🚀 Scoring {KAFKA_INPUT_TOPIC} on {ML_WORKERS} workers: batch_size={ML_BATCH_SIZE}, "
+                     f"max_wait_ms={ML_BATCH_MAX_WAIT_MS}, max_in_flight={ML_MAX_IN_FLIGHT}")
+        try:
+            while True:
+                # Come back quickly while batches are being scored, to publish them
+                timeout = batcher.poll_timeout()
+                msg = consumer.poll(timeout=min(timeout, 0.005) if len(pool) else timeout)
+                if msg is not None:
+                    if msg.error():
+                        logging.error(f"❌ Kafka error: {msg.error()}")
+                    else:
+                        messages_in.inc()
+                        row_data = decode_message(msg)
+                        batch = batcher.add(msg.partition(), (msg, row_data)) if row_data is not None else None
+                        if batch:
+                            dispatch(msg.partition(), batch)
+                for partition, batch in batcher.expired():
+                    dispatch(partition, batch)
+                publish(pool.completed())
+                influx_sink.sync(consumer)
+                lag.update(consumer, producer)
+        finally:
+            for partition, batch in batcher.drain():
+                dispatch(partition, batch)
+            publish(pool.completed(wait_for=len(pool)))
+            influx_sink.flush(consumer)
+            pool.close()
+
+
+def report_startup():
+    """Log and export how long each startup phase took."""
+    startup['total'] = time.perf_counter() - STARTED
+    for phase, seconds in startup.items():
+        STARTUP_SECONDS.labels(phase).set(seconds)
+    logging.info("⏱️ Ready in " + ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in startup.items()))
+
+
 # Run the application
 if __name__ == "__main__":
-    sdf = app.dataframe(input_topic)
-    sdf = sdf.apply(handle_message)
+    start_metrics_server(8002)
+    report_startup()
+    if reloader is not None:
+        reloader.start()
+    if pool is not None:
+        run_pooled()
+    elif ML_BATCH_SIZE > 1:
+        run_batched()
+    else:
+        sdf = app.dataframe(input_topic)
+        sdf = sdf.apply(handle_message, stateful=True, metadata=True)
+        sdf = sdf.filter(lambda row: row is not None)
 
-    app.run(sdf)
+        # Quix commits on its own checkpoints, after InfluxAnomalySink has flushed
+        sdf.sink(InfluxAnomalySink())
+        app.run()
+        influx_sink.close()
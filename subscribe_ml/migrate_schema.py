@@ -0,0 +1,196 @@
+"""
+Rewrite subscribe_ml's anomaly measurement into another schema layout.
+
+Reads the measurement back from InfluxDB one `--window-hours` window at a
+time (fields pivoted into rows, tags as columns), re-encodes every row with
+the `--schema` layout of `common/influx_schema.py` and writes it to
+`--target-bucket` / `--target-measurement`. The calendar tags of the legacy
+layout come back as strings and are written as integer fields, the same
+types `subscribe_ml` writes itself.
+
+With `--checkpoint`, the end of the last migrated window is saved there and
+a rerun resumes from it. `--delete-source` deletes each window from the
+source once it is written (refused when source and target are the same
+measurement), `--drop-data-copy` deletes the `<measurement>_DATA` copy for
+the window too.
+
+Usage:
+    python migrate_schema.py --start 2014-07-01T00:00:00Z --target-bucket iot_data_v2
+    python migrate_schema.py --start 2014-07-01T00:00:00Z --target-measurement taxi-demand-anomalies-v2 \
+        --checkpoint migrate.ckpt --delete-source --drop-data-copy
+    python migrate_schema.py --start 2014-07-01T00:00:00Z --stop 2014-07-02T00:00:00Z --output - | head
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from influxdb_client import InfluxDBClient
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.influx_schema import ANOMALY_CALENDAR, ANOMALY_SCHEMAS, MeasurementSchema
+
+# Columns of a pivoted Flux record that are not row data
+FLUX_COLUMNS = {'result', 'table', '_start', '_stop', '_time', '_measurement'}
+
+
+def parse_time(value: str) -> datetime:
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def rfc3339(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def windows(start: datetime, stop: datetime, hours: float):
+    step = timedelta(hours=hours)
+    while start < stop:
+        yield start, min(start + step, stop)
+        start += step
+
+
+def window_query(bucket: str, measurement: str, start: datetime, stop: datetime) -> str:
+    return f'''
+from(bucket: "{bucket}")
+  |> range(start: {rfc3339(start)}, stop: {rfc3339(stop)})
+  |> filter(fn: (r) => r._measurement == "{measurement}")
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+'''
+
+
+def record_row(values: dict) -> dict:
+    """A pivoted Flux record as the row dict subscribe_ml scored."""
+    row = {key: value for key, value in values.items() if key not in FLUX_COLUMNS}
+    for key in ANOMALY_CALENDAR:
+        # Tags are strings in InfluxDB; the numeric calendar columns are ints in the row
+        if isinstance(row.get(key), str) and row[key].isdigit():
+            row[key] = int(row[key])
+    return row
+
+
+def load_checkpoint(path: str, source: str):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['source'] != source:
+        raise ValueError(f"Checkpoint {path} is for {checkpoint['source']}, not {source}")
+    return checkpoint['position']
+
+
+def save_checkpoint(path: str, source: str, position):
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'source': source, 'position': position}, f)
+    os.replace(tmp, path)
+
+
+def run(config: dict) -> dict:
+    target_bucket = config['target_bucket'] or config['bucket']
+    target_measurement = config['target_measurement'] or config['measurement']
+    if config['delete_source'] and (target_bucket, target_measurement) == (config['bucket'], config['measurement']):
+        raise ValueError("--delete-source needs a different --target-bucket or --target-measurement")
+
+    tags, fields = ANOMALY_SCHEMAS[config['schema']]
+    # The guard is for live data; a migration writes exactly the declared layout
+    schema = MeasurementSchema(target_measurement, tags, fields, max_tag_values=0, max_series=0)
+    source = f"{config['bucket']}/{config['measurement']}"
+    start = parse_time(config['start'])
+    stop = parse_time(config['stop']) if config['stop'] else datetime.now(timezone.utc)
+    resumed = load_checkpoint(config['checkpoint'], source)
+    if resumed:
+        start = max(start, parse_time(resumed))
+        logging.info(f"↩️ Resuming {source} from {resumed}")
+
+    out = None
+    if config['output']:
+        out = sys.stdout if config['output'] == '-' else open(config['output'], 'w')
+    client = InfluxDBClient(url=config['url'], token=config['token'], org=config['org'], timeout=120_000)
+    query_api = client.query_api()
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+    delete_api = client.delete_api()
+
+    started = time.perf_counter()
+    rows = windows_done = 0
+    try:
+        for window_start, window_stop in windows(start, stop, config['window_hours']):
+            query = window_query(config['bucket'], config['measurement'], window_start, window_stop)
+            lines = []
+            for record in query_api.query_stream(query, org=config['org']):
+                lines.append(schema.line(record_row(record.values), record.get_time()))
+                if len(lines) >= config['batch_size']:
+                    rows += write(lines, out, write_api, target_bucket, config['org'])
+                    lines = []
+            rows += write(lines, out, write_api, target_bucket, config['org'])
+
+            if out is None and config['delete_source']:
+                delete_api.delete(window_start, window_stop, f'_measurement="{config["measurement"]}"',
+                                  bucket=config['bucket'], org=config['org'])
+            if out is None and config['drop_data_copy']:
+                delete_api.delete(window_start, window_stop, f'_measurement="{config["measurement"]}_DATA"',
+                                  bucket=config['bucket'], org=config['org'])
+            if config['checkpoint']:
+                save_checkpoint(config['checkpoint'], source, rfc3339(window_stop))
+            windows_done += 1
+            logging.info(f"✅ {rfc3339(window_start)} .. {rfc3339(window_stop)}: {rows} rows so far")
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+        client.close()
+
+    seconds = time.perf_counter() - started
+    return {
+        'source': source,
+        'target': f"{target_bucket}/{target_measurement}",
+        'schema': config['schema'],
+        'windows': windows_done,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rate': round(rows / seconds, 1) if seconds else None,
+    }
+
+
+def write(lines: list, out, write_api, bucket: str, org: str) -> int:
+    if not lines:
+        return 0
+    if out is not None:
+        out.write("\n".join(lines) + "\n")
+    else:
+        write_api.write(bucket=bucket, org=org, record=lines)
+    return len(lines)
+
+
+def parse_args(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("INFLUX_URL", "http://172.16.2.117:8086"))
+    parser.add_argument("--token", default=os.getenv("INFLUX_TOKEN"))
+    parser.add_argument("--org", default=os.getenv("INFLUX_ORG"))
+    parser.add_argument("--bucket", default=os.getenv("INFLUX_BUCKET"), help="source bucket")
+    parser.add_argument("--measurement", default=os.getenv("KAFKA_ML_TOPIC", "taxi-demand-anomalies"),
+                        help="source measurement")
+    parser.add_argument("--target-bucket", help="default: the source bucket")
+    parser.add_argument("--target-measurement", help="default: the source measurement")
+    parser.add_argument("--schema", default="compact", choices=sorted(ANOMALY_SCHEMAS))
+    parser.add_argument("--start", required=True, help="RFC 3339 time, e.g. 2014-07-01T00:00:00Z")
+    parser.add_argument("--stop", help="RFC 3339 time (default: now)")
+    parser.add_argument("--window-hours", type=float, default=24, help="time range read per query")
+    parser.add_argument("--batch-size", type=int, default=5000, help="points per write request")
+    parser.add_argument("--checkpoint", help="file to save progress to and resume from")
+    parser.add_argument("--delete-source", action="store_true", help="delete each window from the source once written")
+    parser.add_argument("--drop-data-copy", action="store_true", help="delete the <measurement>_DATA copy as well")
+    parser.add_argument("--output", help="write line protocol to this file ('-' = stdout) instead of InfluxDB")
+    return vars(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    config = parse_args()
+    # Keep stdout for the line protocol with --output -
+    print(json.dumps(run(config), indent=2), file=sys.stderr if config['output'] == '-' else sys.stdout)
@@ -0,0 +1,136 @@
+"""
+Streaming robust z-score detector, alone or in front of the Isolation Forest.
+
+Per key the detector keeps an EWMA of the log residual
+`log1p(value) - log1p(value_Average)` (the Hour x Weekday baseline;
+`Rolling_Mean` for models without one; demand varies multiplicatively, so
+the log keeps quiet night hours and busy evenings on one scale) and an EWMA
+of its absolute deviation, a streaming stand-in for the median and MAD. A
+row's z is its distance from that mean in MAD units (1.4826 * MAD ~ one
+standard deviation). Updates are clipped at `clip` scales, so even an
+anomaly lasting hours (a snowstorm) barely moves the estimates. State is
+three numbers per key, kept in `FeatureState.detector`; one row costs a few
+float operations instead of a walk down every tree of the forest.
+
+Modes (ML_DETECTOR):
+
+- "forest":  the Isolation Forest scores every row (no detector)
+- "online":  the detector alone, flagging z >= `threshold`
+- "cascade": rows with z >= `suspicious` (and keys still warming up) go to
+             the forest, which decides; the rest are normal without it
+- "shadow":  the forest decides, the detector runs next to it and its
+             agreement is exported
+
+Rows the forest did not score get `Score = 1 - z / threshold`, which is
+positive for normal rows and negative for outliers like the forest's
+decision function, though on a different scale.
+"""
+import math
+
+from batching import score_batch
+from common.metrics import ONLINE_DETECTOR_ROWS
+
+MODES = ("forest", "online", "cascade", "shadow")
+# 1.4826 * MAD estimates the standard deviation of normal data
+MAD_SCALE = 1.4826
+MIN_SCALE = 1e-6
+
+
+class OnlineDetector:
+    """
+    :param alpha: EWMA weight of a new residual
+    :param threshold: z from which a row is an outlier
+    :param suspicious: z from which the cascade asks the forest
+    :param warmup: rows per key before z is trusted
+    :param clip: max step of the estimates, in scales
+    """
+
+    def __init__(self, mode: str = "cascade", alpha: float = 0.01, threshold: float = 4.0,
+                 suspicious: float = 2.5, warmup: int = 24, clip: float = 1.5):
+        if mode not in MODES:
+            raise ValueError(f"Unknown detector mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.alpha = alpha
+        self.threshold = threshold
+        self.suspicious = suspicious
+        self.warmup = warmup
+        self.clip = clip
+
+    def update(self, feature_state, current_row: dict):
+        """
+        z of the row against its key's history (None while warming up), then
+        learn from it. A row without a finite residual gets None and leaves
+        the state as it is.
+        """
+        level = current_row.get('value_Average')
+        if level is None:
+            level = current_row['Rolling_Mean']
+        residual = math.log1p(max(float(current_row['value']), 0.0)) - math.log1p(max(level, 0.0))
+        if not math.isfinite(residual):
+            # max() passes NaN through: one missing value would poison the key's estimates for good
+            return None
+        state = feature_state.detector
+        if state is None or not (math.isfinite(state[0]) and math.isfinite(state[1])):
+            # No history yet, or a snapshot poisoned before missing values were skipped
+            feature_state.detector = [residual, 0.0, 1]
+            return None
+
+        mean, mad, count = state
+        # Plain averages until the EWMA has seen enough rows to stand on its own
+        alpha = max(self.alpha, 1.0 / (count + 1))
+        step = residual - mean
+        scale = max(MAD_SCALE * mad, MIN_SCALE)
+        z = abs(step) / scale if count >= self.warmup else None
+        if z is not None:
+            # Clipped (Huber) update: an outlier moves the estimates by at most `clip` scales
+            limit = self.clip * scale
+            step = max(-limit, min(limit, step))
+        mean += alpha * step
+        mad += alpha * (abs(step) - mad)
+        state[0], state[1], state[2] = mean, mad, count + 1
+        return z
+
+    def decision(self, z) -> float:
+        return 1.0 if z is None else 1.0 - z / self.threshold
+
+
+def score_rows(model, detector, feature_states: list, rows: list, features: list):
+    """
+    Score rows built by `FeatureState.update`, with the forest, the detector
+    or both depending on `detector.mode` (None = forest only).
+    Returns (scores, outliers, forest) where `forest` is the
+    (features, scores, outliers) subset the forest scored, for shadowing.
+    """
+    if detector is None or detector.mode == "forest":
+        scores, outliers = score_batch(model, features)
+        return scores, outliers, (features, scores, outliers)
+
+    zs = [detector.update(state, row) for state, row in zip(feature_states, rows)]
+    if detector.mode == "online":
+        outliers = [1.0 if z is not None and z >= detector.threshold else 0.0 for z in zs]
+        ONLINE_DETECTOR_ROWS.labels(detector.mode, 'scored').inc(len(zs))
+        return [detector.decision(z) for z in zs], outliers, ([], [], [])
+
+    if detector.mode == "shadow":
+        scores, outliers = score_batch(model, features)
+        agree = sum(1 for z, outlier in zip(zs, outliers)
+                    if (z is not None and z >= detector.threshold) == (outlier == 1.0))
+        ONLINE_DETECTOR_ROWS.labels(detector.mode, 'agree').inc(agree)
+        ONLINE_DETECTOR_ROWS.labels(detector.mode, 'disagree').inc(len(zs) - agree)
+        return scores, outliers, (features, scores, outliers)
+
+    # cascade
+    forward = [i for i, z in enumerate(zs) if z is None or z >= detector.suspicious]
+    scores = [detector.decision(z) for z in zs]
+    outliers = [0.0] * len(zs)
+    forest = ([], [], [])
+    if forward:
+        forward_features = [features[i] for i in forward]
+        forest_scores, forest_outliers = score_batch(model, forward_features)
+        for i, score, outlier in zip(forward, forest_scores, forest_outliers):
+            scores[i] = score
+            outliers[i] = outlier
+        forest = (forward_features, forest_scores, forest_outliers)
+    ONLINE_DETECTOR_ROWS.labels(detector.mode, 'forwarded').inc(len(forward))
+    ONLINE_DETECTOR_ROWS.labels(detector.mode, 'skipped').inc(len(zs) - len(forward))
+    return scores, outliers, forest
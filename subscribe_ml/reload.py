@@ -0,0 +1,234 @@
+"""
+Hot model reload for subscribe_ml.
+
+`ModelReloader` runs a background thread that notices a new model version,
+either because the files at the model path changed (train.py replaces them
+atomically) or because a message arrived on a control topic, and loads and
+warms it up off the consuming thread. The new model then scores every batch
+in shadow next to the live one; after `shadow_rows` rows the divergence
+(share of rows whose outlier flag differs, mean and max score difference)
+is logged and exported, and the candidate replaces the live model between
+two batches. Consumption never stops and the consumer group never rebalances.
+
+A control message is JSON, e.g. `{"model_path": "/models/isolation_forest_model-20240101T000000Z.joblib"}`;
+an empty object reloads the watched path. Promoting a model from another path
+does not move the watch: new files train.py writes at the model path are
+still picked up.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+
+from batching import score_batch
+from common.metrics import ERRORS, MODEL_RELOADS, MODEL_SHADOW_DISAGREEMENT, MODEL_SHADOW_SCORE_DIFF
+from features import FEATURE_COLUMNS
+
+
+def artifact_version(model_path: str) -> tuple:
+    """(mtime, size) of the model files that exist; changes whenever train.py replaces them."""
+    stem = os.path.splitext(model_path)[0]
+    version = []
+    for path in (model_path, stem + '.forest', stem + '.baseline.json'):
+        try:
+            stat = os.stat(path)
+            version.append((path, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            pass
+    return tuple(version)
+
+
+def rebase_features(features: list, baseline) -> list:
+    """The same feature vectors with the BASELINE_COLUMNS taken from another model's `baseline`."""
+    width = len(FEATURE_COLUMNS)
+    if baseline is None:
+        return [f[:width] for f in features]
+    rebased = []
+    for f in features:
+        # FEATURE_COLUMNS order: value, Hour, Day, ...
+        average = baseline.lookup(int(f[2]), int(f[1]))
+        rebased.append(list(f[:width]) + [average, f[0] - average])
+    return rebased
+
+
+class Candidate:
+    """A loaded model waiting in shadow, with its divergence from the live model so far."""
+
+    def __init__(self, path: str, model, baseline):
+        self.path = path
+        self.model = model
+        self.baseline = baseline
+        self.rows = 0
+        self.disagreements = 0
+        self.score_diff = 0.0
+        self.max_score_diff = 0.0
+
+    def compare(self, features: list, scores: list, outliers: list):
+        shadow_scores, shadow_outliers = score_batch(self.model, rebase_features(features, self.baseline))
+        for live, shadow, live_flag, shadow_flag in zip(scores, shadow_scores, outliers, shadow_outliers):
+            diff = abs(shadow - live)
+            self.score_diff += diff
+            self.max_score_diff = max(self.max_score_diff, diff)
+            self.disagreements += live_flag != shadow_flag
+        self.rows += len(scores)
+
+    def stats(self) -> dict:
+        return {
+            'rows': self.rows,
+            'disagreement': self.disagreements / self.rows if self.rows else 0.0,
+            'mean_score_diff': self.score_diff / self.rows if self.rows else 0.0,
+            'max_score_diff': self.max_score_diff,
+        }
+
+
+class ModelReloader:
+    """
+    Watches `model_path` (every `interval` seconds) and optionally a Kafka
+    control topic for new model versions.
+
+    :param loader: `loader(path) -> (model, baseline)`, loads and warms up a model
+    :param shadow_rows: rows scored by both models before the swap, 0 swaps right away
+    :param max_disagreement: reject the candidate if more rows than this share flip their outlier flag
+    """
+
+    def __init__(self, loader, model_path: str, interval: float = 10.0, shadow_rows: int = 1000,
+                 max_disagreement: float = 1.0, broker: str = None, control_topic: str = None,
+                 consumer_group: str = None):
+        self.loader = loader
+        # Watched for new versions; `live_path` is where the live model came from
+        self.path = self.live_path = model_path
+        # Last version of `path` loaded (or failed to load), so each version is tried once
+        self.seen = self._polled = artifact_version(model_path)
+        self.interval = interval
+        self.shadow_rows = shadow_rows
+        self.max_disagreement = max_disagreement
+        self.broker = broker
+        self.control_topic = control_topic
+        self.consumer_group = consumer_group
+        self.candidate = None
+        self._ready = None
+        self._requested = None
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._threads.append(threading.Thread(target=self._watch, name="model-reload", daemon=True))
+        if self.control_topic:
+            self._threads.append(threading.Thread(target=self._listen, name="model-control", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"🔁 Watching {self.path} for new models every {self.interval}s"
+                     + (f" and control topic {self.control_topic}" if self.control_topic else ""))
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def request(self, model_path: str = None):
+        """Load `model_path` (default: the watched path) as the next candidate."""
+        self._requested = model_path or self.path
+        self._wake.set()
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            path, self._requested = self._requested, None
+            if path is not None:
+                if path == self.path:
+                    # Already loaded: the watch must not load the same version again
+                    self.seen = self._polled = artifact_version(path)
+                self._load(path)
+                continue
+            version, previous = artifact_version(self.path), self._polled
+            self._polled = version
+            if not version or version == self.seen:
+                continue
+            # train.py replaces the files one by one: wait until they stop changing
+            if version != previous:
+                continue
+            self.seen = version
+            self._load(self.path)
+
+    def _load(self, path: str):
+        try:
+            model, baseline = self.loader(path)
+        except Exception as e:
+            MODEL_RELOADS.labels('failed').inc()
+            logging.error(f"❌ Failed to load new model from {path}: {e}")
+            return
+        # A newer version replaces one still waiting for the shadow run
+        self._ready = Candidate(path, model, baseline)
+        logging.info(f"🆕 New model from {path} loaded, scoring in shadow for {self.shadow_rows} rows")
+
+    def _listen(self):
+        from confluent_kafka import Consumer
+
+        # Every replica has to see every control message, so each gets its own group
+        consumer = Consumer({
+            'bootstrap.servers': self.broker,
+            'group.id': f"{self.consumer_group}-control-{socket.gethostname()}",
+            'auto.offset.reset': 'latest',
+        })
+        consumer.subscribe([self.control_topic])
+        try:
+            while not self._stopped.is_set():
+                msg = consumer.poll(1.0)
+                if msg is None:
+                    continue
+                if msg.error():
+                    logging.error(f"❌ Control topic error: {msg.error()}")
+                    continue
+                try:
+                    command = json.loads(msg.value() or b'{}')
+                except ValueError:
+                    ERRORS.labels('model_control').inc()
+                    logging.error(f"❌ Invalid control message: {msg.value()!r}")
+                    continue
+                logging.info(f"📨 Model reload requested: {command}")
+                self.request(command.get('model_path'))
+        finally:
+            consumer.close()
+
+    def shadow(self, features: list, scores: list, outliers: list):
+        """Score a batch with the candidate too, after the live model has scored it."""
+        if self.candidate is None and self._ready is not None:
+            self.candidate, self._ready = self._ready, None
+        if self.candidate is not None and features:
+            try:
+                self.candidate.compare(features, scores, outliers)
+            except Exception as e:
+                MODEL_RELOADS.labels('failed').inc()
+                logging.error(f"❌ Candidate model from {self.candidate.path} failed in shadow: {e}")
+                self.candidate = None
+
+    def promote(self):
+        """
+        Called between batches: returns the Candidate that should replace the
+        live model once it has scored enough rows in shadow, else None.
+        """
+        if self.candidate is None and self._ready is not None and self.shadow_rows <= 0:
+            self.candidate, self._ready = self._ready, None
+        candidate = self.candidate
+        if candidate is None or candidate.rows < self.shadow_rows:
+            return None
+        self.candidate = None
+
+        stats = candidate.stats()
+        MODEL_SHADOW_DISAGREEMENT.set(stats['disagreement'])
+        MODEL_SHADOW_SCORE_DIFF.set(stats['mean_score_diff'])
+        summary = (f"{stats['rows']} rows, {stats['disagreement']:.2%} flags differ, "
+                   f"score diff mean {stats['mean_score_diff']:.4f} max {stats['max_score_diff']:.4f}")
+        if stats['disagreement'] > self.max_disagreement:
+            MODEL_RELOADS.labels('rejected').inc()
+            logging.warning(f"⛔ Keeping the live model, candidate from {candidate.path} diverged: {summary}")
+            return None
+        MODEL_RELOADS.labels('promoted').inc()
+        self.live_path = candidate.path
+        logging.info(f"✅ Swapped in model from {candidate.path} after shadow scoring: {summary}")
+        return candidate
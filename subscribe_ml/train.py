@@ -0,0 +1,277 @@
+"""
+Headless training for the taxi anomaly detector.
+
+Loads a (timestamp, value) history from CSV or Parquet, builds the streaming
+features (features.feature_frame), grid-searches contamination, n_estimators
+and max_samples over a process pool and writes:
+
+- isolation_forest_model-<version>.joblib         the fitted IsolationForest
+- isolation_forest_model-<version>.json           params, metrics, search results
+- isolation_forest_model-<version>.baseline.json  Hour x Weekday value_Average
+- isolation_forest_model-<version>.forest         the same forest in forest.py's
+                                                  memory-mappable format
+- isolation_forest_model.joblib / .forest /       atomically replaced with the
+  .baseline.json                                  new set (what subscribe_ml loads)
+
+Unless `--no-baseline` is given, the model also gets the baseline's
+value_Average and Deviation features.
+
+Candidates are ranked by event-window F1 when `--labels` is given (a CSV of
+anomaly windows with `start,end` columns), otherwise by score separation:
+the gap between the mean inlier and outlier decision scores in units of
+their standard deviation.
+
+Usage:
+    python train.py --data nyc_taxi.csv --processes 8
+    python train.py --data history.parquet --contamination 0.001 0.005 --n-estimators 200 400
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import IsolationForest
+
+from features import BASELINE_COLUMNS, FEATURE_COLUMNS, Baseline, baseline_path, feature_frame
+from forest import CompiledForest
+
+MODEL_NAME = "isolation_forest_model"
+
+# Filled in each worker process by _init_worker
+_X = None
+_event_ids = None
+_n_events = 0
+
+
+def load_history(path: str) -> pd.DataFrame:
+    """Read a CSV or Parquet history with `timestamp` and `value` columns, in event order."""
+    if path.endswith(('.parquet', '.pq')):
+        df = pd.read_parquet(path, columns=['timestamp', 'value'])
+    else:
+        df = pd.read_csv(path, usecols=['timestamp', 'value'], parse_dates=['timestamp'])
+    return df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+
+
+def label_events(index: pd.DatetimeIndex, labels: pd.DataFrame) -> np.ndarray:
+    """Window number (0..n-1) each row falls into, -1 outside every anomaly window."""
+    event_ids = np.full(len(index), -1)
+    for i, (start, end) in enumerate(zip(pd.to_datetime(labels['start']), pd.to_datetime(labels['end']))):
+        event_ids[(index >= start) & (index <= end)] = i
+    return event_ids
+
+
+def evaluate(model: IsolationForest, X: np.ndarray, event_ids, n_events: int) -> dict:
+    """Metrics for a fitted model; `objective` is what the search maximizes."""
+    scores = model.decision_function(X)
+    flagged = scores < 0
+    metrics = {'flagged': int(flagged.sum()), 'flagged_ratio': float(flagged.mean())}
+
+    inliers, outliers = scores[~flagged], scores[flagged]
+    separation = 0.0
+    if len(inliers) and len(outliers):
+        separation = float((inliers.mean() - outliers.mean()) / (scores.std() or 1.0))
+    metrics['separation'] = separation
+
+    if event_ids is None:
+        metrics['objective'] = separation
+        return metrics
+
+    metrics.update(event_metrics(flagged, event_ids, n_events))
+    metrics['objective'] = metrics['f1']
+    return metrics
+
+
+def event_metrics(flagged: np.ndarray, event_ids: np.ndarray, n_events: int) -> dict:
+    """
+    Event-level precision/recall: a window counts as found if any of its rows
+    is flagged, a flag counts as a false alarm if it falls outside every window.
+    """
+    found = len(np.unique(event_ids[flagged & (event_ids >= 0)]))
+    false_alarms = int((flagged & (event_ids < 0)).sum())
+    recall = found / n_events if n_events else 0.0
+    precision = found / (found + false_alarms) if found + false_alarms else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'events_found': found, 'events': n_events, 'false_alarms': false_alarms,
+            'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def _init_worker(X, event_ids, n_events):
+    global _X, _event_ids, _n_events
+    _X, _event_ids, _n_events = X, event_ids, n_events
+
+
+def _fit_candidate(params: dict, n_jobs: int, seed: int) -> dict:
+    started = time.perf_counter()
+    model = IsolationForest(random_state=seed, n_jobs=n_jobs, **params).fit(_X)
+    fit_seconds = time.perf_counter() - started
+    metrics = evaluate(model, _X, _event_ids, _n_events)
+    metrics['fit_seconds'] = round(fit_seconds, 3)
+    return {'params': params, 'metrics': metrics}
+
+
+def search(X: np.ndarray, grid: dict, event_ids=None, n_events: int = 0,
+           processes: int = None, n_jobs: int = 1, seed: int = 0) -> list:
+    """Fit every combination in `grid` over a process pool; results sorted best first."""
+    keys = sorted(grid)
+    candidates = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(X, event_ids, n_events)) as pool:
+        futures = [pool.submit(_fit_candidate, params, n_jobs, seed) for params in candidates]
+        results = []
+        for future in futures:
+            result = future.result()
+            logging.info(f"🔎 {result['params']} -> objective {result['metrics']['objective']:.4f} "
+                         f"({result['metrics']['fit_seconds']}s)")
+            results.append(result)
+    return sorted(results, key=lambda r: r['metrics']['objective'], reverse=True)
+
+
+def sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _replace(source: str, target: str):
+    tmp = target + ".tmp"
+    shutil.copyfile(source, tmp)
+    os.replace(tmp, target)
+
+
+def save_model(model: IsolationForest, metadata: dict, output: str, baseline: Baseline = None) -> dict:
+    """
+    Write the versioned artifact, sidecar, baseline and compiled forest next to
+    `output`, then replace `output` (and its baseline and forest) so readers
+    never see a half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(output))[0]
+    version = metadata['version']
+
+    artifact = os.path.join(directory, f"{stem}-{version}.joblib")
+    joblib.dump(model, artifact)
+    metadata['artifact'] = os.path.basename(artifact)
+    metadata['sha256'] = sha256(artifact)
+    paths = {'artifact': artifact, 'forest': os.path.join(directory, f"{stem}-{version}.forest")}
+    CompiledForest.from_sklearn(model).save(paths['forest'])
+    metadata['forest'] = os.path.basename(paths['forest'])
+    if baseline is not None:
+        paths['baseline'] = baseline_path(artifact)
+        baseline.save(paths['baseline'])
+        metadata['baseline'] = os.path.basename(paths['baseline'])
+    sidecar = os.path.join(directory, f"{stem}-{version}.json")
+    with open(sidecar, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    paths['sidecar'] = sidecar
+
+    # Baseline first: a reader that sees the new model also finds its baseline
+    if baseline is not None:
+        _replace(paths['baseline'], baseline_path(output))
+    elif os.path.exists(baseline_path(output)):
+        os.remove(baseline_path(output))
+    _replace(artifact, output)
+    # Forest last: subscribe_ml only maps it when it is not older than the joblib model
+    _replace(paths['forest'], os.path.splitext(output)[0] + ".forest")
+    paths['model'] = output
+    return paths
+
+
+def train(config: dict) -> dict:
+    started = time.perf_counter()
+    history = load_history(config['data'])
+    features = feature_frame(history).dropna()
+    columns = list(FEATURE_COLUMNS)
+    baseline = None
+    if config['baseline']:
+        baseline = Baseline.fit(features)
+        features = baseline.apply(features)
+        columns += BASELINE_COLUMNS
+    X = features[columns].to_numpy(dtype=np.float64)
+    load_seconds = time.perf_counter() - started
+    logging.info(f"📦 {len(history)} rows -> {len(X)} feature rows in {load_seconds:.2f}s")
+
+    event_ids, n_events = None, 0
+    if config['labels']:
+        labels = pd.read_csv(config['labels'])
+        event_ids = label_events(features.index, labels)
+        n_events = len(labels)
+
+    grid = {
+        'contamination': config['contamination'],
+        'n_estimators': config['n_estimators'],
+        'max_samples': config['max_samples'],
+    }
+    search_started = time.perf_counter()
+    results = search(X, grid, event_ids, n_events, config['processes'], config['n_jobs'], config['seed'])
+    search_seconds = time.perf_counter() - search_started
+    best = results[0]
+    logging.info(f"🏆 Best {best['params']}: {best['metrics']}")
+
+    # Refit the winner on all cores; same seed and data give the same forest
+    # DataFrame input records feature_names_in_, as the notebook model did
+    model = IsolationForest(random_state=config['seed'], n_jobs=-1, **best['params'])
+    model.fit(pd.DataFrame(X, columns=columns))
+
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    metadata = {
+        'version': version,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'data': os.path.abspath(config['data']),
+        'rows': len(history),
+        'training_rows': len(X),
+        'data_start': str(features.index.min()),
+        'data_end': str(features.index.max()),
+        'features': columns,
+        'params': best['params'],
+        'seed': config['seed'],
+        'metrics': best['metrics'],
+        'offset': float(model.offset_),
+        'objective': 'event_f1' if event_ids is not None else 'separation',
+        'search': results,
+        'timings': {
+            'load_seconds': round(load_seconds, 3),
+            'search_seconds': round(search_seconds, 3),
+            'total_seconds': round(time.perf_counter() - started, 3),
+        },
+        'sklearn_version': sklearn.__version__,
+    }
+    paths = save_model(model, metadata, config['output'], baseline)
+    logging.info(f"✅ Saved {paths['artifact']} and {paths['sidecar']}, updated {paths['model']}")
+    return {**paths, 'version': version, 'params': best['params'], 'metrics': best['metrics']}
+
+
+def parse_args(argv=None) -> dict:
+    script_dir = os.path.dirname(os.path.realpath(__file__))
+    default_data = os.path.join(os.path.dirname(script_dir), "demo_data", "nyc_taxi.csv")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=default_data, help="CSV or Parquet with timestamp,value")
+    parser.add_argument("--labels", help="CSV of anomaly windows (start,end) to rank candidates by event F1")
+    parser.add_argument("--output", default=os.getenv("ML_MODEL_PATH", os.path.join(script_dir, f"{MODEL_NAME}.joblib")))
+    parser.add_argument("--contamination", type=float, nargs='+', default=[0.001, 0.0025, 0.005, 0.01])
+    parser.add_argument("--n-estimators", type=int, nargs='+', default=[100, 200, 400])
+    parser.add_argument("--max-samples", type=float, nargs='+', default=[0.25, 0.5, 0.7])
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="candidates fitted in parallel")
+    parser.add_argument("--n-jobs", type=int, default=1, help="n_jobs of each candidate's forest")
+    parser.add_argument("--no-baseline", dest="baseline", action="store_false",
+                        help="skip the Hour x Weekday baseline and its value_Average / Deviation features")
+    parser.add_argument("--seed", type=int, default=0)
+    return vars(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    print(json.dumps(train(parse_args()), indent=2))
@@ -0,0 +1,118 @@
+from quixstreams import Application
+from quixstreams.dataframe.windows import Count, Max, Mean, Min, Sum
+from quixstreams.sinks import BatchingSink
+import os
+import sys
+import logging
+
+# Load environment variables (useful when working locally)
+from dotenv import load_dotenv
+load_dotenv(".env")
+
+from rollup import ROLLUPS, rollup_input, rollup_line
+
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.influx_router import create_influx_sink
+from common.metrics import ERRORS, MESSAGES_IN, start_metrics_server
+from common.wire import WireDeserializer
+
+# Logggin env
+log_level_str = os.getenv("LOG_LEVEL", "INFO").upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+
+logging.basicConfig(
+    level=log_level,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+# --- InfluxDB Setup ---
+INFLUX_URL = os.getenv("INFLUX_URL", "http://influxdb86:8086")
+INFLUX_TOKEN = os.getenv("INFLUX_TOKEN", "your_token")
+INFLUX_ORG = os.getenv("INFLUX_ORG", "your_org")
+INFLUX_BUCKET = os.getenv("INFLUX_BUCKET", "iot_data")
+INFLUX_GZIP = os.getenv("INFLUX_GZIP", "true").lower() in ("1", "true", "yes")
+INFLUX_REPLICATION = int(os.getenv("INFLUX_REPLICATION", 1))
+
+# --- Quix Setup ---
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "172.16.2.117:9092")
+# The scored stream, so every window can also count the anomalies in it
+KAFKA_INPUT_TOPIC = os.getenv("KAFKA_INPUT_TOPIC", "taxi-demand-anomalies")
+CONSUMER_GROUP = os.getenv("CONSUMER_GROUP", "model-rollup")
+ROLLUP_MEASUREMENT = os.getenv("ROLLUP_MEASUREMENT", KAFKA_INPUT_TOPIC + "_ROLLUP")
+# Events later than this behind the newest one seen on their partition no longer update a window
+ROLLUP_GRACE_MS = int(os.getenv("ROLLUP_GRACE_MS", 10 * 60 * 1000))
+
+# Windows are only written on checkpoints, so batching by size/age is left to Quix
+influx_sink = create_influx_sink(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG, bucket=INFLUX_BUCKET,
+                                 gzip=INFLUX_GZIP, replication=INFLUX_REPLICATION)
+
+app = Application(broker_address=KAFKA_BROKER,
+                loglevel="INFO",
+                auto_offset_reset="earliest",
+                state_dir=os.path.dirname(os.path.abspath(__file__))+"/state/",
+                consumer_group=CONSUMER_GROUP
+      )
+# Binary or JSON rows from subscribe_ml (see common/wire.py)
+input_topic = app.topic(KAFKA_INPUT_TOPIC, value_deserializer=WireDeserializer())
+messages_in = MESSAGES_IN.labels(input_topic.name)
+
+
+class InfluxRollupSink(BatchingSink):
+    """
+    Hands closed windows to the InfluxDB sink and waits for them to be
+    written on every Quix checkpoint, before the checkpoint commits offsets.
+    """
+
+    def write(self, batch):
+        for item in batch:
+            influx_sink.add(item.value)
+
+    def flush(self):
+        super().flush()
+        influx_sink.flush()
+
+
+def on_late(value, key, timestamp_ms, late_by_ms, start, end, store_name, topic, partition, offset):
+    ERRORS.labels('rollup_late').inc()
+    logging.debug(f"Late event for {store_name} window {start}-{end} at {topic}[{partition}]@{offset}, {late_by_ms} ms late")
+    # Counted above, skip Quix's own per-event log line
+    return False
+
+
+def build_rollups(sdf, sink):
+    """One tumbling window branch per entry in ROLLUPS, all written to `sink`."""
+    for window, duration_ms, shift_ms in ROLLUPS:
+        branch = sdf
+        if shift_ms:
+            branch = branch.set_timestamp(lambda value, key, ts, headers, shift_ms=shift_ms: ts - shift_ms)
+        branch = (
+            branch.tumbling_window(duration_ms, grace_ms=ROLLUP_GRACE_MS, name=f"rollup-{window}", on_late=on_late)
+            .agg(mean=Mean('value'), min=Min('value'), max=Max('value'),
+                 count=Count(), anomalies=Sum('anomaly'))
+            .final()
+        )
+        branch = branch.apply(
+            lambda result, key, ts, headers, window=window, shift_ms=shift_ms:
+                rollup_line(ROLLUP_MEASUREMENT, window, key, result, shift_ms),
+            metadata=True,
+        )
+        branch.sink(sink)
+
+
+def count_in(row):
+    messages_in.inc()
+
+
+if __name__ == "__main__":
+    start_metrics_server(8004)
+
+    sdf = app.dataframe(input_topic)
+    sdf = sdf.update(count_in).apply(rollup_input)
+    build_rollups(sdf, InfluxRollupSink())
+
+    logging.info(f"🚀 Rolling up {KAFKA_INPUT_TOPIC} into {ROLLUP_MEASUREMENT}: {', '.join(w for w, _, _ in ROLLUPS)}")
+    app.run()
+    influx_sink.close()
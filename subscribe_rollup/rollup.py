@@ -0,0 +1,55 @@
+"""
+Tumbling-window rollups of the scored stream.
+
+`ROLLUPS` lists the hourly, daily and weekly windows (the notebook's
+`resample('H'/'D'/'W')` views). Windows are aligned to UTC; weekly windows
+start on Monday 00:00 like pandas' `W` (= `W-SUN`) bins, which Quix Streams
+cannot do directly since it aligns windows to the epoch (a Thursday), so the
+weekly branch shifts its timestamps by `WEEK_OFFSET_MS` before windowing.
+"""
+from datetime import datetime, timezone
+
+from influxdb_client import Point
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+# 1970-01-01 was a Thursday, the first Monday is four days later
+WEEK_OFFSET_MS = 4 * DAY_MS
+
+# (window tag, duration, timestamp shift applied before windowing)
+ROLLUPS = [
+    ("1h", HOUR_MS, 0),
+    ("1d", DAY_MS, 0),
+    ("1w", WEEK_MS, WEEK_OFFSET_MS),
+]
+
+
+def rollup_input(row: dict) -> dict:
+    """The two columns the windows aggregate: the value and whether it was flagged as an anomaly."""
+    return {
+        'value': float(row['value']),
+        'anomaly': 1 if row.get('Outliers') else 0,
+    }
+
+
+def rollup_line(measurement: str, window: str, key, result: dict, shift_ms: int = 0) -> str:
+    """
+    Line-protocol record for one closed window, stamped with the window start.
+    `result` is a Quix Streams window result with start/end and the aggregates.
+    """
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', errors='replace')
+    start_ms = result['start'] + shift_ms
+    point = (
+        Point(measurement)
+        .tag("window", window)
+        .tag("key", key or "unknown")
+        .field("mean", float(result['mean']))
+        .field("min", float(result['min']))
+        .field("max", float(result['max']))
+        .field("count", int(result['count']))
+        .field("anomalies", int(result['anomalies']))
+        .time(datetime.fromtimestamp(start_ms / 1000.0, tz=timezone.utc))
+    )
+    return point.to_line_protocol()
@@ -0,0 +1,305 @@
+"""
+Bulk loader: a CSV, a Parquet file or a Kafka topic range straight into InfluxDB.
+
+Writes the same records `main.process_event` would for every event,
+`<measurement> value=<value> <timestamp ns>`, byte for byte, but encodes
+line protocol for a whole chunk of rows at once with pandas string
+operations instead of one `Point` per row. Chunks go to the InfluxDB write
+API as gzip-compressed requests, `--concurrency` of them in flight.
+
+With `--checkpoint`, the position after the last chunk whose write (and
+every write before it) succeeded is saved there, and a rerun resumes from
+it. Chunks after that position may have been written already; writing them
+again is harmless, since InfluxDB keeps one value per series and timestamp.
+
+Usage:
+    python bulk_load.py --source ../demo_data/nyc_taxi.csv --checkpoint nyc.ckpt
+    python bulk_load.py --source history.parquet --concurrency 8      # needs pyarrow
+    python bulk_load.py --topic event-frames-model --to-offset 1000000
+    python bulk_load.py --source ../demo_data/nyc_taxi.csv --output - | head   # line protocol, no writes
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
+
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.wire import decode
+
+
+def measurement_prefix(measurement: str) -> str:
+    """The measurement as `Point` escapes it."""
+    line = Point(measurement).field("value", 0).to_line_protocol()
+    return line[:-len(" value=0i")]
+
+
+def encode_lines(measurement: str, timestamps_ms, values) -> list:
+    """
+    Line protocol for whole columns, identical to `Point(measurement)
+    .field("value", v).time(<timestamp_ms as UTC datetime>)` per row.
+    Rows whose float value is NaN or infinite have no field and are dropped,
+    as `Point` does.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    timestamps_ms = pd.Series(timestamps_ms, dtype='int64').reset_index(drop=True)
+    prefix = measurement_prefix(measurement) + " value="
+
+    if pd.api.types.is_bool_dtype(values):
+        fields = values.map({True: 'true', False: 'false'})
+    elif pd.api.types.is_integer_dtype(values):
+        fields = values.astype(str) + 'i'
+    elif pd.api.types.is_float_dtype(values):
+        finite = np.isfinite(values.to_numpy())
+        values, timestamps_ms = values[finite], timestamps_ms[finite]
+        # Point writes str(float) without a trailing ".0"
+        fields = values.map(repr).str.removesuffix('.0')
+    else:
+        # Mixed types (e.g. from a Kafka range): let Point format each value
+        lines = (Point(measurement).field("value", v).time(int(ts) * 1_000_000).to_line_protocol()
+                 for ts, v in zip(timestamps_ms.tolist(), values.tolist()))
+        return [line for line in lines if line]
+
+    return (prefix + fields + ' ' + (timestamps_ms * 1_000_000).astype(str)).tolist()
+
+
+def _frame_columns(df: pd.DataFrame):
+    """(timestamps_ms, values) of a (timestamp, value) frame, like the publisher's `build_payloads`."""
+    timestamps = pd.to_datetime(df['timestamp'])
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+    return (timestamps - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1), df['value']
+
+
+def csv_chunks(path: str, chunk_size: int, position: int = 0):
+    """Yield (timestamps_ms, values, position after the chunk) from row `position` on."""
+    reader = pd.read_csv(path, usecols=['timestamp', 'value'], chunksize=chunk_size,
+                         skiprows=range(1, position + 1))
+    for df in reader:
+        position += len(df)
+        yield (*_frame_columns(df), position)
+
+
+def parquet_chunks(path: str, chunk_size: int, position: int = 0):
+    """Like `csv_chunks` for a Parquet file, read one record batch at a time."""
+    import pyarrow.parquet as pq
+
+    skip = position
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=['timestamp', 'value']):
+        if skip >= batch.num_rows:
+            skip -= batch.num_rows
+            continue
+        df = batch.slice(skip).to_pandas()
+        skip = 0
+        position += len(df)
+        yield (*_frame_columns(df), position)
+
+
+def kafka_chunks(broker: str, topic: str, chunk_size: int, position: dict = None,
+                 from_offset: int = None, to_offset: int = None):
+    """
+    Yield (timestamps_ms, values, {partition: next offset}) for every
+    partition of `topic` from `from_offset` (default: earliest) up to
+    `to_offset` (default: the high watermark when the load started).
+    Messages without timestamp_ms use their Kafka timestamp.
+    """
+    from confluent_kafka import Consumer, TopicPartition
+
+    consumer = Consumer({'bootstrap.servers': broker, 'group.id': 'influx-bulk-load',
+                         'enable.auto.commit': False, 'auto.offset.reset': 'earliest'})
+    try:
+        partitions = consumer.list_topics(topic, timeout=10).topics[topic].partitions
+        position = {int(p): o for p, o in (position or {}).items()}
+        ends, assignment = {}, []
+        for partition in partitions:
+            low, high = consumer.get_watermark_offsets(TopicPartition(topic, partition), timeout=10)
+            start = position.get(partition, max(low, from_offset or 0))
+            ends[partition] = min(high, to_offset) if to_offset is not None else high
+            position[partition] = start
+            if start < ends[partition]:
+                assignment.append(TopicPartition(topic, partition, start))
+        consumer.assign(assignment)
+
+        remaining = {tp.partition for tp in assignment}
+        while remaining:
+            timestamps_ms, values = [], []
+            for msg in consumer.consume(num_messages=chunk_size, timeout=1.0):
+                if msg.error():
+                    logging.error(f"❌ Kafka error: {msg.error()}")
+                    continue
+                partition, offset = msg.partition(), msg.offset()
+                if partition not in remaining or offset >= ends[partition]:
+                    continue
+                data = decode(msg.value())
+                timestamps_ms.append(data.get('timestamp_ms') or msg.timestamp()[1])
+                values.append(data.get('value', 'N/A'))
+                position[partition] = offset + 1
+                if position[partition] >= ends[partition]:
+                    remaining.discard(partition)
+            if values:
+                values = pd.Series(values)
+                if values.map(type).nunique() == 1:
+                    values = values.infer_objects()
+                yield timestamps_ms, values, dict(position)
+    finally:
+        consumer.close()
+
+
+class BulkWriter:
+    """Posts chunks of line protocol with up to `concurrency` requests in flight."""
+
+    def __init__(self, url: str, token: str, org: str, bucket: str, concurrency: int = 4,
+                 gzip: bool = True, max_retries: int = 5, retry_interval_ms: float = 500):
+        self.org = org
+        self.bucket = bucket
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval_ms / 1000.0
+        self.client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=gzip, timeout=60_000,
+                                     connection_pool_maxsize=concurrency)
+        self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+    def write(self, lines: list):
+        delay = self.retry_interval
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=lines,
+                                     write_precision=WritePrecision.NS)
+                return
+            except ApiException as e:
+                # Bad data will not get better on retry, overload and outages might
+                if (e.status is not None and e.status < 500 and e.status != 429) or attempt == self.max_retries:
+                    raise
+                logging.warning(f"⚠️ InfluxDB write failed ({e.status}), retry {attempt}/{self.max_retries}")
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"⚠️ InfluxDB write failed ({e}), retry {attempt}/{self.max_retries}")
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def close(self):
+        self.client.close()
+
+
+def load_checkpoint(path: str, source: str):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint['source'] != source:
+        raise ValueError(f"Checkpoint {path} is for {checkpoint['source']}, not {source}")
+    return checkpoint['position']
+
+
+def save_checkpoint(path: str, source: str, position):
+    tmp = path + ".tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'source': source, 'position': position}, f)
+    os.replace(tmp, path)
+
+
+def run(config: dict) -> dict:
+    source = config['source'] or f"kafka://{config['topic']}"
+    position = load_checkpoint(config['checkpoint'], source)
+    if position is not None:
+        logging.info(f"⏩ Resuming {source} from {position}")
+
+    if config['topic']:
+        chunks = kafka_chunks(config['broker'], config['topic'], config['chunk_size'], position,
+                              config['from_offset'], config['to_offset'])
+    elif config['source'].endswith(('.parquet', '.pq')):
+        chunks = parquet_chunks(config['source'], config['chunk_size'], position or 0)
+    else:
+        chunks = csv_chunks(config['source'], config['chunk_size'], position or 0)
+
+    started = time.perf_counter()
+    totals = {'rows': 0, 'lines': 0, 'requests': 0, 'encode_seconds': 0.0}
+
+    if config['output']:
+        out = sys.stdout if config['output'] == '-' else open(config['output'], 'w')
+        try:
+            for timestamps_ms, values, _ in chunks:
+                lines = encode_lines(config['measurement'], timestamps_ms, values)
+                out.write('\n'.join(lines) + '\n' if lines else '')
+                totals['rows'] += len(values)
+                totals['lines'] += len(lines)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        return totals
+
+    writer = BulkWriter(config['url'], config['token'], config['org'], config['bucket'],
+                        config['concurrency'], config['gzip'])
+    # (future, position after its chunk) in read order; the checkpoint follows the oldest unfinished one
+    in_flight = deque()
+
+    def settle(limit: int):
+        """Wait until at most `limit` requests are in flight, checkpointing finished ones in order."""
+        while in_flight and (len(in_flight) > limit or in_flight[0][0].done()):
+            future, chunk_position = in_flight.popleft()
+            future.result()
+            totals['requests'] += 1
+            if config['checkpoint']:
+                save_checkpoint(config['checkpoint'], source, chunk_position)
+
+    try:
+        with ThreadPoolExecutor(max_workers=config['concurrency']) as pool:
+            for timestamps_ms, values, chunk_position in chunks:
+                encode_started = time.perf_counter()
+                lines = encode_lines(config['measurement'], timestamps_ms, values)
+                totals['encode_seconds'] += time.perf_counter() - encode_started
+                totals['rows'] += len(values)
+                totals['lines'] += len(lines)
+                in_flight.append((pool.submit(writer.write, lines), chunk_position))
+                # Encode the next chunk while up to `concurrency` requests are in flight
+                settle(config['concurrency'])
+            settle(0)
+    finally:
+        writer.close()
+
+    seconds = time.perf_counter() - started
+    totals.update(seconds=round(seconds, 3), encode_seconds=round(totals['encode_seconds'], 3),
+                  lines_per_s=round(totals['lines'] / seconds, 1) if seconds else None)
+    logging.info(f"✅ Loaded {totals['lines']} points from {source} in {totals['seconds']}s "
+                 f"({totals['lines_per_s']} points/s)")
+    return totals
+
+
+def parse_args(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source", help="CSV or Parquet file with timestamp,value")
+    source.add_argument("--topic", help="Kafka topic to load instead of a file")
+    parser.add_argument("--broker", default=os.getenv("KAFKA_BROKER", "172.16.2.117:9092"))
+    parser.add_argument("--from-offset", type=int, help="first offset per partition (default: earliest)")
+    parser.add_argument("--to-offset", type=int, help="stop before this offset per partition (default: high watermark)")
+    parser.add_argument("--measurement", default=os.getenv("KAFKA_INPUT_TOPIC", "event-frames-model"),
+                        help="measurement name, the streaming sink uses its input topic")
+    parser.add_argument("--url", default=os.getenv("INFLUX_URL", "http://influxdb86:8086"))
+    parser.add_argument("--token", default=os.getenv("INFLUX_TOKEN", "your_token"))
+    parser.add_argument("--org", default=os.getenv("INFLUX_ORG", "your_org"))
+    parser.add_argument("--bucket", default=os.getenv("INFLUX_BUCKET", "iot_data"))
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="points per write request")
+    parser.add_argument("--concurrency", type=int, default=4, help="write requests in flight")
+    parser.add_argument("--no-gzip", dest="gzip", action="store_false")
+    parser.add_argument("--checkpoint", help="file to save progress to and resume from")
+    parser.add_argument("--output", help="write line protocol to this file ('-' = stdout) instead of InfluxDB")
+    return vars(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    config = parse_args()
+    # Keep stdout for the line protocol with --output -
+    print(json.dumps(run(config), indent=2), file=sys.stderr if config['output'] == '-' else sys.stdout)
@@ -1,7 +1,8 @@
 from quixstreams import Application
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+from influxdb_client import Point
 from datetime import datetime, timezone
 import os
+import sys
 import json
 from datetime import datetime
 import logging
@@ -11,6 +12,12 @@ from dotenv import load_dotenv
 # load_dotenv(os.path.dirname(os.path.abspath(__file__))+"/.env")
 load_dotenv(".env")
 
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.influx_router import create_influx_sink
+from common.metrics import ERRORS, MESSAGES_IN, STAGES, LagTracker, start_metrics_server
+from common.wire import decode
+
 # Logggin env
 log_level_str = os.getenv("LOG_LEVEL", "INFO").upper()
 log_level = getattr(logging, log_level_str, logging.INFO)
@@ -28,8 +35,22 @@ INFLUX_TOKEN = os.getenv("INFLUX_TOKEN", "your_token")
 INFLUX_ORG = os.getenv("INFLUX_ORG", "your_org")
 INFLUX_BUCKET = os.getenv("INFLUX_BUCKET", "iot_data")
 
-influx_client = InfluxDBClient(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG)
-influx_write = influx_client.write_api(write_options=WriteOptions(batch_size=1, flush_interval=1))
+# Batching: points per request, max batch age and how many sealed batches may queue before the consumer pauses
+INFLUX_BATCH_SIZE = int(os.getenv("INFLUX_BATCH_SIZE", 5000))
+INFLUX_FLUSH_INTERVAL_MS = float(os.getenv("INFLUX_FLUSH_INTERVAL_MS", 1000))
+INFLUX_MAX_PENDING_BATCHES = int(os.getenv("INFLUX_MAX_PENDING_BATCHES", 4))
+INFLUX_GZIP = os.getenv("INFLUX_GZIP", "true").lower() in ("1", "true", "yes")
+# Several comma-separated INFLUX_URLs shard the writes (see common/influx_router.py)
+INFLUX_REPLICATION = int(os.getenv("INFLUX_REPLICATION", 1))
+# "async" keeps INFLUX_MAX_IN_FLIGHT write requests open per node (see common/influx_async.py)
+INFLUX_WRITER = os.getenv("INFLUX_WRITER", "thread").lower()
+INFLUX_MAX_IN_FLIGHT = int(os.getenv("INFLUX_MAX_IN_FLIGHT", 4))
+
+influx_sink = create_influx_sink(url=INFLUX_URL, token=INFLUX_TOKEN, org=INFLUX_ORG, bucket=INFLUX_BUCKET,
+                              batch_size=INFLUX_BATCH_SIZE, flush_interval_ms=INFLUX_FLUSH_INTERVAL_MS,
+                              max_pending_batches=INFLUX_MAX_PENDING_BATCHES, gzip=INFLUX_GZIP,
+                              replication=INFLUX_REPLICATION, writer=INFLUX_WRITER,
+                              max_in_flight=INFLUX_MAX_IN_FLIGHT)
 
 # --- Quix Setup ---
 # Config
@@ -46,11 +67,11 @@ input_topic = app.topic(KAFKA_INPUT_TOPIC, value_deserializer="json")
 
 
 def process_event(data):
+    """Convert a message into a line-protocol record, or None if it is unusable."""
     try:
         payload = data
         timestamp_ms = payload.get("timestamp_ms", None)
         timestamp = datetime.fromtimestamp(timestamp_ms / 1000.0, tz=timezone.utc) if timestamp_ms else datetime.utcnow()
-        logging.info(f"timestamp-{timestamp}")
         # logging.info(f"[📥] Got message: {data}")
 
         point = (
@@ -63,18 +84,54 @@ def process_event(data):
             .time(timestamp)
         )
 
-        influx_write.write(bucket=INFLUX_BUCKET, org=INFLUX_ORG, record=point)
-        logging.info(f"[✓] Wrote to InfluxDB: {point.to_line_protocol()}")
+        line = point.to_line_protocol()
+        logging.debug(f"[✓] Queued for InfluxDB: {line}")
+        return line
 
     except Exception as e:
+        ERRORS.labels('process_event').inc()
         logging.error(f"❌ Error processing message: {e}")
 
 
-
-# Stream
-sdf = app.dataframe(input_topic)
-sdf = sdf.apply(process_event)
-
-logging.info(f"Connecting to ...{KAFKA_BROKER}")
-logging.info(f"🚀 Listening to Kafka topic: {KAFKA_INPUT_TOPIC}")
-app.run()
+def run():
+    """
+    Consume the input topic into the batched InfluxDB sink.
+    Offsets are committed only after the batch holding them has been written.
+    """
+    def on_revoke(consumer, partitions):
+        # Finish in-flight writes so the next owner starts after them
+        influx_sink.flush(consumer)
+
+    start_metrics_server(8003)
+    lag = LagTracker()
+    messages_in = MESSAGES_IN.labels(input_topic.name)
+
+    with app.get_consumer(auto_commit_enable=False) as consumer:
+        consumer.subscribe([input_topic.name], on_revoke=on_revoke)
+        logging.info(f"Connecting to ...{KAFKA_BROKER}")
+        logging.info(f"🚀 Listening to Kafka topic: {KAFKA_INPUT_TOPIC}")
+        try:
+            while True:
+                msg = consumer.poll(timeout=0.1)
+                if msg is not None:
+                    if msg.error():
+                        logging.error(f"❌ Kafka error: {msg.error()}")
+                    else:
+                        messages_in.inc()
+                        try:
+                            with STAGES['deserialize'].time():
+                                data = decode(msg.value())
+                            with STAGES['influx_write'].time():
+                                influx_sink.add(process_event(data))
+                        except ValueError as e:
+                            ERRORS.labels('deserialize').inc()
+                            logging.error(f"❌ Invalid message at {msg.topic()}[{msg.partition()}]@{msg.offset()}: {e}")
+                        influx_sink.track(msg.topic(), msg.partition(), msg.offset())
+                influx_sink.sync(consumer)
+                lag.update(consumer)
+        finally:
+            influx_sink.flush(consumer)
+
+
+if __name__ == "__main__":
+    run()
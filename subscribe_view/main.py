@@ -0,0 +1,214 @@
+from quixstreams import Application
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import os
+import sys
+import threading
+import time
+import logging
+
+# Load environment variables (useful when working locally)
+from dotenv import load_dotenv
+load_dotenv(".env")
+
+from view import ROW_BYTES, SPARE, MaterializedView
+
+# Shared modules live in the repository root (PYTHONPATH=/app in the Dockerfile)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import (ERRORS, MESSAGES_IN, STAGES, VIEW_BYTES, VIEW_EVICTIONS, VIEW_KEYS,
+                            VIEW_QUERY_SECONDS, VIEW_ROWS, LagTracker, start_metrics_server)
+from common.wire import WireDeserializer, decode
+
+# Logggin env
+log_level_str = os.getenv("LOG_LEVEL", "INFO").upper()
+log_level = getattr(logging, log_level_str, logging.INFO)
+
+logging.basicConfig(
+    level=log_level,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+# --- Quix Setup ---
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "172.16.2.117:9092")
+# The scored stream from subscribe_ml
+KAFKA_INPUT_TOPIC = os.getenv("KAFKA_INPUT_TOPIC", "taxi-demand-anomalies")
+# Offsets are never committed, every start rebuilds the view from the topic.
+# Each replica needs its own group to see every partition.
+CONSUMER_GROUP = os.getenv("CONSUMER_GROUP", "model-view")
+
+# --- View Setup ---
+# Rows further than this behind the newest event time are dropped
+VIEW_RETENTION_HOURS = float(os.getenv("VIEW_RETENTION_HOURS", 7 * 24))
+# Memory for the row arrays; they hold up to SPARE times the live rows, so that share of it is the row budget
+VIEW_MAX_MB = float(os.getenv("VIEW_MAX_MB", 256))
+VIEW_HOST = os.getenv("VIEW_HOST", "0.0.0.0")
+VIEW_PORT = int(os.getenv("VIEW_PORT", 8090))
+# Max rows returned by one query
+VIEW_MAX_LIMIT = int(os.getenv("VIEW_MAX_LIMIT", 10000))
+
+view = MaterializedView(retention_ms=int(VIEW_RETENTION_HOURS * 3600 * 1000),
+                        max_rows=int(VIEW_MAX_MB * 1024 * 1024) // (SPARE * ROW_BYTES))
+
+app = Application(broker_address=KAFKA_BROKER,
+                loglevel="INFO",
+                auto_offset_reset="earliest",
+                consumer_group=CONSUMER_GROUP
+      )
+# Binary or JSON rows from subscribe_ml (see common/wire.py)
+input_topic = app.topic(KAFKA_INPUT_TOPIC, value_deserializer=WireDeserializer())
+messages_in = MESSAGES_IN.labels(input_topic.name)
+
+REQUIRED = object()
+
+
+def param(params: dict, name: str, cast, default=REQUIRED):
+    if name not in params:
+        if default is REQUIRED:
+            raise ValueError(f"Missing parameter {name!r}")
+        return default
+    try:
+        return cast(params[name])
+    except ValueError:
+        raise ValueError(f"Invalid {name!r}: {params[name]!r}")
+
+
+def parse_time_ms(value: str) -> int:
+    """Epoch milliseconds, or an ISO 8601 time (UTC unless it has an offset)."""
+    if value.lstrip('-').isdigit():
+        return int(value)
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def limit_param(params: dict) -> int:
+    return max(1, min(param(params, 'limit', int, VIEW_MAX_LIMIT), VIEW_MAX_LIMIT))
+
+
+def query_recent(params: dict) -> dict:
+    """/recent?hours=N[&key=K][&limit=L]: the last N hours of event time."""
+    since_ms = view.since_hours(param(params, 'hours', float))
+    if since_ms is None:
+        return {'since_ms': None, 'rows': []}
+    return {'since_ms': since_ms, 'rows': view.recent(since_ms, params.get('key'), limit_param(params))}
+
+
+def query_lowest(params: dict) -> dict:
+    """/lowest?k=K[&hours=N][&key=K]: the K lowest scores, optionally within the last N hours."""
+    k = max(0, min(param(params, 'k', int, 10), VIEW_MAX_LIMIT))
+    hours = param(params, 'hours', float, None)
+    since_ms = view.since_hours(hours) if hours is not None else None
+    return {'since_ms': since_ms, 'rows': view.lowest(k, since_ms, params.get('key'))}
+
+
+def query_outliers(params: dict) -> dict:
+    """/outliers?since=T[&key=K][&limit=L]: outliers at or after T (epoch ms or ISO 8601)."""
+    since_ms = param(params, 'since', parse_time_ms)
+    return {'since_ms': since_ms, 'rows': view.outliers(since_ms, params.get('key'), limit_param(params))}
+
+
+ROUTES = {
+    '/recent': query_recent,
+    '/lowest': query_lowest,
+    '/outliers': query_outliers,
+    '/keys': lambda params: {'keys': view.keys()},
+    '/health': lambda params: view.stats(),
+}
+
+
+class ViewHandler(BaseHTTPRequestHandler):
+    """JSON over GET; the query itself runs on the view's arrays."""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        route = ROUTES.get(url.path)
+        if route is None:
+            self.reply(404, {'error': f"Unknown path {url.path}, expected one of {sorted(ROUTES)}"})
+            return
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        started = time.perf_counter()
+        try:
+            body = route(params)
+        except ValueError as e:
+            self.reply(400, {'error': str(e)})
+            return
+        took = time.perf_counter() - started
+        VIEW_QUERY_SECONDS.labels(url.path).observe(took)
+        body['took_us'] = round(took * 1e6, 1)
+        self.reply(200, body)
+
+    def reply(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+def key_name(key) -> str:
+    if isinstance(key, bytes):
+        key = key.decode('utf-8', errors='replace')
+    return key or "unknown"
+
+
+def update_metrics(evicted: dict):
+    stats = view.stats()
+    VIEW_ROWS.set(stats['rows'])
+    VIEW_KEYS.set(stats['keys'])
+    VIEW_BYTES.set(stats['bytes'])
+    # The view counts evictions itself, the counter only gets the difference
+    for reason, count in stats['evicted'].items():
+        VIEW_EVICTIONS.labels(reason).inc(count - evicted.get(reason, 0))
+        evicted[reason] = count
+
+
+def consume():
+    """Feed every scored row into the view; expire idle keys and refresh the gauges once a second."""
+    lag = LagTracker()
+    evicted = {}
+    last_expire = time.monotonic()
+    with app.get_consumer(auto_commit_enable=False) as consumer:
+        consumer.subscribe([input_topic.name])
+        while True:
+            msg = consumer.poll(timeout=1.0)
+            if msg is not None:
+                if msg.error():
+                    logging.error(f"❌ Kafka error: {msg.error()}")
+                else:
+                    messages_in.inc()
+                    try:
+                        with STAGES['deserialize'].time():
+                            row = decode(msg.value())
+                        view.add(key_name(msg.key()), row)
+                    except Exception as e:
+                        ERRORS.labels('view_add').inc()
+                        logging.error(f"❌ Error adding message to the view: {e}")
+            now = time.monotonic()
+            if now - last_expire >= 1.0:
+                view.expire()
+                update_metrics(evicted)
+                last_expire = now
+            lag.update(consumer)
+
+
+if __name__ == "__main__":
+    start_metrics_server(8005)
+
+    server = ThreadingHTTPServer((VIEW_HOST, VIEW_PORT), ViewHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="view-http", daemon=True).start()
+    logging.info(f"🔎 Serving the view of {KAFKA_INPUT_TOPIC} on {VIEW_HOST}:{VIEW_PORT} "
+                 f"(retention {VIEW_RETENTION_HOURS:g} h, {view.max_rows} rows max)")
+    try:
+        consume()
+    finally:
+        server.shutdown()
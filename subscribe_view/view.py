@@ -0,0 +1,278 @@
+"""
+In-memory materialized view of the scored stream.
+
+Every key gets a `Series`: preallocated numpy arrays of timestamp_ms, value,
+Score and an outlier flag, kept in event-time order, with the live rows in
+`[start, end)`. Eviction moves `start`; appends go to `end`, and when
+the arrays are full the live rows are moved back to the front into arrays
+of twice their count, so slices stay contiguous and a time range is two
+binary searches away. Once evictions leave the live rows filling less than
+a third of the arrays, they are compacted the same way. Queries run over those slices with numpy: "since T" is a
+`searchsorted`, "lowest K scores" an `argpartition` of the window, so they
+never touch Python objects per row until the answer is built.
+
+Memory is bounded twice: rows older than `retention_ms` behind the newest
+event are dropped, and once the view holds more than `max_rows` rows the
+oldest ones across all keys go first until it is back under 90% of it.
+The arrays of a key hold at most `SPARE` times its live rows (and at least
+MIN_CAPACITY), so `max_rows` rows take at most `SPARE * ROW_BYTES` bytes
+each, plus MIN_CAPACITY rows per key.
+"""
+import heapq
+import threading
+import time
+
+import numpy as np
+
+from common.wire import TIMESTAMP_TEMPLATE
+
+# timestamp_ms + value + Score (8 bytes each) + outlier flag
+ROW_BYTES = 25
+MIN_CAPACITY = 64
+# Allocated rows per live row a Series may hold before it is compacted
+SPARE = 3
+
+
+def format_time(timestamp_ms: int) -> str:
+    ts = time.gmtime(timestamp_ms // 1000)
+    return TIMESTAMP_TEMPLATE % (ts.tm_year, ts.tm_mon, ts.tm_mday, ts.tm_hour, ts.tm_min, ts.tm_sec)
+
+
+class Series:
+    """Rows of one key in time order; late rows are inserted in place."""
+
+    def __init__(self, capacity: int = MIN_CAPACITY):
+        self.time = np.empty(capacity, np.int64)
+        self.value = np.empty(capacity, np.float64)
+        self.score = np.empty(capacity, np.float64)
+        self.outlier = np.empty(capacity, np.bool_)
+        self.start = self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def first(self) -> int:
+        return int(self.time[self.start])
+
+    def append(self, timestamp_ms: int, value: float, score: float, outlier: bool):
+        if self.end == len(self.time):
+            self._make_room()
+        i = self.end
+        if i > self.start and timestamp_ms < self.time[i - 1]:
+            # Out of order (another producer, a replay): shift the newer rows up by one
+            i = self.start + int(np.searchsorted(self.time[self.start:self.end], timestamp_ms, 'right'))
+            for column in (self.time, self.value, self.score, self.outlier):
+                column[i + 1:self.end + 1] = column[i:self.end]
+        self.time[i] = timestamp_ms
+        self.value[i] = value
+        self.score[i] = score
+        self.outlier[i] = outlier
+        self.end += 1
+
+    def _make_room(self):
+        """Move the live rows to the front of arrays twice their count."""
+        live = len(self)
+        capacity = max(MIN_CAPACITY, 2 * live)
+        columns = []
+        for column in (self.time, self.value, self.score, self.outlier):
+            if capacity == len(column):
+                column[:live] = column[self.start:self.end]
+            else:
+                resized = np.empty(capacity, column.dtype)
+                resized[:live] = column[self.start:self.end]
+                column = resized
+            columns.append(column)
+        self.time, self.value, self.score, self.outlier = columns
+        self.start, self.end = 0, live
+
+    def position(self, timestamp_ms: int) -> int:
+        """Index of the first live row at or after `timestamp_ms`."""
+        if self.start == self.end or self.time[self.start] >= timestamp_ms:
+            return self.start
+        if self.time[self.end - 1] < timestamp_ms:
+            return self.end
+        return self.start + int(np.searchsorted(self.time[self.start:self.end], timestamp_ms, 'left'))
+
+    def evict_before(self, timestamp_ms: int) -> int:
+        """Drop rows older than `timestamp_ms`; returns how many."""
+        dropped = self.position(timestamp_ms) - self.start
+        self.evict(dropped)
+        return dropped
+
+    def evict(self, count: int):
+        """Drop the oldest `count` rows, compacting the arrays once they are mostly empty."""
+        self.start += count
+        if len(self.time) > max(MIN_CAPACITY, SPARE * len(self)):
+            self._make_room()
+
+
+class MaterializedView:
+    """
+    Thread-safe store of the latest scored rows per key.
+
+    :param retention_ms: keep rows this far behind the newest event time seen
+    :param max_rows: evict the oldest rows across keys past this many
+    """
+
+    def __init__(self, retention_ms: int, max_rows: int):
+        self.retention_ms = retention_ms
+        self.max_rows = max_rows
+        self.series = {}
+        self.rows = 0
+        # Event time, not wall clock, so replays of old data are kept too
+        self.newest = None
+        self.evicted = {'age': 0, 'memory': 0}
+        self.lock = threading.Lock()
+
+    # --- ingest ------------------------------------------------------------
+
+    def add(self, key: str, row: dict):
+        timestamp_ms = int(row['timestamp_ms'])
+        with self.lock:
+            if self.newest is None or timestamp_ms > self.newest:
+                self.newest = timestamp_ms
+            cutoff = self.newest - self.retention_ms
+            if timestamp_ms < cutoff:
+                self.evicted['age'] += 1
+                return
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = Series()
+            elif len(series) and series.time[series.start] < cutoff:
+                self._evict(series.evict_before(cutoff), 'age')
+            series.append(timestamp_ms, float(row['value']), float(row['Score']), bool(row['Outliers']))
+            self.rows += 1
+            if self.rows > self.max_rows:
+                self._shrink(int(self.max_rows * 0.9))
+
+    def expire(self):
+        """Apply the retention to keys that stopped receiving rows."""
+        with self.lock:
+            if self.newest is None:
+                return
+            cutoff = self.newest - self.retention_ms
+            for key, series in list(self.series.items()):
+                if len(series) and series.time[series.start] < cutoff:
+                    self._evict(series.evict_before(cutoff), 'age')
+                if not len(series):
+                    del self.series[key]
+
+    def _evict(self, count: int, reason: str):
+        self.rows -= count
+        self.evicted[reason] += count
+
+    def _shrink(self, target: int):
+        """Drop the globally oldest rows until at most `target` are left."""
+        heap = [(series.first(), key) for key, series in self.series.items() if len(series)]
+        heapq.heapify(heap)
+        while self.rows > target and heap:
+            _, key = heapq.heappop(heap)
+            series = self.series[key]
+            # Everything up to the next key's oldest row is older than any other row left
+            if heap:
+                count = int(np.searchsorted(series.time[series.start:series.end], heap[0][0], 'right'))
+            else:
+                count = len(series)
+            count = min(max(count, 1), self.rows - target)
+            series.evict(count)
+            self._evict(count, 'memory')
+            if len(series):
+                heapq.heappush(heap, (series.first(), key))
+            else:
+                del self.series[key]
+
+    # --- queries -----------------------------------------------------------
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'keys': len(self.series),
+                'rows': self.rows,
+                'max_rows': self.max_rows,
+                'bytes': sum(len(series.time) for series in self.series.values()) * ROW_BYTES,
+                'newest_ms': self.newest,
+                'evicted': dict(self.evicted),
+            }
+
+    def keys(self) -> list:
+        with self.lock:
+            return [{'key': key, 'rows': len(series), 'first_ms': series.first(),
+                     'last_ms': int(series.time[series.end - 1])}
+                    for key, series in sorted(self.series.items()) if len(series)]
+
+    def since_hours(self, hours: float):
+        """Event time `hours` before the newest row (None while empty)."""
+        with self.lock:
+            return None if self.newest is None else self.newest - int(hours * 3600 * 1000)
+
+    def _select(self, key, since_ms, pick):
+        """
+        Columns of the rows `pick(series, lo)` chooses from each matching
+        key's window [lo, end), plus the key of each row. Only those rows are
+        copied, under the lock, since the writer may compact the arrays.
+        """
+        with self.lock:
+            if key is not None:
+                selected = [(key, self.series[key])] if key in self.series else []
+            else:
+                selected = list(self.series.items())
+            names, parts = [], []
+            for name, series in selected:
+                lo = series.start if since_ms is None else series.position(since_ms)
+                index = pick(series, lo)
+                if len(index):
+                    names.append(name)
+                    parts.append((series.time[index], series.value[index],
+                                  series.score[index], series.outlier[index]))
+        if not parts:
+            return [], np.empty(0, np.intp), tuple(np.empty(0) for _ in range(4))
+        owner = np.repeat(np.arange(len(parts)), [len(part[0]) for part in parts])
+        columns = tuple(np.concatenate([part[c] for part in parts]) for c in range(4))
+        return names, owner, columns
+
+    def recent(self, since_ms: int, key: str = None, limit: int = 10000) -> list:
+        """Rows at or after `since_ms`, oldest first, at most the newest `limit`."""
+        def pick(series, lo):
+            return np.arange(max(lo, series.end - limit) if limit else lo, series.end)
+
+        names, owner, columns = self._select(key, since_ms, pick)
+        order = np.argsort(columns[0], kind='stable')
+        return self._rows(names, owner, columns, order[-limit:] if limit else order)
+
+    def lowest(self, k: int, since_ms: int = None, key: str = None) -> list:
+        """The `k` rows with the lowest Score (most anomalous first)."""
+        if k <= 0:
+            return []
+
+        def pick(series, lo):
+            # The k lowest of every key hold the k lowest overall
+            if series.end - lo <= k:
+                return np.arange(lo, series.end)
+            return lo + np.argpartition(series.score[lo:series.end], k - 1)[:k]
+
+        names, owner, columns = self._select(key, since_ms, pick)
+        times, scores = columns[0], columns[2]
+        order = np.lexsort((times, scores))[:k]
+        return self._rows(names, owner, columns, order)
+
+    def outliers(self, since_ms: int, key: str = None, limit: int = 10000) -> list:
+        """Rows flagged as outliers at or after `since_ms`, oldest first."""
+        def pick(series, lo):
+            flagged = lo + np.flatnonzero(series.outlier[lo:series.end])
+            return flagged[-limit:] if limit else flagged
+
+        names, owner, columns = self._select(key, since_ms, pick)
+        order = np.argsort(columns[0], kind='stable')
+        return self._rows(names, owner, columns, order[-limit:] if limit else order)
+
+    @staticmethod
+    def _rows(names, owner, columns, order) -> list:
+        times, values, scores, flags = columns
+        return [{
+            'key': names[owner[i]],
+            'timestamp_ms': int(times[i]),
+            'timestamp': format_time(int(times[i])),
+            'value': float(values[i]),
+            'Score': float(scores[i]),
+            'Outliers': 1.0 if flags[i] else 0.0,
+        } for i in order.tolist()]
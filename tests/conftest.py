@@ -0,0 +1,14 @@
+"""
+The services import `common` from the repository root and their own modules
+from their directory; the tests see the same paths, plus benchmark/ for the
+InfluxDB and Kafka stand-ins in fakes.py.
+"""
+import os
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (REPO, os.path.join(REPO, "benchmark"), os.path.join(REPO, "subscribe_ml"),
+             os.path.join(REPO, "publish_csv_kafka"), os.path.join(REPO, "subscribe_view"),
+             os.path.join(REPO, "subscribe_to_influx"), os.path.join(REPO, "subscribe_rollup")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,61 @@
+"""The bulk loader's vectorized line protocol against `Point`, as the streaming sink writes it."""
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+from influxdb_client import Point
+
+from bulk_load import csv_chunks, encode_lines, parse_args, run
+from conftest import REPO
+
+CSV = os.path.join(REPO, "demo_data", "nyc_taxi.csv")
+
+
+def point_lines(measurement: str, timestamps_ms, values) -> list:
+    """What subscribe_to_influx's process_event writes for each event, without the rows Point drops."""
+    lines = (Point(measurement).field("value", value)
+             .time(datetime.fromtimestamp(timestamp_ms / 1000.0, tz=timezone.utc)).to_line_protocol()
+             for timestamp_ms, value in zip(timestamps_ms, values))
+    return [line for line in lines if line]
+
+
+TIMESTAMPS_MS = [1404172800000 + i * 1800000 for i in range(8)]
+
+
+@pytest.mark.parametrize("values", [
+    np.array([10844, 0, -3, 2 ** 40, 7, 8, 9, 10], dtype=np.int64),
+    np.array([10844.0, 0.1, -2.5, 1e20, 1e-7, np.nan, np.inf, -np.inf]),
+    np.array([True, False, True, True, False, False, True, False]),
+    pd.Series([10844, 0.5, "N/A", True, None, 3, "x y", -1.0], dtype=object),
+])
+@pytest.mark.parametrize("measurement", ["event-frames-model", "taxi demand,nyc"])
+def test_encode_lines_matches_point(measurement, values):
+    expected = point_lines(measurement, TIMESTAMPS_MS, pd.Series(values).tolist())
+    assert encode_lines(measurement, TIMESTAMPS_MS, values) == expected
+
+
+def test_csv_chunks_match_point_for_the_demo_data():
+    history = pd.read_csv(CSV, parse_dates=['timestamp'])
+    timestamps_ms = [int(ts.timestamp() * 1000) for ts in history['timestamp'].dt.tz_localize('UTC')]
+    expected = point_lines("event-frames-model", timestamps_ms, history['value'].tolist())
+
+    lines, position = [], 0
+    for chunk_timestamps_ms, values, position in csv_chunks(CSV, chunk_size=4000):
+        lines += encode_lines("event-frames-model", chunk_timestamps_ms, values)
+    assert position == len(history)
+    assert lines == expected
+
+
+def test_output_resumes_from_the_checkpoint_position(tmp_path):
+    whole, tail = tmp_path / "whole.lp", tmp_path / "tail.lp"
+    run(parse_args(["--source", CSV, "--measurement", "m", "--output", str(whole)]))
+    lines = whole.read_text().splitlines()
+
+    checkpoint = tmp_path / "nyc.ckpt"
+    checkpoint.write_text('{"source": "%s", "position": 1000}' % CSV)
+    totals = run(parse_args(["--source", CSV, "--measurement", "m", "--output", str(tail),
+                             "--checkpoint", str(checkpoint)]))
+    assert totals['lines'] == len(lines) - 1000
+    assert tail.read_text().splitlines() == lines[1000:]
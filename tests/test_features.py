@@ -0,0 +1,84 @@
+"""FeatureState against the pandas buffer it replaced and the vectorized training features."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import REPO
+from features import BASELINE_COLUMNS, FEATURE_COLUMNS, Baseline, FeatureState, feature_frame
+
+
+@pytest.fixture(scope="module")
+def history():
+    return pd.read_csv(os.path.join(REPO, "demo_data", "nyc_taxi.csv"), parse_dates=['timestamp'])
+
+
+def streamed(history: pd.DataFrame, baseline: Baseline = None) -> np.ndarray:
+    """Features of every event with a Lag, as serving builds them from the published messages."""
+    state, rows = FeatureState(), []
+    for timestamp, value in zip(history['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S'), history['value'].tolist()):
+        _, row_features = state.update({'timestamp': timestamp, 'value': value}, baseline)
+        if row_features is not None:
+            rows.append(row_features)
+    return np.asarray(rows, dtype=np.float64)
+
+
+def test_feature_frame_matches_feature_state(history):
+    features = feature_frame(history)
+    assert len(features) == len(history) - 1
+    np.testing.assert_allclose(features[FEATURE_COLUMNS].to_numpy(dtype=np.float64), streamed(history),
+                               rtol=0, atol=1e-9)
+
+
+def test_baseline_columns_match_feature_state(history):
+    features = feature_frame(history)
+    baseline = Baseline.fit(features)
+    columns = FEATURE_COLUMNS + BASELINE_COLUMNS
+    np.testing.assert_allclose(baseline.apply(features)[columns].to_numpy(dtype=np.float64),
+                               streamed(history, baseline), rtol=0, atol=1e-9)
+
+
+def pandas_buffer(rows: list, buffer_size: int = 20) -> list:
+    """The features the original handle_message built with a pandas buffer; None where it skipped the row."""
+    buffer, out = [], []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) > buffer_size:
+            buffer.pop(0)
+        df = pd.DataFrame(buffer)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df['Hour'] = df['timestamp'].dt.hour
+        df['Day'] = df['timestamp'].dt.weekday
+        df['Month'] = df['timestamp'].dt.month
+        df['Month_day'] = df['timestamp'].dt.day
+        df['Lag'] = df['value'].shift(1)
+        df['Rolling_Mean'] = df['value'].rolling(window=7, min_periods=1).mean()
+        current = pd.DataFrame([df.iloc[-1].to_dict()])[FEATURE_COLUMNS].dropna()
+        out.append(None if current.empty else current.iloc[0].astype('float64').tolist())
+    return out
+
+
+def test_feature_state_matches_the_pandas_buffer_with_missing_values(history):
+    rows = [{'timestamp': timestamp, 'value': value} for timestamp, value in
+            zip(history['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')[:200], history['value'].astype(float)[:200])]
+    # A lone gap, two in a row, and a whole window of them
+    for i in [10, 40, 41, *range(100, 108)]:
+        rows[i]['value'] = np.nan
+    rows[60]['value'] = None
+    state = FeatureState()
+    got_features = [state.update(row)[1] for row in rows]
+    expected = pandas_buffer(rows)
+    assert [features is None for features in got_features] == [features is None for features in expected]
+    for got, want in zip(got_features, expected):
+        if want is not None:
+            np.testing.assert_allclose(got, want, rtol=0, atol=1e-9)
+
+
+def test_missing_values_are_skipped_by_the_vectorized_features(history):
+    gappy = history.head(200).assign(value=history['value'].head(200).astype(float))
+    gappy.loc[[10, 40, 41, 60], 'value'] = np.nan
+    features = feature_frame(gappy)
+    assert not features.isna().any().any()
+    np.testing.assert_allclose(features[FEATURE_COLUMNS].to_numpy(dtype=np.float64), streamed(gappy),
+                               rtol=0, atol=1e-9)
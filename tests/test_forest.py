@@ -0,0 +1,60 @@
+"""The compiled forest against sklearn's IsolationForest it was flattened from."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import IsolationForest
+
+from conftest import REPO
+from features import FEATURE_COLUMNS, feature_frame
+from forest import CompiledForest
+
+
+@pytest.fixture(scope="module")
+def features():
+    history = pd.read_csv(os.path.join(REPO, "demo_data", "nyc_taxi.csv"), parse_dates=['timestamp'])
+    return feature_frame(history)[FEATURE_COLUMNS]
+
+
+@pytest.fixture(scope="module")
+def model(features):
+    return IsolationForest(random_state=0, contamination=0.005, n_estimators=50, max_samples=0.7).fit(features)
+
+
+def with_missing_values(features: pd.DataFrame) -> pd.DataFrame:
+    """Rows with one, two and every feature missing."""
+    gappy = features.head(300).copy()
+    rng = np.random.default_rng(0)
+    for i in range(len(gappy)):
+        columns = rng.choice(len(FEATURE_COLUMNS), size=1 + i % len(FEATURE_COLUMNS), replace=False)
+        gappy.iloc[i, columns] = np.nan
+    return gappy
+
+
+def assert_same_scores(model, compiled, X: pd.DataFrame):
+    np.testing.assert_array_equal(compiled.decision_function(X), model.decision_function(X))
+    np.testing.assert_array_equal(compiled.predict(X), model.predict(X))
+
+
+def test_compiled_forest_matches_sklearn(model, features):
+    assert_same_scores(model, CompiledForest.from_sklearn(model), features)
+
+
+def test_missing_values_follow_sklearn(model, features):
+    assert_same_scores(model, CompiledForest.from_sklearn(model), with_missing_values(features))
+
+
+@pytest.mark.parametrize("suffix", [".forest", ".npz"])
+def test_saved_forest_keeps_missing_value_routing(model, features, tmp_path, suffix):
+    path = str(tmp_path / f"model{suffix}")
+    CompiledForest.from_sklearn(model).save(path)
+    assert_same_scores(model, CompiledForest.load(path), with_missing_values(features))
+
+
+def test_old_export_refuses_missing_values(model, features):
+    compiled = CompiledForest.from_sklearn(model)
+    compiled.missing_right = None
+    assert_same_scores(model, compiled, features)
+    with pytest.raises(ValueError):
+        compiled.decision_function(with_missing_values(features))
@@ -0,0 +1,108 @@
+"""Series routing and failover of the sharded InfluxDB writer, against fake write endpoints."""
+import contextlib
+
+import pytest
+
+import fakes
+from common.influx_router import HashRing, InfluxShardRouter, create_influx_sink, series_key
+from common.influx_sink import InfluxBatchSink, InfluxSinkError
+from test_influx_sink import sink_classes
+
+
+def lines(n: int, start: int = 0, series: int = 50) -> list:
+    return [f"m,device=d{i % series} value={i} {i}" for i in range(start, start + n)]
+
+
+@pytest.fixture
+def influx_nodes():
+    with contextlib.ExitStack() as stack:
+        yield [stack.enter_context(fakes.FakeInfluxServer()) for _ in range(3)]
+
+
+def router(nodes, sink_class, **kwargs):
+    return InfluxShardRouter([node.url for node in nodes], token='t', org='o', bucket='b', sink_class=sink_class,
+                             batch_size=10, retry_interval_ms=1, max_retries=1, failover_cooldown_ms=60000,
+                             **kwargs)
+
+
+def write(sink, records: list, first_offset: int = 0) -> list:
+    for offset, line in enumerate(records, first_offset):
+        sink.add(line)
+        sink.track('events', 0, offset)
+    return sink.flush()
+
+
+def test_series_key_stops_at_the_first_unescaped_space():
+    assert series_key("m,device=d1 value=1 5") == "m,device=d1"
+    assert series_key(r"m,device=a\ b value=1") == r"m,device=a\ b"
+    assert series_key("m") == "m"
+
+
+def test_hash_ring_preference_is_stable_and_moves_few_series():
+    keys = [f"m,device=d{i}" for i in range(2000)]
+    ring = HashRing(['a', 'b', 'c'])
+    for key in keys[:50]:
+        assert sorted(ring.preference(key)) == [0, 1, 2]
+        assert ring.preference(key) == HashRing(['a', 'b', 'c']).preference(key)
+    # A fourth node takes over about a quarter of the series, the others keep their owner
+    grown = HashRing(['a', 'b', 'c', 'd'])
+    moved = [key for key in keys if grown.preference(key)[0] != ring.preference(key)[0]]
+    assert all(grown.preference(key)[0] == 3 for key in moved)
+    assert 0.1 < len(moved) / len(keys) < 0.4
+
+
+def test_create_influx_sink_picks_a_sink_or_a_router(influx_nodes):
+    single = create_influx_sink(influx_nodes[0].url, token='t', org='o', bucket='b')
+    sharded = create_influx_sink(','.join(node.url for node in influx_nodes[:2]), token='t', org='o', bucket='b')
+    try:
+        assert type(single) is InfluxBatchSink
+        assert isinstance(sharded, InfluxShardRouter) and len(sharded.nodes) == 2
+    finally:
+        single.close()
+        sharded.close()
+    with pytest.raises(ValueError):
+        create_influx_sink(influx_nodes[0].url, token='t', org='o', bucket='b', writer='threads')
+
+
+@pytest.mark.parametrize("sink_class", sink_classes())
+def test_records_are_sharded_by_series(influx_nodes, sink_class):
+    sink = router(influx_nodes, sink_class, replication=2)
+    try:
+        offsets = write(sink, lines(300))
+        assert [(tp.topic, tp.partition, tp.offset) for tp in offsets] == [('events', 0, 300)]
+        points = [node.stats()['points'] for node in influx_nodes]
+        assert sum(points) == 600
+        assert all(points)
+    finally:
+        sink.close()
+
+
+@pytest.mark.parametrize("sink_class", sink_classes())
+def test_failed_node_is_re_routed_without_duplicates(influx_nodes, sink_class):
+    sink = router(influx_nodes, sink_class)
+    try:
+        influx_nodes[0].fail(503, count=1000)
+        offsets = write(sink, lines(300))
+        assert [tp.offset for tp in offsets] == [300]
+        assert not sink.nodes[0].healthy
+        # Every record written exactly once, by the two nodes left
+        assert influx_nodes[1].stats()['points'] + influx_nodes[2].stats()['points'] == 300
+
+        # The down node gets no new records while it cools down
+        offsets = write(sink, lines(100, 300), first_offset=300)
+        assert [tp.offset for tp in offsets] == [400]
+        assert influx_nodes[1].stats()['points'] + influx_nodes[2].stats()['points'] == 400
+    finally:
+        sink.close()
+
+
+def test_record_without_a_healthy_node_fails_the_router(influx_nodes):
+    sink = router(influx_nodes[:2], InfluxBatchSink)
+    try:
+        for node in influx_nodes[:2]:
+            node.fail(503, count=1000)
+        with pytest.raises(InfluxSinkError):
+            write(sink, lines(100))
+    finally:
+        for node in sink.nodes:
+            node.close()
@@ -0,0 +1,101 @@
+"""InfluxDB sink behaviour on refused data, against the fake write endpoint."""
+import time
+
+import pytest
+
+import fakes
+from common.influx_sink import InfluxBatchSink, InfluxSinkError
+
+
+def lines(n: int, start: int = 0) -> list:
+    return [f"m,device=d{i % 5} value={i} {i}" for i in range(start, start + n)]
+
+
+def sink_classes():
+    classes = [InfluxBatchSink]
+    try:
+        from common.influx_async import AsyncInfluxBatchSink
+        classes.append(AsyncInfluxBatchSink)
+    except ImportError:
+        pass
+    return classes
+
+
+@pytest.fixture
+def influx():
+    with fakes.FakeInfluxServer() as server:
+        yield server
+
+
+def write(sink, records: list, first_offset: int = 0) -> list:
+    for offset, line in enumerate(records, first_offset):
+        sink.add(line)
+        sink.track('events', 0, offset)
+    return sink.flush()
+
+
+@pytest.mark.parametrize("sink_class", sink_classes())
+@pytest.mark.parametrize("status", [400, 422])
+def test_rejected_batch_is_dropped_and_its_offsets_released(influx, sink_class, status):
+    sink = sink_class(url=influx.url, token='t', org='o', bucket='b', batch_size=10, retry_interval_ms=1)
+    try:
+        influx.fail(status)
+        offsets = write(sink, lines(10))
+        assert [(tp.topic, tp.partition, tp.offset) for tp in offsets] == [('events', 0, 10)]
+        assert sink.healthy
+
+        # The consumer goes on: the next batch is written and committed
+        offsets = write(sink, lines(10, 10), first_offset=10)
+        assert [tp.offset for tp in offsets] == [20]
+        assert influx.stats()['points'] == 10
+    finally:
+        sink.close()
+
+
+@pytest.mark.parametrize("sink_class", sink_classes())
+def test_unauthorized_fails_the_sink(influx, sink_class):
+    sink = sink_class(url=influx.url, token='t', org='o', bucket='b', batch_size=10, retry_interval_ms=1)
+    influx.fail(401)
+    with pytest.raises(InfluxSinkError):
+        write(sink, lines(10))
+
+
+@pytest.mark.parametrize("sink_class", sink_classes())
+def test_failover_hands_each_failed_batch_back_once(influx, sink_class):
+    sink = sink_class(url=influx.url, token='t', org='o', bucket='b', batch_size=10, retry_interval_ms=1,
+                      max_retries=1, failover=True, failover_cooldown_ms=60000)
+    try:
+        influx.fail(503, count=3)
+        write(sink, lines(30))
+        failed = sink.take_failed()
+        # The first batch failed, the ones behind it failed too or came back during the cooldown
+        assert len({id(batch) for batch in failed}) == len(failed)
+        assert [batch.lines for batch in failed if batch.lines] == [lines(10), lines(10, 10), lines(10, 20)]
+        assert not sink.healthy
+        sink.flush()
+        assert sink.take_failed() == []
+        assert influx.stats()['points'] == 0
+    finally:
+        sink.close()
+
+
+def test_retry_after_is_waited_beyond_the_backoff_cap(influx, monkeypatch):
+    influx_async = pytest.importorskip("common.influx_async")
+    monkeypatch.setattr(influx_async, 'MAX_RETRY_DELAY', 0.01)
+    monkeypatch.setattr(influx_async, 'MAX_RETRY_AFTER', 0.6)
+    sink = influx_async.AsyncInfluxBatchSink(url=influx.url, token='t', org='o', bucket='b', batch_size=10,
+                                             retry_interval_ms=1)
+    try:
+        # Asked for 0.3 s: honoured although the backoff itself stops at 10 ms
+        influx.fail(503, retry_after=0.3)
+        started = time.monotonic()
+        write(sink, lines(10))
+        assert time.monotonic() - started >= 0.3
+        # Asked for 100 s: waits MAX_RETRY_AFTER
+        influx.fail(429, retry_after=100)
+        started = time.monotonic()
+        write(sink, lines(10, 10), first_offset=10)
+        assert 0.6 <= time.monotonic() - started < 5
+        assert influx.stats()['points'] == 20
+    finally:
+        sink.close()
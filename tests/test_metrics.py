@@ -0,0 +1,47 @@
+"""LagTracker with fake consumers and a librdkafka statistics payload."""
+import json
+
+from confluent_kafka import TopicPartition
+
+from common.metrics import CONSUMER_LAG, LagTracker
+
+
+def lag(topic: str, partition: int) -> float:
+    return CONSUMER_LAG.labels(topic, str(partition))._value.get()
+
+
+class CachedOnlyConsumer:
+    """Answers watermarks from its cache only, like a consumer whose broker is unreachable."""
+
+    def assignment(self):
+        return [TopicPartition('lag-poll', 0), TopicPartition('lag-poll', 1)]
+
+    def position(self, partitions):
+        return [TopicPartition(tp.topic, tp.partition, 40) for tp in partitions]
+
+    def get_watermark_offsets(self, tp, timeout=None, cached=False):
+        assert cached, "a lag update must not wait on the broker"
+        return (0, 100) if tp.partition == 0 else (-1001, -1001)
+
+
+def test_update_reads_cached_watermarks():
+    LagTracker().update(CachedOnlyConsumer())
+    assert lag('lag-poll', 0) == 60
+    # No cached watermark yet: the partition is left alone
+    assert lag('lag-poll', 1) == 0
+
+
+def test_statistics_set_the_lag_of_assigned_partitions():
+    tracker = LagTracker(interval=2.5)
+    config = tracker.consumer_config()
+    assert config['statistics.interval.ms'] == 2500
+    config['stats_cb'](json.dumps({'topics': {'lag-stats': {'partitions': {
+        '0': {'consumer_lag': 7},
+        '1': {'consumer_lag': -1},
+        '-1': {'consumer_lag': 99},
+    }}}}))
+    assert lag('lag-stats', 0) == 7
+    assert lag('lag-stats', 1) == 0
+    assert lag('lag-stats', -1) == 0
+    # A malformed payload is ignored
+    tracker.on_statistics("not json")
@@ -0,0 +1,28 @@
+"""OnlineDetector state updates on rows the features let through, and on ones they should not."""
+import math
+
+from features import FeatureState
+from online import OnlineDetector
+
+
+def row(value: float, level: float = 100.0) -> dict:
+    return {'value': value, 'value_Average': level}
+
+
+def test_missing_value_leaves_the_detector_state_alone():
+    detector, state = OnlineDetector("online", warmup=3), FeatureState()
+    for value in [100.0, 105.0, 95.0, 102.0, 98.0]:
+        detector.update(state, row(value))
+    before = list(state.detector)
+    assert detector.update(state, row(math.nan)) is None
+    assert detector.update(state, row(100.0, level=math.nan)) is None
+    assert state.detector == before
+    # The key still flags afterwards
+    assert detector.update(state, row(1000.0)) >= detector.threshold
+
+
+def test_poisoned_state_starts_over():
+    detector, state = OnlineDetector("online", warmup=1), FeatureState()
+    state.detector = [math.nan, math.nan, 50]
+    assert detector.update(state, row(100.0)) is None
+    assert state.detector == [0.0, 0.0, 1]
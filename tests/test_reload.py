@@ -0,0 +1,40 @@
+"""ModelReloader's file watch, with a loader that only records what it was asked to load."""
+import os
+import time
+
+from reload import ModelReloader
+
+
+def wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def promoted(reloader):
+    """The next candidate, swapped in right away (shadow_rows=0)."""
+    assert wait_for(lambda: reloader._ready is not None)
+    return reloader.promote()
+
+
+def test_watch_keeps_following_the_model_path_after_a_control_reload(tmp_path):
+    watched, versioned = tmp_path / "model.joblib", tmp_path / "model-20240101T000000Z.joblib"
+    watched.write_bytes(b"v1")
+    versioned.write_bytes(b"v2")
+    reloader = ModelReloader(lambda path: (path, None), str(watched), interval=0.02, shadow_rows=0).start()
+    try:
+        reloader.request(str(versioned))
+        assert promoted(reloader).path == str(versioned)
+        assert reloader.path == str(watched)
+        assert reloader.live_path == str(versioned)
+
+        # train.py writes a new version at the model path
+        watched.write_bytes(b"v3-longer")
+        os.utime(watched, ns=(time.time_ns(), time.time_ns()))
+        assert promoted(reloader).path == str(watched)
+        assert reloader.live_path == str(watched)
+    finally:
+        reloader.stop()
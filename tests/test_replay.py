@@ -0,0 +1,21 @@
+"""The publisher's vectorized JSON payloads against json.dumps of the same rows."""
+import json
+
+import numpy as np
+import pandas as pd
+
+from replay import build_payloads
+
+
+def test_json_payloads_match_json_dumps_including_missing_values():
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(['2014-07-01 00:00:00', '2014-07-01 00:30:00',
+                                     '2014-07-01 01:00:00', '2014-07-01 01:30:00']),
+        'value': [10844.0, np.nan, 0.1, np.inf],
+    })
+    payloads, timestamps_ms = build_payloads(df)
+    for payload, (timestamp, value), timestamp_ms in zip(payloads, df.itertuples(index=False), timestamps_ms):
+        expected = json.dumps({'timestamp': timestamp.strftime('%Y-%m-%d %H:%M:%S'), 'value': value,
+                               'timestamp_ms': timestamp_ms})
+        assert payload.decode('utf-8') == expected
+        json.loads(payload)
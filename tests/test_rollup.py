@@ -0,0 +1,89 @@
+"""Rollup windows as Quix Streams assigns them, against the notebook's pandas resample bins."""
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+from quixstreams.dataframe.windows.base import get_window_ranges
+
+from conftest import REPO
+from rollup import DAY_MS, HOUR_MS, ROLLUPS, WEEK_MS, rollup_input, rollup_line
+
+# Pandas bins are labelled by their right edge for "W" (the Sunday), by their start otherwise
+RESAMPLE = {"1h": ("h", pd.Timedelta(0)), "1d": ("D", pd.Timedelta(0)), "1w": ("W", pd.Timedelta(days=6))}
+
+
+def ms(text: str) -> int:
+    return int(datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def window_start(timestamp_ms: int, duration_ms: int, shift_ms: int) -> int:
+    """The start of the tumbling window build_rollups puts an event in, in event time."""
+    [(start, _)] = get_window_ranges(timestamp_ms - shift_ms, duration_ms)
+    return start + shift_ms
+
+
+def rollup_windows(window: str, timestamps_ms: list, rows: list) -> dict:
+    """{window start ms: result} for one entry of ROLLUPS, aggregated like its Quix window."""
+    _, duration_ms, shift_ms = next(rollup for rollup in ROLLUPS if rollup[0] == window)
+    windows = {}
+    for timestamp_ms, row in zip(timestamps_ms, rows):
+        value = rollup_input(row)
+        windows.setdefault(window_start(timestamp_ms, duration_ms, shift_ms), []).append(value)
+    return {start: {'mean': sum(v['value'] for v in values) / len(values),
+                    'min': min(v['value'] for v in values), 'max': max(v['value'] for v in values),
+                    'count': len(values), 'anomalies': sum(v['anomaly'] for v in values)}
+            for start, values in windows.items()}
+
+
+@pytest.mark.parametrize("window, event, start", [
+    ("1h", "2014-07-07 13:00:00", "2014-07-07 13:00:00"),
+    ("1h", "2014-07-07 13:59:59.999", "2014-07-07 13:00:00"),
+    ("1d", "2014-07-07 00:00:00", "2014-07-07 00:00:00"),
+    ("1d", "2014-07-06 23:59:59.999", "2014-07-06 00:00:00"),
+    # 2014-07-07 is a Monday: the week starts at its midnight, Sunday's last millisecond is the week before
+    ("1w", "2014-07-07 00:00:00", "2014-07-07 00:00:00"),
+    ("1w", "2014-07-06 23:59:59.999", "2014-06-30 00:00:00"),
+    ("1w", "2014-07-13 23:30:00", "2014-07-07 00:00:00"),
+    ("1w", "1970-01-05 00:00:00", "1970-01-05 00:00:00"),
+])
+def test_window_boundaries(window, event, start):
+    _, duration_ms, shift_ms = next(rollup for rollup in ROLLUPS if rollup[0] == window)
+    assert window_start(ms(event), duration_ms, shift_ms) == ms(start)
+
+
+def test_weekly_windows_start_on_monday():
+    _, duration_ms, shift_ms = ROLLUPS[-1]
+    assert duration_ms == WEEK_MS
+    for day in range(14):
+        start = window_start(ms("2014-07-01 12:00:00") + day * DAY_MS, duration_ms, shift_ms)
+        assert datetime.fromtimestamp(start / 1000, tz=timezone.utc).strftime('%A %H:%M') == 'Monday 00:00'
+
+
+@pytest.mark.parametrize("window", [rollup[0] for rollup in ROLLUPS])
+def test_windows_match_pandas_resample(window):
+    history = pd.read_csv(os.path.join(REPO, "demo_data", "nyc_taxi.csv"), parse_dates=['timestamp']).head(3000)
+    history['Outliers'] = (history.index % 97 == 0).astype(float)
+    timestamps_ms = [int(ts.timestamp() * 1000) for ts in history['timestamp'].dt.tz_localize('UTC')]
+    got = rollup_windows(window, timestamps_ms, history[['value', 'Outliers']].to_dict('records'))
+
+    rule, label_offset = RESAMPLE[window]
+    resampled = history.set_index('timestamp').resample(rule)
+    expected = pd.DataFrame({'mean': resampled['value'].mean(), 'min': resampled['value'].min(),
+                             'max': resampled['value'].max(), 'count': resampled['value'].count(),
+                             'anomalies': resampled['Outliers'].sum()}).query('count > 0')
+    expected.index = expected.index - label_offset
+    assert sorted(got) == [int(ts.tz_localize('UTC').timestamp() * 1000) for ts in expected.index]
+    for start, (_, row) in zip(sorted(got), expected.iterrows()):
+        assert got[start]['count'] == row['count'] and got[start]['anomalies'] == row['anomalies']
+        assert got[start]['min'] == row['min'] and got[start]['max'] == row['max']
+        assert got[start]['mean'] == pytest.approx(row['mean'], rel=1e-12)
+
+
+def test_rollup_line_is_stamped_with_the_unshifted_window_start():
+    result = {'start': ms("2014-07-07 00:00:00") - 4 * DAY_MS, 'end': 0, 'mean': 1.5, 'min': 1, 'max': 2,
+              'count': 2, 'anomalies': 1}
+    line = rollup_line("rollup", "1w", b"taxi", result, shift_ms=4 * DAY_MS)
+    assert line == ("rollup,key=taxi,window=1w anomalies=1i,count=2i,max=2,mean=1.5,min=1 "
+                    f"{ms('2014-07-07 00:00:00') * 1_000_000}")
+    assert ",key=unknown," in rollup_line("rollup", "1h", None, {**result, 'start': HOUR_MS})
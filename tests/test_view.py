@@ -0,0 +1,25 @@
+"""MaterializedView's memory budget: allocated arrays, not just live rows."""
+from view import MIN_CAPACITY, ROW_BYTES, SPARE, MaterializedView
+
+
+def add(view, key: str, timestamp_ms: int):
+    view.add(key, {'timestamp_ms': timestamp_ms, 'value': 1.0, 'Score': 0.1, 'Outliers': 0.0})
+
+
+def test_allocated_arrays_stay_within_the_row_budget():
+    view = MaterializedView(retention_ms=10**12, max_rows=5000)
+    for i in range(60000):
+        # Many keys first, then a few: the keys left behind are evicted, not appended to
+        add(view, f"k{i % (20 if i < 30000 else 3)}", i * 1000)
+        if i % 500 == 0:
+            stats = view.stats()
+            assert stats['rows'] <= 5000
+            assert stats['bytes'] <= (stats['rows'] * SPARE + stats['keys'] * MIN_CAPACITY) * ROW_BYTES
+
+
+def test_retention_compacts_a_series():
+    view = MaterializedView(retention_ms=100 * 1000, max_rows=10**6)
+    for i in range(10000):
+        add(view, "k", i * 1000)
+    assert view.stats()['rows'] == 101
+    assert view.stats()['bytes'] <= max(MIN_CAPACITY, SPARE * 101) * ROW_BYTES
@@ -0,0 +1,122 @@
+"""Binary and JSON wire messages: every schema against json.dumps of the same row."""
+import datetime
+import json
+import struct
+
+import numpy as np
+import pytest
+from quixstreams.models.serializers import SerializationContext, SerializationError
+
+from common.wire import (ANOMALY, BINARY_FORMAT, EVENT, JSON_FORMAT, MAGIC, SCHEMAS, WireDeserializer,
+                         WireSerializer, decode, encode, encode_events)
+
+TIMESTAMP_MS = 1404172800000 + 5 * 86400000 + 13 * 3600000 + 30 * 60000  # Sun 2014-07-06 13:30:00 UTC
+CTX = SerializationContext(topic='events', field='value')
+
+
+def event(value, timestamp_ms: int = TIMESTAMP_MS) -> dict:
+    ts = datetime.datetime.fromtimestamp(timestamp_ms // 1000, datetime.timezone.utc)
+    return {'timestamp_ms': timestamp_ms, 'value': value, 'timestamp': ts.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def anomaly(value, baseline: bool = False, score: float = -0.05) -> dict:
+    row = event(value)
+    ts = datetime.datetime.fromtimestamp(TIMESTAMP_MS // 1000, datetime.timezone.utc)
+    row.update({'Weekday': ts.strftime('%A'), 'Hour': ts.hour, 'Day': ts.weekday(), 'Month': ts.month,
+                'Year': ts.year, 'Month_day': ts.day, 'Lag': 10844.0, 'Rolling_Mean': 9500.5,
+                'Outliers': 1.0, 'Score': score})
+    if baseline:
+        row.update({'value_Average': 12000.25, 'Deviation': -0.12})
+    return row
+
+
+def as_json(row: dict) -> str:
+    """Canonical JSON, so NaN compares equal to NaN."""
+    return json.dumps(row, sort_keys=True)
+
+
+@pytest.mark.parametrize("schema_id, topic, row", [
+    (1, EVENT, event(10844)),
+    (2, EVENT, event(10844.5)),
+    (3, ANOMALY, anomaly(10844)),
+    (4, ANOMALY, anomaly(10844.5)),
+    (5, ANOMALY, anomaly(10844, baseline=True)),
+    (6, ANOMALY, anomaly(10844.5, baseline=True)),
+])
+def test_binary_round_trip_per_schema(schema_id, topic, row):
+    data = encode(row, topic, BINARY_FORMAT)
+    assert data[0] == MAGIC and data[1] == schema_id
+    assert len(data) == SCHEMAS[schema_id].size
+    assert as_json(decode(data)) == as_json(json.loads(json.dumps(row)))
+    assert decode(data).keys() == row.keys()
+
+
+@pytest.mark.parametrize("topic, row", [
+    (EVENT, event(float('nan'))),
+    (ANOMALY, anomaly(float('nan'), score=float('nan'))),
+    (ANOMALY, anomaly(10844.5, baseline=True, score=float('inf'))),
+])
+def test_non_finite_floats_survive_the_binary_format(topic, row):
+    data = encode(row, topic, BINARY_FORMAT)
+    assert data[0] == MAGIC
+    assert as_json(decode(data)) == as_json(row)
+
+
+@pytest.mark.parametrize("topic, row", [
+    (EVENT, event(None)),
+    (EVENT, {**event(10844), 'device': 'd1'}),
+    (EVENT, {'timestamp_ms': TIMESTAMP_MS, 'value': 10844}),
+    (EVENT, event(True)),
+    (ANOMALY, {**anomaly(10844), 'Lag': None}),
+    (ANOMALY, event(10844)),
+])
+def test_rows_without_a_schema_fall_back_to_json(topic, row):
+    data = encode(row, topic, BINARY_FORMAT)
+    assert data == json.dumps(row).encode('utf-8')
+    assert decode(data) == row
+
+
+@pytest.mark.parametrize("row", [event(10844), event(None), anomaly(10844.5, baseline=True)])
+def test_json_format_is_plain_json(row):
+    assert encode(row, ANOMALY if 'Score' in row else EVENT, JSON_FORMAT) == json.dumps(row).encode('utf-8')
+
+
+@pytest.mark.parametrize("data", [
+    bytes([MAGIC]),
+    bytes([MAGIC, 99]) + bytes(16),
+    encode(event(10844), EVENT, BINARY_FORMAT)[:-1],
+    b'',
+    b'not json',
+])
+def test_decode_rejects_truncated_or_unknown_messages(data):
+    with pytest.raises(ValueError):
+        decode(data)
+
+
+@pytest.mark.parametrize("values", [
+    np.array([10844, 0, -3, 2 ** 40], dtype=np.int64),
+    np.array([10844.5, float('nan'), 0.1, float('inf')]),
+])
+def test_encode_events_matches_encode(values):
+    timestamps_ms = np.array([TIMESTAMP_MS + i * 1800000 for i in range(len(values))], dtype=np.int64)
+    messages = encode_events(timestamps_ms, values)
+    expected = [encode(event(value, int(ts)), EVENT, BINARY_FORMAT)
+                for ts, value in zip(timestamps_ms.tolist(), values.tolist())]
+    assert messages == expected
+
+
+def test_serializer_pair_round_trips_both_formats():
+    deserializer = WireDeserializer()
+    for wire_format in (JSON_FORMAT, BINARY_FORMAT):
+        serializer = WireSerializer(ANOMALY, wire_format)
+        for row in (anomaly(10844), anomaly(10844.5, baseline=True), {'note': 'not an anomaly row'}):
+            assert deserializer(serializer(row, CTX), CTX) == row
+
+
+def test_serializer_pair_raises_serialization_errors():
+    with pytest.raises(SerializationError):
+        WireSerializer(EVENT, BINARY_FORMAT)({'value': object()}, CTX)
+    with pytest.raises(SerializationError):
+        WireDeserializer()(bytes([MAGIC, 1]) + struct.pack('<q', TIMESTAMP_MS), CTX)
+    with pytest.raises(SerializationError):
+        WireDeserializer()(b'{"value": ', CTX)